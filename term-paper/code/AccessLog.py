@@ -0,0 +1,54 @@
+import csv
+import threading
+import time
+from collections import Counter
+
+
+# Append-only log of the customers served by the read path, one "epoch seconds,CustomerID" line per read. Lines
+# are buffered and written every flush_every reads, so logging costs no I/O on the request path.
+class AccessLog:
+    def __init__(self, path, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def record(self, customer_id):
+        with self._lock:
+            self._pending.append(f"{time.time():.3f},{customer_id}\n")
+            self.recorded += 1
+            if len(self._pending) < self.flush_every:
+                return
+            lines, self._pending = self._pending, []
+            # Written under the lock so the lines of concurrent flushes do not interleave
+            with open(self.path, 'a') as file:
+                file.writelines(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._pending = self._pending, []
+            if lines:
+                with open(self.path, 'a') as file:
+                    file.writelines(lines)
+
+    def close(self):
+        self.flush()
+
+
+def most_accessed(path, limit, since=None):
+    # CustomerIDs of the log, most accessed first, counting only reads at or after since (epoch seconds).
+    # Ties go to the customer read most recently.
+    counts = Counter()
+    last_read = {}
+    with open(path, 'r') as file:
+        for row in csv.reader(file):
+            if len(row) != 2:
+                continue
+            read_at = float(row[0])
+            if since is not None and read_at < since:
+                continue
+            counts[row[1]] += 1
+            last_read[row[1]] = read_at
+    ranked = sorted(counts, key=lambda customer_id: (counts[customer_id], last_read[customer_id]), reverse=True)
+    return ranked[:limit] if limit else ranked
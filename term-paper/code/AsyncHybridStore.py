@@ -0,0 +1,200 @@
+import asyncio
+import asyncpg
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from HybridDatastore import address_fields, has_fields, project_item, row_to_customer_data
+from SingleFlight import AsyncSingleFlight
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def to_attribute_map(item):
+    return {key: serializer.serialize(value) for key, value in item.items()}
+
+
+def from_attribute_map(attributes):
+    return {key: deserializer.deserialize(value) for key, value in attributes.items()}
+
+
+# asyncio version of the hybrid datastore in HybridDatastore.py, with the same read-through semantics.
+# endpoint_url points the DynamoDB client at DynamoDB Local instead of AWS. With write_behind, backfills run as
+# background tasks, at most max_pending_writes at a time, beyond that a miss waits for its own backfill.
+# With an ItemCodec, items are stored in its compact format.
+class AsyncHybridStore:
+    def __init__(self, table_name, region, pg_dsn, endpoint_url=None, access_key=None, secret_key=None,
+                 session_token=None, pool_min_size=1, pool_max_size=10, max_pool_connections=10, single_flight=True,
+                 write_behind=True, max_pending_writes=1000, codec=None):
+        self.table_name = table_name
+        self.region = region
+        self.pg_dsn = pg_dsn
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.max_pool_connections = max_pool_connections
+        # Concurrent misses on the same CustomerID share one PostgreSQL fetch and backfill
+        self.single_flight = AsyncSingleFlight() if single_flight else None
+        self.write_behind = write_behind
+        self.max_pending_writes = max_pending_writes
+        self.pending_writes = set()
+        self.codec = codec
+        self.dynamodb = None
+        self.pg_pool = None
+        self._client_context = None
+
+    async def start(self):
+        self._client_context = get_session().create_client(
+            'dynamodb',
+            region_name=self.region,
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            aws_session_token=self.session_token,
+            config=AioConfig(max_pool_connections=self.max_pool_connections)
+        )
+        self.dynamodb = await self._client_context.__aenter__()
+        self.pg_pool = await asyncpg.create_pool(self.pg_dsn, min_size=self.pool_min_size, max_size=self.pool_max_size)
+        return self
+
+    async def flush(self):
+        # Waits for every queued backfill
+        while self.pending_writes:
+            await asyncio.gather(*self.pending_writes)
+
+    async def close(self):
+        await self.flush()
+        if self.pg_pool is not None:
+            await self.pg_pool.close()
+            self.pg_pool = None
+        if self._client_context is not None:
+            await self._client_context.__aexit__(None, None, None)
+            self._client_context = None
+            self.dynamodb = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def encode(self, item):
+        return self.codec.encode(item) if self.codec else item
+
+    async def insert_into_dynamodb(self, customer_data):
+        try:
+            await self.dynamodb.put_item(TableName=self.table_name, Item=to_attribute_map(self.encode(customer_data)))
+        except Exception as e:
+            print(f"Error inserting data into DynamoDB: {e}")
+
+    async def conditional_update(self, customer_id, attributes, condition, values):
+        attributes = self.encode(attributes)
+        names = {f'#a{i}': name for i, name in enumerate(attributes)}
+        if '#version' in condition:
+            names['#version'] = 'Version'
+        values = {**values, **{f':a{i}': value for i, value in enumerate(attributes.values())}}
+        try:
+            await self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={'CustomerID': {'S': customer_id}},
+                UpdateExpression="SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(attributes))),
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=to_attribute_map(values)
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"Error updating data in DynamoDB: {e}")
+            return False
+
+    async def backfill_dynamodb(self, customer_data):
+        # Same version-conditioned backfill as HybridDatastore.backfill_item
+        attributes = {key: value for key, value in customer_data.items() if key != 'CustomerID'}
+        if 'Version' in customer_data:
+            await self.conditional_update(customer_data['CustomerID'], attributes,
+                                          "attribute_not_exists(#version) OR #version < :version",
+                                          {':version': customer_data['Version']})
+        else:
+            await self.conditional_update(customer_data['CustomerID'], attributes, "attribute_not_exists(#version)", {})
+
+    async def correct_loyalty_points(self, customer_data):
+        attributes = {'LoyaltyPoints': customer_data['LoyaltyPoints']}
+        if 'Version' in customer_data:
+            await self.conditional_update(customer_data['CustomerID'], attributes,
+                                          "attribute_exists(CustomerID) AND (attribute_not_exists(#version) OR #version <= :version)",
+                                          {':version': customer_data['Version']})
+        else:
+            await self.conditional_update(customer_data['CustomerID'], attributes, "attribute_exists(CustomerID)", {})
+
+    async def get_from_dynamodb(self, customer_id, projection_expression):
+        try:
+            response = await self.dynamodb.get_item(TableName=self.table_name, Key={'CustomerID': {'S': customer_id}},
+                                                    ProjectionExpression=projection_expression)
+            if 'Item' in response:
+                response['Item'] = from_attribute_map(response['Item'])
+            return response
+        except Exception as e:
+            print(f"Error fetching data from DynamoDB: {e}")
+            return None
+
+    async def fetch_from_postgresql(self, customer_id):
+        try:
+            # asyncpg prepares and caches the statement per pooled connection
+            result = await self.pg_pool.fetchrow("SELECT * FROM customer_info WHERE customerid = $1", customer_id)
+            if result:
+                return row_to_customer_data(result)
+            else:
+                return None
+        except Exception as e:
+            print(f"Error fetching data from PostgreSQL: {e}")
+            return None
+
+    async def load_and_backfill(self, customer_id):
+        customer_data = await self.fetch_from_postgresql(customer_id)
+        if customer_data:
+            if self.write_behind and len(self.pending_writes) < self.max_pending_writes:
+                task = asyncio.create_task(self.backfill_dynamodb(customer_data))
+                self.pending_writes.add(task)
+                task.add_done_callback(self.pending_writes.discard)
+            else:
+                await self.backfill_dynamodb(customer_data)
+        return customer_data
+
+    async def get_customer_data_fields(self, customer_id, fields):
+        fields = [f'Address.{field}' if field in address_fields else field for field in fields]
+        projection_expression = self.codec.projection(fields) if self.codec else ", ".join(fields)
+
+        try:
+            response = await self.get_from_dynamodb(customer_id, projection_expression)
+            if 'Item' in response and self.codec:
+                response['Item'] = self.codec.decode(response['Item'], fields)
+            if 'Item' in response and not has_fields(response['Item'], fields):
+                # A clobbered item that lost some of the requested fields is served like a miss, as in HybridDatastore
+                del response['Item']
+            if 'Item' in response:
+                # Handle the case where the loyalty points have changed in the PostgreSQL database but not in DynamoDB
+                if 'LoyaltyPoints' in fields:
+                    customer_data = await self.fetch_from_postgresql(customer_id)
+                    if customer_data:
+                        if customer_data['LoyaltyPoints'] != response['Item']['LoyaltyPoints']:
+                            response['Item']['LoyaltyPoints'] = customer_data['LoyaltyPoints']
+                            await self.correct_loyalty_points(customer_data)
+                return response['Item']
+            else:
+                if self.single_flight is not None:
+                    customer_data = await self.single_flight.do(customer_id, lambda: self.load_and_backfill(customer_id))
+                else:
+                    customer_data = await self.load_and_backfill(customer_id)
+                if customer_data:
+                    # The row already holds every requested field, no need to read the backfilled item back
+                    return project_item(customer_data, fields)
+                else:
+                    return None
+        except Exception as e:
+            print(f"Error fetching customer data: {e}")
+            return None
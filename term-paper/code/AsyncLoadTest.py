@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import csv
+import math
+import os
+import time
+from dotenv import load_dotenv
+from prettytable import PrettyTable
+from AsyncHybridStore import AsyncHybridStore
+from HybridDatastore import flag
+from ItemCodec import ItemCodec
+
+# Concurrent load driver for the asyncio hybrid datastore. Runs against AWS, or against DynamoDB Local and a
+# local Postgres when DYNAMODB_ENDPOINT is set, e.g. DYNAMODB_ENDPOINT=http://localhost:8000 DATABASE_ENDPOINT=localhost
+local_sample_data = 'term-paper/data/customer_info_sample.csv'
+
+
+def get_customer_ids_from_csv(file_path, start, end):
+    customer_ids = []
+    with open(file_path, 'r') as file:
+        reader = csv.reader(file)
+        for i, row in enumerate(reader):
+            if i == 0 or i < start:
+                continue
+            if i > end:
+                break
+            customer_ids.append(row[0])
+    return customer_ids
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = min(max(1, math.ceil(p / 100 * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+
+async def run_level(store, customer_ids, fields, concurrency, total_requests):
+    latencies = []
+    next_request = iter(range(total_requests))
+
+    async def worker():
+        # Workers share one request counter, so a level issues exactly total_requests requests
+        for n in next_request:
+            customer_id = customer_ids[n % len(customer_ids)]
+            start = time.perf_counter()
+            await store.get_customer_data_fields(customer_id, fields)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests_per_second': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+async def delete_items(store, customer_ids):
+    # Queued backfills would otherwise land after the deletes
+    await store.flush()
+    for customer_id in customer_ids:
+        await store.dynamodb.delete_item(TableName=store.table_name, Key={'CustomerID': {'S': customer_id}})
+
+
+async def main(args):
+    customer_ids = get_customer_ids_from_csv(local_sample_data, args.start, args.end)
+    fields = args.fields.split(",")
+    store = AsyncHybridStore(env_vars["NOSQL_NAME"], env_vars["AWS_REGION"], pg_dsn, endpoint_url=dynamodb_endpoint,
+                             access_key=access_key, secret_key=secret_key, session_token=session_token,
+                             pool_min_size=1, pool_max_size=args.pool_max_size,
+                             max_pool_connections=max(args.concurrency), single_flight=not args.no_single_flight,
+                             write_behind=not args.no_write_behind, codec=ItemCodec() if args.compact else None)
+    results = PrettyTable()
+    results.field_names = ["Concurrency", "Requests/sec", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+    async with store:
+        # One untimed pass so connection setup and cache misses do not land in the first level
+        await run_level(store, customer_ids, fields, min(args.concurrency), len(customer_ids))
+        for concurrency in args.concurrency:
+            if args.cold:
+                # Coalescing only shows up when workers miss on the same customers at the same time
+                await delete_items(store, customer_ids)
+            stats = await run_level(store, customer_ids, fields, concurrency, args.requests)
+            print(f"Concurrency {concurrency}: {stats['requests_per_second']:.1f} requests/sec")
+            results.add_row([concurrency, round(stats['requests_per_second'], 1), round(stats['p50'] * 1000, 2),
+                             round(stats['p95'] * 1000, 2), round(stats['p99'] * 1000, 2)])
+    print(results)
+    if store.single_flight is not None:
+        print(f"Single-flight stats: {store.single_flight.stats}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    variable_names = ["DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_ENDPOINT", "DATABASE_NAME", "NOSQL_NAME", "AWS_REGION"]
+    assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
+    env_vars = {var: os.getenv(var) for var in variable_names}
+    dynamodb_endpoint = os.getenv("DYNAMODB_ENDPOINT")
+    if not dynamodb_endpoint:
+        assert all(os.getenv(var) for var in ["ACCESS_KEY", "SECRET_KEY", "SESSION_TOKEN"]), "AWS credentials are missing or empty"
+    # DynamoDB Local accepts any credentials
+    access_key = os.getenv("ACCESS_KEY", "local")
+    secret_key = os.getenv("SECRET_KEY", "local")
+    session_token = os.getenv("SESSION_TOKEN")
+    pg_dsn = (f"postgresql://{env_vars['DATABASE_USERNAME']}:{env_vars['DATABASE_PASSWORD']}"
+              f"@{env_vars['DATABASE_ENDPOINT']}:{os.getenv('DATABASE_PORT', '5432')}/{env_vars['DATABASE_NAME']}")
+
+    parser = argparse.ArgumentParser(description="Concurrent load test of the asyncio hybrid datastore")
+    parser.add_argument("--concurrency", type=lambda value: [int(n) for n in value.split(",")], default=[1, 8, 64, 256],
+                        help="Comma separated concurrency levels, default 1,8,64,256")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests issued per concurrency level")
+    parser.add_argument("--start", type=int, default=1, help="First row of the sample data to request")
+    parser.add_argument("--end", type=int, default=1000, help="Last row of the sample data to request")
+    parser.add_argument("--fields", default="FirstName,LastName,Email,Street", help="Comma separated fields to fetch")
+    parser.add_argument("--cold", action="store_true", help="Delete the requested items after every level so each level starts cold")
+    parser.add_argument("--no-single-flight", action="store_true", help="Do not coalesce concurrent misses")
+    parser.add_argument("--no-write-behind", action="store_true", help="Write the backfill of a miss before returning it")
+    parser.add_argument("--compact", action="store_true", default=flag(os.getenv("COMPACT_ITEMS") or "0"),
+                        help="Items are stored in the compact format, defaults to COMPACT_ITEMS")
+    parser.add_argument("--pool-max-size", type=int, default=20, help="Maximum number of Postgres connections")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,192 @@
+import random
+import threading
+import time
+import zlib
+
+# DynamoDB TTL attribute, enabled on the table by DeployDatabases.py
+ttl_attribute = 'ExpiresAt'
+
+
+# Count-min sketch of access frequencies with 4-bit counters as in TinyLFU. After sample_size increments every
+# counter is halved, so old popularity fades and the sketch follows a changing workload.
+class FrequencySketch:
+    def __init__(self, width=4096, depth=4, sample_size=None, max_count=15):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or width * 10
+        self.max_count = max_count
+        self.rows = [[0] * width for _ in range(depth)]
+        self.salts = [str(i).encode() for i in range(depth)]
+        self.additions = 0
+        self.resets = 0
+
+    def _indexes(self, key):
+        key = key.encode()
+        return [zlib.crc32(salt + key) % self.width for salt in self.salts]
+
+    def increment(self, key):
+        indexes = self._indexes(key)
+        # Conservative update: only the smallest counters grow, which keeps overestimates down
+        current = min(row[index] for row, index in zip(self.rows, indexes))
+        if current < self.max_count:
+            for row, index in zip(self.rows, indexes):
+                if row[index] == current:
+                    row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def reset(self):
+        for row in self.rows:
+            for i in range(self.width):
+                row[i] >>= 1
+        self.additions //= 2
+        self.resets += 1
+
+
+# Decides which PostgreSQL misses are written into the DynamoDB tier and which cached items make room for them.
+# The base policy writes on the first miss. ttl (seconds) stamps every written item with ExpiresAt, capacity
+# bounds the number of cached items: once it is reached, the least frequently used of sample_size random
+# resident items is evicted, by the frequencies of the sketch. Residents are only known to this process, so
+# items cached before it started have to be registered with add_residents.
+class CachePolicy:
+    name = 'first_miss'
+
+    def __init__(self, ttl=None, capacity=None, sketch_width=4096, sample_size=8, seed=42):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.sample_size = sample_size
+        self.sketch = FrequencySketch(width=sketch_width)
+        self.stats = {'admitted': 0, 'rejected': 0, 'evicted': 0, 'expired': 0}
+        self._residents = []
+        self._resident_index = {}
+        self._expires_at = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def describe(self):
+        description = self.name
+        if self.ttl:
+            description += f", ttl {self.ttl:g}s"
+        if self.capacity:
+            description += f", capacity {self.capacity}"
+        return description
+
+    def record_access(self, customer_id):
+        # Called for every read that reaches the DynamoDB tier, hit or miss
+        with self._lock:
+            self.sketch.increment(customer_id)
+
+    def item_attributes(self):
+        # Extra attributes written with an admitted item
+        return {ttl_attribute: int(time.time() + self.ttl)} if self.ttl else {}
+
+    def is_expired(self, item):
+        # DynamoDB deletes expired items lazily, up to days later, so reads have to check ExpiresAt themselves
+        if self.ttl and ttl_attribute in item and item[ttl_attribute] <= time.time():
+            with self._lock:
+                self.stats['expired'] += 1
+            return True
+        return False
+
+    def projection(self, projection_expression):
+        return f"{projection_expression}, {ttl_attribute}" if self.ttl else projection_expression
+
+    def admit(self, customer_id):
+        # Returns (admit, victims): whether the missed item should be written, and the cached items to delete
+        # to make room for it
+        with self._lock:
+            if not self._should_admit(customer_id):
+                self.stats['rejected'] += 1
+                return False, []
+            victims = []
+            if self.capacity and customer_id not in self._resident_index and len(self._residents) >= self.capacity:
+                victim, expired = self._pick_victim()
+                if not expired and not self._wins_against(customer_id, victim):
+                    self.stats['rejected'] += 1
+                    return False, []
+                self._remove(victim)
+                victims.append(victim)
+                self.stats['evicted'] += 1
+            self._add(customer_id)
+            self.stats['admitted'] += 1
+            return True, victims
+
+    def _should_admit(self, customer_id):
+        return True
+
+    def _wins_against(self, candidate, victim):
+        return True
+
+    def _pick_victim(self):
+        # Sampled LFU: an expired item is taken right away, otherwise the least frequent of the sample
+        now = time.time()
+        victim = None
+        victim_frequency = None
+        for _ in range(min(self.sample_size, len(self._residents))):
+            customer_id = self._rng.choice(self._residents)
+            if self._expires_at.get(customer_id, now + 1) <= now:
+                return customer_id, True
+            frequency = self.sketch.estimate(customer_id)
+            if victim is None or frequency < victim_frequency:
+                victim, victim_frequency = customer_id, frequency
+        return victim, False
+
+    def add_residents(self, customer_ids):
+        with self._lock:
+            for customer_id in customer_ids:
+                self._add(customer_id, expires=False)
+
+    def removed(self, customer_id):
+        # The item was deleted from DynamoDB by someone else, for example the benchmark
+        with self._lock:
+            if customer_id in self._resident_index:
+                self._remove(customer_id)
+
+    def __len__(self):
+        return len(self._residents)
+
+    def _add(self, customer_id, expires=True):
+        if customer_id not in self._resident_index:
+            self._resident_index[customer_id] = len(self._residents)
+            self._residents.append(customer_id)
+        if expires and self.ttl:
+            self._expires_at[customer_id] = time.time() + self.ttl
+
+    def _remove(self, customer_id):
+        # Swap with the last resident so removal stays O(1)
+        index = self._resident_index.pop(customer_id)
+        last = self._residents.pop()
+        if last != customer_id:
+            self._residents[index] = last
+            self._resident_index[last] = index
+        self._expires_at.pop(customer_id, None)
+
+
+# Writes an item only on its second miss within the sketch window, one-off reads never cost a write
+class SecondMissPolicy(CachePolicy):
+    name = 'second_miss'
+
+    def _should_admit(self, customer_id):
+        # record_access already counted this miss
+        return self.sketch.estimate(customer_id) >= 2
+
+
+# TinyLFU admission: below capacity every miss is written, at capacity the missed item replaces the sampled
+# victim only if the sketch has seen it more often
+class TinyLfuPolicy(CachePolicy):
+    name = 'tinylfu'
+
+    def _wins_against(self, candidate, victim):
+        return self.sketch.estimate(candidate) > self.sketch.estimate(victim)
+
+
+policies = {policy.name: policy for policy in (CachePolicy, SecondMissPolicy, TinyLfuPolicy)}
+
+
+def make_policy(name, **kwargs):
+    assert name in policies, f"Unknown cache policy '{name}', use one of {', '.join(policies)}"
+    return policies[name](**kwargs)
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import select
+import time
+from datetime import timedelta
+from botocore.exceptions import ClientError
+from HybridDatastore import HybridDatastore, check_environment, flag, row_to_customer_data
+from NegativeCache import is_tombstone, tombstone_attribute
+
+# Change-data-capture sync from PostgreSQL to DynamoDB.
+# Triggers keep a version number on every customer_info row and NOTIFY on every change, the sync worker
+# LISTENs, re-reads the changed rows and pushes them into the DynamoDB items that are already cached.
+# The worker also polls updatedat to catch up on changes committed while it was not listening.
+channel = 'customer_info_changes'
+# Item written by the worker after every sync cycle, readers trust DynamoDB while it is fresh enough
+heartbeat_id = '__sync_heartbeat__'
+catch_up_overlap = timedelta(seconds=60)
+
+# The triggers alone, LoadData_RDS.py recreates them on the table it swaps in
+trigger_sql = f"""
+CREATE OR REPLACE FUNCTION customer_info_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    NEW.updatedat := now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION customer_info_notify() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    PERFORM pg_notify('{channel}', json_build_object(
+        'op', TG_OP, 'customerid', changed.customerid, 'version', changed.version)::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS customer_info_version ON customer_info;
+CREATE TRIGGER customer_info_version BEFORE UPDATE ON customer_info
+    FOR EACH ROW EXECUTE FUNCTION customer_info_bump_version();
+DROP TRIGGER IF EXISTS customer_info_changes ON customer_info;
+CREATE TRIGGER customer_info_changes AFTER INSERT OR UPDATE OR DELETE ON customer_info
+    FOR EACH ROW EXECUTE FUNCTION customer_info_notify();
+"""
+
+install_sql = """
+ALTER TABLE customer_info ADD COLUMN IF NOT EXISTS Version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE customer_info ADD COLUMN IF NOT EXISTS UpdatedAt TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS customer_info_updatedat ON customer_info (updatedat);
+""" + trigger_sql
+
+customer_columns = ("customerid, firstname, lastname, email, phonenumber, street, city, state, postalcode, "
+                    "dateofbirth, accountcreationdate, lastpurchasedate, loyaltypoints, version, updatedat")
+
+
+def install(conn):
+    with conn.cursor() as cur:
+        cur.execute(install_sql)
+    print("Version columns and change triggers installed on 'customer_info'.")
+
+
+def fetch_rows(conn, customer_ids):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT {customer_columns} FROM customer_info WHERE customerid = ANY(%s)", (list(customer_ids),))
+        return cur.fetchall()
+
+
+def push_item(table, customer_data, codec=None):
+    # Only refresh items that are already cached, and never replace a newer version with an older one.
+    # update_item keeps attributes the row does not have, such as the ExpiresAt of a cache TTL. Tombstones of
+    # absent customers are left to replace_tombstone.
+    stored = codec.encode(customer_data) if codec else customer_data
+    attributes = {key: value for key, value in stored.items() if key != 'CustomerID'}
+    try:
+        table.update_item(
+            Key={'CustomerID': customer_data['CustomerID']},
+            UpdateExpression="SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(attributes))),
+            ConditionExpression="attribute_exists(CustomerID) AND attribute_not_exists(#tombstone) AND "
+                                "(attribute_not_exists(#version) OR #version < :version)",
+            ExpressionAttributeNames={'#version': 'Version', '#tombstone': tombstone_attribute,
+                                      **{f'#a{i}': name for i, name in enumerate(attributes)}},
+            ExpressionAttributeValues={':version': customer_data['Version'],
+                                       **{f':a{i}': value for i, value in enumerate(attributes.values())}}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def replace_tombstone(table, customer_data, codec=None):
+    # An inserted customer may have been looked up before and cached as absent, its tombstone becomes the item
+    stored = codec.encode(customer_data) if codec else customer_data
+    try:
+        table.put_item(Item=stored, ConditionExpression="attribute_exists(#tombstone)",
+                       ExpressionAttributeNames={'#tombstone': tombstone_attribute})
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def apply_changes(conn, table, customer_ids, codec=None, inserted=()):
+    rows = fetch_rows(conn, customer_ids)
+    pushed = 0
+    for result in rows:
+        if result[0] in inserted and replace_tombstone(table, row_to_customer_data(result), codec):
+            pushed += 1
+            continue
+        pushed += push_item(table, row_to_customer_data(result), codec)
+    # Rows that no longer exist were deleted in PostgreSQL
+    for customer_id in set(customer_ids) - {result[0] for result in rows}:
+        table.delete_item(Key={'CustomerID': customer_id})
+    return pushed, rows
+
+
+def write_heartbeat(table, synced_at):
+    table.put_item(Item={'CustomerID': heartbeat_id, 'SyncedAt': int(synced_at * 1000)})
+
+
+def run(conn, table, heartbeat_interval, catch_up_interval, codec=None):
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {channel}")
+        cur.execute("SELECT now() - interval '1 day'")
+        watermark = cur.fetchone()[0]
+    print(f"Listening on '{channel}'. Press Ctrl+C to stop.")
+    last_catch_up = 0
+    total_pushed = 0
+    while True:
+        # Every change committed before cycle_start is applied by the end of this cycle
+        cycle_start = time.time()
+        changed = set()
+        inserted = set()
+        if time.time() - last_catch_up >= catch_up_interval:
+            with conn.cursor() as cur:
+                cur.execute("SELECT customerid FROM customer_info WHERE updatedat >= %s", (watermark,))
+                changed.update(result[0] for result in cur.fetchall())
+            last_catch_up = time.time()
+        conn.poll()
+        while conn.notifies:
+            change = json.loads(conn.notifies.pop(0).payload)
+            changed.add(change['customerid'])
+            if change['op'] == 'INSERT':
+                inserted.add(change['customerid'])
+        if changed:
+            pushed, rows = apply_changes(conn, table, changed, codec, inserted)
+            total_pushed += pushed
+            if rows:
+                # updatedat is the transaction start time, so keep an overlap for transactions that commit late
+                watermark = max(watermark, max(result[14] for result in rows) - catch_up_overlap)
+            print(f"Synced {len(changed)} changed customers, {pushed} cached items refreshed ({total_pushed} total)")
+        write_heartbeat(table, cycle_start)
+        if not conn.notifies:
+            select.select([conn], [], [], heartbeat_interval)
+
+
+def check(conn, table, repair, codec=None):
+    # Compare every cached item with its PostgreSQL row
+    counts = {'checked': 0, 'consistent': 0, 'missing_in_postgres': 0, 'stale_version': 0, 'mismatched': 0, 'repaired': 0,
+              'tombstones': 0}
+    mismatched_fields = {}
+    scan_kwargs = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        # Tombstones of absent customers expire on their own
+        counts['tombstones'] += sum(1 for item in response['Items'] if is_tombstone(item))
+        items = {item['CustomerID']: codec.decode(item) if codec else item
+                 for item in response['Items'] if item['CustomerID'] != heartbeat_id and not is_tombstone(item)}
+        rows = {result[0]: row_to_customer_data(result) for result in fetch_rows(conn, items.keys())} if items else {}
+        for customer_id, item in items.items():
+            counts['checked'] += 1
+            customer_data = rows.get(customer_id)
+            if customer_data is None:
+                counts['missing_in_postgres'] += 1
+                if repair:
+                    table.delete_item(Key={'CustomerID': customer_id})
+                    counts['repaired'] += 1
+                continue
+            differences = [field for field, value in customer_data.items() if field != 'Version' and item.get(field) != value]
+            if not differences:
+                counts['consistent'] += 1
+                continue
+            if 'Version' in item and item['Version'] < customer_data['Version']:
+                counts['stale_version'] += 1
+            counts['mismatched'] += 1
+            for field in differences:
+                mismatched_fields[field] = mismatched_fields.get(field, 0) + 1
+            if repair:
+                table.put_item(Item=codec.encode(customer_data) if codec else customer_data)
+                counts['repaired'] += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    print(f"Consistency check: {counts}")
+    if mismatched_fields:
+        print(f"Mismatched fields: {mismatched_fields}")
+    return counts
+
+
+if __name__ == "__main__":
+    check_environment()
+
+    parser = argparse.ArgumentParser(description="Change-data-capture sync from PostgreSQL to DynamoDB")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("install", help="Add version columns and change triggers to customer_info")
+    run_parser = subparsers.add_parser("run", help="Listen for changes and push them into DynamoDB")
+    run_parser.add_argument("--heartbeat-interval", type=float, default=1.0, help="Seconds between heartbeats")
+    run_parser.add_argument("--catch-up-interval", type=float, default=30.0, help="Seconds between updatedat polls")
+    check_parser = subparsers.add_parser("check", help="Compare cached DynamoDB items with PostgreSQL")
+    check_parser.add_argument("--repair", action="store_true", help="Overwrite or delete inconsistent items")
+    parser.add_argument("--compact", action="store_true", default=flag(os.getenv("COMPACT_ITEMS") or "0"),
+                        help="Cached items are stored in the compact format of ItemCodec.py, defaults to COMPACT_ITEMS")
+    args = parser.parse_args()
+
+    # The sync scans and writes the single NOSQL_NAME table, also when the benchmark shards the cache
+    store = HybridDatastore.from_env(dynamodb_shards=None, compact_items=args.compact)
+    codec = store.item_codec
+    table = store.table
+    conn = store.connect()
+    conn.autocommit = True
+    try:
+        if args.command == "install":
+            install(conn)
+        elif args.command == "run":
+            run(conn, table, args.heartbeat_interval, args.catch_up_interval, codec)
+        else:
+            check(conn, table, args.repair, codec)
+    except KeyboardInterrupt:
+        print("Sync stopped.")
+    finally:
+        conn.close()
+        store.close()
@@ -0,0 +1,172 @@
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# A pooled psycopg2 connection plus the bookkeeping the pool needs for idle eviction,
+# health checks and per-connection prepared statements
+class PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.prepared = set()
+
+    def prepare(self, name, sql):
+        if name not in self.prepared:
+            cur = self.conn.cursor()
+            cur.execute(f"PREPARE {name} AS {sql}")
+            cur.close()
+            self.prepared.add(name)
+
+    def execute_prepared(self, name, sql, params):
+        self.prepare(name, sql)
+        cur = self.conn.cursor()
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders})", params)
+        return cur
+
+    def is_healthy(self):
+        if self.conn.closed:
+            return False
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def close(self):
+        try:
+            self.conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class PostgresPool:
+    def __init__(self, conn_string, min_size=1, max_size=10, idle_timeout=300,
+                 health_check_interval=30, checkout_timeout=10, statements=None):
+        assert 0 <= min_size <= max_size and max_size > 0, "Pool sizes must satisfy 0 <= min_size <= max_size"
+        self.conn_string = conn_string
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        # Statements prepared on every new connection, as {name: sql with $1, $2... placeholders}
+        self.statements = statements or {}
+        self.stats = {'connects': 0, 'checkouts': 0, 'health_check_failures': 0, 'evicted_idle': 0, 'waits': 0}
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.conn_string)
+        # Lookups are single statements, autocommit keeps pooled sessions from idling in a transaction
+        conn.autocommit = True
+        pooled = PooledConnection(conn)
+        for name, sql in self.statements.items():
+            pooled.prepare(name, sql)
+        self._count('connects')
+        return pooled
+
+    def _count(self, stat):
+        # Counted under the pool lock, connects and checkouts run on many threads at once
+        with self._cond:
+            self.stats[stat] += 1
+
+    def _evict_idle(self):
+        # Close connections idle longer than idle_timeout, oldest first, but never shrink below min_size
+        now = time.monotonic()
+        while self._size > self.min_size and self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            self._idle.pop(0).close()
+            self._size -= 1
+            self.stats['evicted_idle'] += 1
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Pool is closed")
+                self._evict_idle()
+                if self._idle:
+                    # Most recently used connection first so the rest can age out
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No connection available within {self.checkout_timeout} seconds")
+                self.stats['waits'] += 1
+                self._cond.wait(remaining)
+
+    def _discard(self, pooled):
+        if pooled is not None:
+            pooled.close()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def checkout(self):
+        pooled = self._acquire()
+        try:
+            if pooled is None:
+                pooled = self._connect()
+            elif time.monotonic() - pooled.last_used > self.health_check_interval and not pooled.is_healthy():
+                self._count('health_check_failures')
+                pooled.close()
+                pooled = self._connect()
+        except Exception:
+            self._discard(None)
+            raise
+        self._count('checkouts')
+        return pooled
+
+    def checkin(self, pooled, broken=False):
+        if broken or pooled.conn.closed:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                pooled.close()
+                self._size -= 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        pooled = self.checkout()
+        try:
+            yield pooled
+        except psycopg2.Error:
+            # The session may be in an unknown state after a database error, do not reuse it
+            self.checkin(pooled, broken=True)
+            raise
+        except BaseException:
+            self.checkin(pooled)
+            raise
+        else:
+            self.checkin(pooled)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+            self._cond.notify_all()
@@ -1,54 +1,127 @@
+import argparse
 import json
+import os
 import matplotlib
-matplotlib.use('TkAgg')
+# Renders straight to files, no display needed
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import numpy as np
+from LatencyAnalysis import MissRateModel, cumulative_seconds, downsample, map_results, percentiles
 
-# Load time used from JSON file
-with open('term-paper/data/time_data.json', 'r') as file:
-    data = json.load(file)
-    nosql_time_used = data['nosql']
-    hybrid_time_used = data['hybrid']
-    rds_time_used = data['rds']
-    sensitive_time_used = data['sensitive']
-
-
-execution_count = list(range(1, 1001))
-total_time_nosql = []
-total_time_hybrid = []
-total_time_rds = []
-total_time_sensitive = []
-
-for i in range(1, 1001):
-    total_time_nosql.append(sum(nosql_time_used[:i]))
-    total_time_hybrid.append(sum(hybrid_time_used[:i]))
-    total_time_rds.append(sum(rds_time_used[:i]))
-    total_time_sensitive.append(sum(sensitive_time_used[:i]))
-
-plt.plot(execution_count, total_time_nosql, marker='o', label = 'Hybrid Datastore (best case)')
-plt.plot(execution_count, total_time_hybrid, marker='o', label = 'Hybrid Datastore (worst case)')
-plt.plot(execution_count, total_time_rds, marker='o', label = 'Relational Database (best case)')
-plt.plot(execution_count, total_time_sensitive, marker='o', label = 'Hybrid Datastore (sensitive field)')
-plt.xlabel('Number of Executions')
-plt.ylabel('Total Time (seconds)')
-plt.title('Execution Time Comparison')
-plt.legend()
-plt.savefig('term-paper/data/general.png')
-
-
-total_time_50_50 = [(nosql + hybrid) / 2 for nosql, hybrid in zip(total_time_nosql, total_time_hybrid)]
-total_time_25_75 = [(nosql * 0.75 + hybrid * 0.25) for nosql, hybrid in zip(total_time_nosql, total_time_hybrid)]
-total_time_10_90 = [(nosql * 0.90 + hybrid * 0.10) for nosql, hybrid in zip(total_time_nosql, total_time_hybrid)]
-
-plt.figure(figsize=(10, 6))
-plt.plot(execution_count, total_time_rds, marker='o', label='Relational Database (best case)')
-plt.plot(execution_count, total_time_50_50, marker='o', label='50% Miss Rate (Hybrid Datastore)')
-plt.plot(execution_count, total_time_25_75, marker='o', label='25% Miss Rate (Hybrid Datastore)')
-plt.plot(execution_count, total_time_10_90, marker='o', label='10% Miss Rate (Hybrid Datastore)')
-plt.plot(execution_count, total_time_nosql, marker='o', label = 'Hybrid Datastore (best case)')
-plt.xlabel('Number of Executions')
-plt.ylabel('Total Time (seconds)')
-plt.title('Execution Time Comparison')
-plt.legend()
-plt.savefig('term-paper/data/comparison.png')
-plt.show()
+results_file = 'term-paper/data/time_data.bin'
+legacy_results_file = 'term-paper/data/time_data.json'
+output_dir = 'term-paper/data'
 
+
+def load(path):
+    # {scenario: {'latencies_ns': array, ...metadata}}, memory-mapped from the binary results of PerformanceEval.py
+    if os.path.exists(path):
+        return map_results(path)
+    # Older versions wrote seconds to a JSON file
+    with open(legacy_results_file, 'r') as file:
+        data = json.load(file)
+    return {name: {'latencies_ns': (np.asarray(values) * 1e9).astype(np.int64)}
+            for name, values in data.items() if isinstance(values, list)}
+
+
+def plot_cumulative(ax, latencies_ns, label, **kwargs):
+    requests, total = downsample(cumulative_seconds(latencies_ns))
+    ax.plot(requests, total, label=label, **kwargs)
+
+
+def main(args):
+    results = load(args.results)
+    labels = {'nosql': 'Hybrid Datastore (best case)', 'hybrid': 'Hybrid Datastore (worst case)',
+              'rds': 'Relational Database (best case)', 'sensitive': 'Hybrid Datastore (sensitive field)'}
+
+    fig, ax = plt.subplots()
+    for name, label in labels.items():
+        if name in results:
+            plot_cumulative(ax, results[name]['latencies_ns'], label)
+    ax.set_xlabel('Number of Executions')
+    ax.set_ylabel('Total Time (seconds)')
+    ax.set_title('Execution Time Comparison')
+    ax.legend()
+    fig.savefig(os.path.join(output_dir, 'general.png'))
+
+    # Measured workloads next to runs modelled at the requested miss rates from the hit and miss latencies
+    model = MissRateModel(results[args.hit_scenario]['latencies_ns'], results[args.miss_scenario]['latencies_ns'])
+    requests = args.requests or len(results[args.hit_scenario]['latencies_ns'])
+    fig, ax = plt.subplots(figsize=(10, 6))
+    if 'rds' in results:
+        plot_cumulative(ax, results['rds']['latencies_ns'], labels['rds'])
+    workloads = {name: result for name, result in results.items() if 'workload' in result}
+    for result in workloads.values():
+        plot_cumulative(ax, result['latencies_ns'], f"{result['workload']} ({1 - result['hit_rate']:.0%} Miss Rate)")
+    for miss_rate in args.miss_rates:
+        plot_cumulative(ax, model.simulate(miss_rate, requests, args.seed),
+                        f"{miss_rate:.0%} Miss Rate (modelled)", linestyle='--')
+    plot_cumulative(ax, results[args.hit_scenario]['latencies_ns'], labels.get(args.hit_scenario, args.hit_scenario))
+    ax.set_xlabel('Number of Executions')
+    ax.set_ylabel('Total Time (seconds)')
+    ax.set_title('Execution Time Comparison')
+    ax.legend()
+    fig.savefig(os.path.join(output_dir, 'comparison.png'))
+
+    # Mean, p50 and p99 over every miss rate, with the measured workloads as points
+    miss_rates = np.linspace(0, 1, 101)
+    curve = model.curve(miss_rates, ps=(50, 99))
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for stat in ['mean', 50, 99]:
+        ax.plot(miss_rates * 100, curve[stat] / 1e6, label=stat if stat == 'mean' else f'p{stat}')
+    for result in workloads.values():
+        ax.scatter([(1 - result['hit_rate']) * 100], [percentiles(result['latencies_ns'], 99) / 1e6], marker='x')
+        ax.annotate(result['workload'], ((1 - result['hit_rate']) * 100, percentiles(result['latencies_ns'], 99) / 1e6),
+                    fontsize=7)
+    ax.set_yscale('log')
+    ax.set_xlabel('Miss Rate (%)')
+    ax.set_ylabel('Latency (ms)')
+    ax.set_title('Modelled Latency by Miss Rate (x: measured p99 of the workloads)')
+    ax.legend()
+    fig.savefig(os.path.join(output_dir, 'missrate.png'))
+    for miss_rate in args.miss_rates:
+        p50, p99 = model.percentiles(miss_rate, [50, 99])
+        print(f"{miss_rate:.0%} miss rate: mean {model.mean(miss_rate) / 1e6:.3f} ms, p50 {p50 / 1e6:.3f} ms, "
+              f"p99 {p99 / 1e6:.3f} ms")
+
+    # Hit rate after a cold start, per window of requests, with and without warming the cache
+    recovery = [result for result in results.values() if 'recovery' in result]
+    if recovery:
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for result in recovery:
+            windows = np.asarray(result['recovery'])
+            requests = np.minimum((np.arange(len(windows)) + 1) * result['window'], result['requests'])
+            ax.plot(requests, windows * 100, marker='o', label=f"Warmed from {result['warming']}")
+        ax.set_xlabel('Requests after the cold start')
+        ax.set_ylabel('Hit Rate (%)')
+        ax.set_title('Hit Rate Recovery after a Cold Start')
+        ax.legend()
+        fig.savefig(os.path.join(output_dir, 'warming.png'))
+
+    # Tail latency of every scenario
+    ps = [50, 90, 99, 99.9]
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for name, result in results.items():
+        if 'hit_rate' in result or not len(result['latencies_ns']):
+            continue
+        latencies = result['latencies_ns']
+        ax.plot([f"p{p:g}" for p in ps] + ['max'], np.append(percentiles(latencies, ps), latencies.max()) / 1e6,
+                marker='o', label=result.get('description', name))
+    ax.set_yscale('log')
+    ax.set_xlabel('Percentile')
+    ax.set_ylabel('Latency (ms)')
+    ax.set_title('Latency Percentiles')
+    ax.legend()
+    fig.savefig(os.path.join(output_dir, 'percentiles.png'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the benchmark results")
+    parser.add_argument("--results", default=results_file, help="Binary results file of PerformanceEval.py")
+    parser.add_argument("--hit-scenario", default='nosql', help="Scenario whose latencies model a hit")
+    parser.add_argument("--miss-scenario", default='hybrid', help="Scenario whose latencies model a miss")
+    parser.add_argument("--miss-rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[0.1, 0.25, 0.5],
+                        help="Comma separated miss rates to model, default 0.1,0.25,0.5")
+    parser.add_argument("--requests", type=int, default=0, help="Length of the modelled runs, default that of the hit scenario")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the modelled runs")
+    main(parser.parse_args())
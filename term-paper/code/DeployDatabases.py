@@ -64,6 +64,20 @@ try:
 except ClientError as e:
     print(e.response['Error']['Message'])
 
+# Items written with an ExpiresAt attribute (CACHE_TTL in PerformanceEval.py) are deleted by DynamoDB once expired
+try:
+    ttl_description = session.client('dynamodb', region_name=aws_region).describe_time_to_live(TableName=dynamodb_name)
+    if ttl_description['TimeToLiveDescription']['TimeToLiveStatus'] in ('ENABLED', 'ENABLING'):
+        print("Time to live is already enabled!")
+    else:
+        session.client('dynamodb', region_name=aws_region).update_time_to_live(
+            TableName=dynamodb_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'ExpiresAt'}
+        )
+        print("Time to live enabled on 'ExpiresAt'!")
+except ClientError as e:
+    print(e.response['Error']['Message'])
+
 # Relational Database: AWS RDS
 # Create a new RDS instance with PostgreSQL engine and t3.micro instance class
 rds_client = session.client('rds', region_name=aws_region)
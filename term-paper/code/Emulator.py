@@ -0,0 +1,134 @@
+import asyncio
+import random
+import subprocess
+import threading
+import time
+import psycopg2
+from botocore.exceptions import ClientError
+
+# Local stand-ins for DynamoDB and RDS, as (docker image, container port)
+dynamodb_images = {'dynamodb-local': ('amazon/dynamodb-local', 8000), 'moto': ('motoserver/moto', 5000)}
+postgres_image = ('postgres:16', 5432)
+
+
+def start_container(name, image, container_port, host_port, env=None):
+    # Replaces a leftover container of the same name from an earlier run
+    stop_container(name)
+    command = ['docker', 'run', '-d', '--rm', '--name', name, '-p', f'{host_port}:{container_port}']
+    for key, value in (env or {}).items():
+        command += ['-e', f'{key}={value}']
+    subprocess.run(command + [image], check=True, stdout=subprocess.DEVNULL)
+
+
+def stop_container(name):
+    subprocess.run(['docker', 'rm', '-f', name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until(check, description, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return check()
+        except Exception as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{description} was not ready after {timeout:.0f} seconds: {e}")
+            time.sleep(0.5)
+
+
+def wait_for_postgres(conn_string, timeout=60.0):
+    wait_until(lambda: psycopg2.connect(conn_string).close(), "PostgreSQL", timeout)
+
+
+def wait_for_dynamodb(resource, timeout=60.0):
+    wait_until(lambda: resource.meta.client.list_tables(), "DynamoDB", timeout)
+
+
+def create_table(resource, table_name):
+    try:
+        table = resource.create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': 'CustomerID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'CustomerID', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table.wait_until_exists()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceInUseException':
+            raise
+
+
+# TCP proxy that adds latency: every chunk is forwarded latency / 2 (plus up to jitter / 2) seconds after it
+# arrived, in each direction, so a request and its response take about latency longer. Chunks keep their order
+# and are not slowed down by each other, the delay models distance rather than bandwidth.
+class LatencyProxy:
+    def __init__(self, target_host, target_port, latency, jitter=0.0, listen_port=0, seed=42):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.latency = latency
+        self.jitter = jitter
+        self.listen_port = listen_port
+        self.port = None
+        self.stats = {'connections': 0, 'chunks': 0}
+        self._rng = random.Random(seed)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server = None
+
+    def start(self):
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, '127.0.0.1', self.listen_port), self._loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _delay(self):
+        return (self.latency + self._rng.uniform(0, self.jitter)) / 2
+
+    async def _handle(self, client_reader, client_writer):
+        self.stats['connections'] += 1
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(self._pipe(client_reader, upstream_writer), self._pipe(upstream_reader, client_writer))
+
+    async def _pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        async def send():
+            try:
+                while True:
+                    due, data = await chunks.get()
+                    if due > loop.time():
+                        await asyncio.sleep(due - loop.time())
+                    if not data:
+                        break
+                    writer.write(data)
+                    await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        sender = asyncio.create_task(send())
+        last_due = 0.0
+        while True:
+            try:
+                data = await reader.read(65536)
+            except ConnectionError:
+                data = b''
+            # Jitter never reorders chunks
+            last_due = max(last_due, loop.time() + self._delay())
+            chunks.put_nowait((last_due, data))
+            if not data:
+                break
+            self.stats['chunks'] += 1
+        await sender
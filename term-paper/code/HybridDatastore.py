@@ -0,0 +1,1133 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from AccessLog import AccessLog
+from CachePolicy import make_policy, ttl_attribute
+from ItemCodec import ItemCodec
+from LocalCache import LocalCache
+from NegativeCache import NegativeCache, is_tombstone, tombstone_attribute, tombstone_expired, tombstone_item
+from SingleFlight import SingleFlight
+from Tracing import Tracer, kind_client
+from WriteBehind import WriteBehind
+
+# The hybrid datastore as a library object: DynamoDB in front of PostgreSQL, with the read path, the write path and
+# every cache tier of the benchmark. One instance is meant to live as long as the process and owns the boto3
+# session, a DynamoDB resource per thread, the PostgreSQL pools and the background writers.
+#   store = HybridDatastore.from_env()
+#   store.get_customer_data_fields('...', ['FirstName', 'Email'])
+#   store.close()
+# Constructing it imports no driver and connects to nothing. boto3, botocore and psycopg2 are imported and the
+# clients and pools created on first use, or all at once by start(), which also makes one round trip to each
+# datastore so the first request does not pay the handshakes.
+address_fields = {'Street', 'City', 'State', 'PostalCode'}
+customer_lookup_sql = "SELECT * FROM customer_info WHERE customerid = $1"
+customer_lookup_many_sql = "SELECT * FROM customer_info WHERE customerid = ANY($1)"
+# Columns behind every field, reads that need only some fields select just those columns
+field_columns = {
+    'CustomerID': 'customerid', 'FirstName': 'firstname', 'LastName': 'lastname', 'Email': 'email',
+    'PhoneNumber': 'phonenumber', 'Address.Street': 'street', 'Address.City': 'city', 'Address.State': 'state',
+    'Address.PostalCode': 'postalcode', 'DateOfBirth': 'dateofbirth', 'AccountCreationDate': 'accountcreationdate',
+    'LastPurchaseDate': 'lastpurchasedate', 'LoyaltyPoints': 'loyaltypoints', 'Version': 'version'
+}
+date_fields = {'DateOfBirth', 'AccountCreationDate', 'LastPurchaseDate'}
+# Narrow lookups are prepared per distinct field set, beyond this many field sets the full row is fetched
+narrow_query_cache_size = 64
+# BatchGetItem accepts at most 100 keys per request
+batch_get_chunk_size = 100
+batch_get_max_retries = 8
+sync_heartbeat_cache_ttl = 0.5
+
+required_variables = ["DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_ENDPOINT", "DATABASE_NAME", "NOSQL_NAME",
+                      "AWS_REGION"]
+# DynamoDB Local and moto accept any credentials
+aws_variables = ["ACCESS_KEY", "SECRET_KEY", "SESSION_TOKEN"]
+
+default_settings = {
+    'dynamodb_name': None,
+    'aws_region': None,
+    # Points DynamoDB at DynamoDB Local or a moto server, see LocalBenchmark.py
+    'dynamodb_endpoint': None,
+    'access_key': 'local',
+    'secret_key': 'local',
+    'session_token': None,
+    # Spreads the cache over several tables, regions or DynamoDB Local endpoints, see ShardRouter.py
+    'dynamodb_shards': None,
+    # botocore Config of every DynamoDB resource. The connection pool is sized for the benchmark's concurrent
+    # threads (botocore keeps 10 by default), kept-alive connections skip the TCP and TLS handshakes, and adaptive
+    # retries back off on throttling on the client side as well.
+    'dynamodb_max_pool_connections': 50,
+    'dynamodb_tcp_keepalive': True,
+    'dynamodb_retry_mode': 'adaptive',
+    'dynamodb_max_attempts': 3,
+    'dynamodb_connect_timeout': 2.0,
+    'dynamodb_read_timeout': 5.0,
+    'rds_user': None,
+    'rds_pass': None,
+    'rds_endpoint': None,
+    'rds_port': None,
+    'rds_name': None,
+    # Connection pool, pooling can be turned off with POOL_ENABLED=0
+    'pool_enabled': True,
+    'pool_min_size': 1,
+    'pool_max_size': 10,
+    'pool_idle_timeout': 300.0,
+    'pool_health_check_interval': 30.0,
+    # Read replicas as "host" or "host:port", with the credentials and database of the primary. Reads that involve
+    # LoyaltyPoints only go to replicas at most replica_sensitive_max_lag seconds behind, others to any replica at
+    # most replica_max_lag behind.
+    'replica_endpoints': [],
+    'replica_max_lag': 30.0,
+    'replica_sensitive_max_lag': 1.0,
+    'replica_health_check_interval': 5.0,
+    # In-process L1 cache in front of DynamoDB. Loyalty points must always be checked against PostgreSQL, so they
+    # are not cached locally by default.
+    'l1_cache_enabled': False,
+    'l1_cache_max_entries': 10000,
+    'l1_cache_max_bytes': 64 * 1024 * 1024,
+    'l1_cache_ttl': 60.0,
+    'l1_cache_field_ttls': {'LoyaltyPoints': 0},
+    # With the ChangeSync.py worker running, sensitive reads trust DynamoDB while its heartbeat is at most this
+    # many seconds old instead of re-reading PostgreSQL. None keeps the double read.
+    'sync_max_staleness': None,
+    # Backfill and loyalty point corrections use version-conditioned update_item, False restores the old
+    # unconditional put_item of whole and partial items
+    'conditional_writes': True,
+    # Concurrent misses on the same CustomerID share one PostgreSQL fetch and backfill
+    'single_flight_enabled': True,
+    # On a miss the item is projected from the PostgreSQL row and returned right away, the backfill write is queued
+    # for background writers. sync writes it before returning instead.
+    'backfill_mode': 'write_behind',
+    'write_behind_queue_size': 1000,
+    'write_behind_workers': 4,
+    # Which misses are written into DynamoDB: first_miss, second_miss or tinylfu. cache_ttl (seconds) stamps
+    # written items with the ExpiresAt TTL attribute, cache_capacity bounds the number of cached items.
+    'cache_policy_name': 'first_miss',
+    'cache_ttl': None,
+    'cache_capacity': None,
+    # update_customer_fields commits a change to PostgreSQL, then write_through updates the cached item before
+    # returning and write_behind queues that update, coalesced per customer and retried write_retries times before
+    # the item is evicted instead. write_api_only declares that every change goes through it, then sensitive reads
+    # trust DynamoDB instead of re-reading PostgreSQL, except for customers whose update is still queued.
+    'write_mode': 'write_through',
+    'write_retries': 5,
+    'write_api_only': False,
+    # CustomerIDs PostgreSQL does not have are remembered for negative_cache_ttl seconds (0 turns it off) in an
+    # in-process LRU. With negative_cache_tombstones, tombstone items in DynamoDB tell every reader, for
+    # negative_cache_tombstone_ttl seconds or until ChangeSync.py replaces them when the customer is inserted.
+    'negative_cache_ttl': 10.0,
+    'negative_cache_max_entries': 100000,
+    'negative_cache_tombstones': False,
+    'negative_cache_tombstone_ttl': 300.0,
+    # Stores cached items in the compact format of ItemCodec.py, the table has to be loaded with
+    # LoadData_NOSQL.py --compact as well
+    'compact_items': False,
+    # Appends the CustomerID of every read to this file, WarmCache.py preloads the most read customers of it
+    'access_log_path': None,
+    # Per-stage spans of the read path, consumed capacity is only requested from DynamoDB while tracing
+    'tracing': False,
+    'trace_sample_rate': 1.0,
+}
+
+
+def flag(value):
+    # Any value but 0 turns a flag on, the scripts that read a flag variable themselves parse it with this too
+    return value != "0"
+
+
+def endpoint_list(value):
+    return [endpoint.strip() for endpoint in value.split(",") if endpoint.strip()]
+
+
+def field_ttls(value):
+    # "LoyaltyPoints=0,Email=30", on top of the default that keeps loyalty points out of the L1 cache
+    ttls = dict(default_settings['l1_cache_field_ttls'])
+    for setting in filter(None, value.split(",")):
+        field, ttl = setting.split("=")
+        field = field.strip()
+        ttls[f'Address.{field}' if field in address_fields else field] = float(ttl)
+    return ttls
+
+
+# Environment variable behind every setting and how its value is read, unset or empty variables keep the default
+env_settings = {
+    "NOSQL_NAME": ('dynamodb_name', str),
+    "AWS_REGION": ('aws_region', str),
+    "DYNAMODB_ENDPOINT": ('dynamodb_endpoint', str),
+    "ACCESS_KEY": ('access_key', str),
+    "SECRET_KEY": ('secret_key', str),
+    "SESSION_TOKEN": ('session_token', str),
+    "DYNAMODB_SHARDS": ('dynamodb_shards', str),
+    "DYNAMODB_MAX_POOL_CONNECTIONS": ('dynamodb_max_pool_connections', int),
+    "DYNAMODB_TCP_KEEPALIVE": ('dynamodb_tcp_keepalive', flag),
+    "DYNAMODB_RETRY_MODE": ('dynamodb_retry_mode', str),
+    "DYNAMODB_MAX_ATTEMPTS": ('dynamodb_max_attempts', int),
+    "DYNAMODB_CONNECT_TIMEOUT": ('dynamodb_connect_timeout', float),
+    "DYNAMODB_READ_TIMEOUT": ('dynamodb_read_timeout', float),
+    "DATABASE_USERNAME": ('rds_user', str),
+    "DATABASE_PASSWORD": ('rds_pass', str),
+    "DATABASE_ENDPOINT": ('rds_endpoint', str),
+    "DATABASE_PORT": ('rds_port', str),
+    "DATABASE_NAME": ('rds_name', str),
+    "POOL_ENABLED": ('pool_enabled', flag),
+    "POOL_MIN_SIZE": ('pool_min_size', int),
+    "POOL_MAX_SIZE": ('pool_max_size', int),
+    "POOL_IDLE_TIMEOUT": ('pool_idle_timeout', float),
+    "POOL_HEALTH_CHECK_INTERVAL": ('pool_health_check_interval', float),
+    "DATABASE_REPLICA_ENDPOINTS": ('replica_endpoints', endpoint_list),
+    "REPLICA_MAX_LAG": ('replica_max_lag', float),
+    "REPLICA_SENSITIVE_MAX_LAG": ('replica_sensitive_max_lag', float),
+    "REPLICA_HEALTH_CHECK_INTERVAL": ('replica_health_check_interval', float),
+    "L1_CACHE_ENABLED": ('l1_cache_enabled', flag),
+    "L1_CACHE_MAX_ENTRIES": ('l1_cache_max_entries', int),
+    "L1_CACHE_MAX_BYTES": ('l1_cache_max_bytes', int),
+    "L1_CACHE_TTL": ('l1_cache_ttl', float),
+    "L1_CACHE_FIELD_TTLS": ('l1_cache_field_ttls', field_ttls),
+    "SYNC_MAX_STALENESS": ('sync_max_staleness', float),
+    "CONDITIONAL_WRITES": ('conditional_writes', flag),
+    "SINGLE_FLIGHT": ('single_flight_enabled', flag),
+    "BACKFILL_MODE": ('backfill_mode', str),
+    "WRITE_BEHIND_QUEUE_SIZE": ('write_behind_queue_size', int),
+    "WRITE_BEHIND_WORKERS": ('write_behind_workers', int),
+    "CACHE_POLICY": ('cache_policy_name', str),
+    "CACHE_TTL": ('cache_ttl', float),
+    "CACHE_CAPACITY": ('cache_capacity', int),
+    "WRITE_MODE": ('write_mode', str),
+    "WRITE_RETRIES": ('write_retries', int),
+    "WRITE_API_ONLY": ('write_api_only', flag),
+    "NEGATIVE_CACHE_TTL": ('negative_cache_ttl', float),
+    "NEGATIVE_CACHE_MAX_ENTRIES": ('negative_cache_max_entries', int),
+    "NEGATIVE_CACHE_TOMBSTONES": ('negative_cache_tombstones', flag),
+    "NEGATIVE_CACHE_TOMBSTONE_TTL": ('negative_cache_tombstone_ttl', float),
+    "COMPACT_ITEMS": ('compact_items', flag),
+    "ACCESS_LOG": ('access_log_path', str),
+    "TRACE_SAMPLE_RATE": ('trace_sample_rate', float),
+}
+
+
+def settings_from_env():
+    load_dotenv()
+    return {name: parse(os.getenv(var)) for var, (name, parse) in env_settings.items() if os.getenv(var)}
+
+
+def check_environment():
+    load_dotenv()
+    required = required_variables + ([] if os.getenv("DYNAMODB_ENDPOINT") else aws_variables)
+    assert all(os.getenv(var) for var in required), "One or more environment variables are missing or empty"
+
+
+def has_fields(item, fields):
+    for field in fields:
+        if field.startswith('Address.'):
+            if field.split('.', 1)[1] not in item.get('Address', {}):
+                return False
+        elif field not in item:
+            return False
+    return True
+
+
+def row_to_customer_data(result):
+    return {
+        'CustomerID': result[0],
+        'FirstName': result[1],
+        'LastName': result[2],
+        'Email': result[3],
+        'PhoneNumber': result[4],
+        'Address': {
+            'Street': result[5],
+            'City': result[6],
+            'State': result[7],
+            'PostalCode': result[8]
+        },
+        'DateOfBirth': result[9].strftime('%Y-%m-%d'),
+        'AccountCreationDate': result[10].strftime('%Y-%m-%d'),
+        'LastPurchaseDate': result[11].strftime('%Y-%m-%d'),
+        'LoyaltyPoints': result[12],
+        # version is only present once ChangeSync.py install has run
+        **({'Version': result[13]} if len(result) > 13 else {})
+    }
+
+
+def row_to_fields(field_names, result):
+    # Builds the nested item of a narrow lookup, dates are only formatted when they were asked for
+    item = {}
+    for field, value in zip(field_names, result):
+        if field in date_fields:
+            value = value.strftime('%Y-%m-%d')
+        if field.startswith('Address.'):
+            item.setdefault('Address', {})[field.split('.', 1)[1]] = value
+        else:
+            item[field] = value
+    return item
+
+
+def project_item(customer_data, fields):
+    # Same result as a ProjectionExpression, fields the row does not have are left out
+    item = {}
+    for field in fields:
+        if field.startswith('Address.'):
+            sub_field = field.split('.', 1)[1]
+            if sub_field in customer_data.get('Address', {}):
+                item.setdefault('Address', {})[sub_field] = customer_data['Address'][sub_field]
+        elif field in customer_data:
+            item[field] = customer_data[field]
+    return item
+
+
+# Every setting is an attribute of the same name. Switches such as use_pool, backfill_mode, conditional_writes,
+# write_api_only or sync_max_staleness, and the l1_cache, cache_policy and access_log, may be changed between
+# requests, the benchmark scenarios do.
+class HybridDatastore:
+    def __init__(self, **settings):
+        unknown = [name for name in settings if name not in default_settings]
+        assert not unknown, f"Unknown settings {', '.join(unknown)}"
+        for name, value in {**default_settings, **settings}.items():
+            setattr(self, name, value)
+        assert self.backfill_mode in ('write_behind', 'sync'), "BACKFILL_MODE must be write_behind or sync"
+        assert self.write_mode in ('write_through', 'write_behind'), "WRITE_MODE must be write_through or write_behind"
+        # ChangeSync.py only syncs the single NOSQL_NAME table, sharded items would be trusted but never updated
+        assert self.sync_max_staleness is None or not self.dynamodb_shards, "SYNC_MAX_STALENESS cannot be used with DYNAMODB_SHARDS"
+        self.conn_string = self.postgres_conn_string(self.rds_endpoint, self.rds_port)
+        self.tracer = Tracer(enabled=self.tracing, sample_rate=self.trace_sample_rate)
+        self.capacity_args = {'ReturnConsumedCapacity': 'TOTAL'} if self.tracer.enabled else {}
+        self.item_codec = ItemCodec() if self.compact_items else None
+        self.use_pool = self.pool_enabled
+        self.l1_cache = self.new_l1_cache() if self.l1_cache_enabled else None
+        self.negative_cache = (NegativeCache(self.negative_cache_max_entries, self.negative_cache_ttl)
+                               if self.negative_cache_ttl > 0 else None)
+        self.access_log = AccessLog(self.access_log_path) if self.access_log_path else None
+        self.cache_policy = make_policy(self.cache_policy_name, ttl=self.cache_ttl, capacity=self.cache_capacity)
+        self.single_flight = SingleFlight()
+        self.read_stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'incomplete_items': 0, 'expired_items': 0,
+                           'lost_conditional_writes': 0}
+        self.write_stats = {'updates': 0, 'not_found': 0, 'refreshed': 0, 'skipped': 0, 'queued': 0,
+                            'write_through_failures': 0}
+        self.sync_heartbeat = {'synced_at': 0.0, 'read_at': 0.0}
+        self.narrow_queries = {}
+        self.write_behind = WriteBehind(self.apply_cache_write, max_pending=self.write_behind_queue_size,
+                                        workers=self.write_behind_workers)
+        self.write_queue = WriteBehind(self.refresh_cached_item, max_pending=self.write_behind_queue_size,
+                                       workers=self.write_behind_workers, retries=self.write_retries,
+                                       on_drop=self.drop_cached_item)
+        self._session = None
+        self._local = threading.local()
+        self._shard_stats = []
+        self._pg_pool = None
+        self._pg_router = None
+        self._versioned_rows = None
+        self._connect_lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._narrow_queries_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **settings):
+        # Settings from the environment and a .env file, the keyword arguments override them
+        return cls(**{**settings_from_env(), **settings})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def postgres_conn_string(self, host, port=None):
+        return (f"dbname='{self.rds_name}' user='{self.rds_user}' host='{host}' password='{self.rds_pass}'" +
+                (f" port='{port}'" if port else ""))
+
+    def replica_conn_string(self, endpoint):
+        host, _, port = endpoint.partition(":")
+        return self.postgres_conn_string(host, port)
+
+    def client_config(self):
+        from botocore.config import Config
+        return Config(max_pool_connections=self.dynamodb_max_pool_connections, tcp_keepalive=self.dynamodb_tcp_keepalive,
+                      connect_timeout=self.dynamodb_connect_timeout, read_timeout=self.dynamodb_read_timeout,
+                      retries={'mode': self.dynamodb_retry_mode, 'max_attempts': self.dynamodb_max_attempts})
+
+    @property
+    def session(self):
+        with self._connect_lock:
+            if self._session is None:
+                import boto3
+                self._session = boto3.Session(aws_access_key_id=self.access_key, aws_secret_access_key=self.secret_key,
+                                              aws_session_token=self.session_token)
+            return self._session
+
+    def new_resource(self):
+        # The DynamoDB resource, or the shard router, that serves batch_get_item next to the Table calls. Creating
+        # clients from the shared session is not thread safe either, so it is serialized.
+        with self._connect_lock:
+            if self.dynamodb_shards:
+                from ShardRouter import ShardRouter, shards_from_spec
+                return ShardRouter(shards_from_spec(self.dynamodb_shards, self.session, self.dynamodb_name,
+                                                    self.aws_region, self.client_config()))
+            return self.session.resource('dynamodb', region_name=self.aws_region, endpoint_url=self.dynamodb_endpoint,
+                                         config=self.client_config())
+
+    def new_table(self):
+        # Another client of the cache table, boto3 resources are not thread safe
+        resource = self.new_resource()
+        return resource if self.dynamodb_shards else resource.Table(self.dynamodb_name)
+
+    def _connect_dynamodb(self):
+        # Every thread that talks to DynamoDB, callers and the write-behind workers alike, gets its own resource and
+        # table the first time and keeps them for its lifetime
+        resource = self.new_resource()
+        self._local.dynamodb = resource
+        self._local.table = resource if self.dynamodb_shards else resource.Table(self.dynamodb_name)
+        if self.dynamodb_shards:
+            with self._connect_lock:
+                self._shard_stats.append(resource.stats)
+        return self._local
+
+    @property
+    def table(self):
+        local = self._local if hasattr(self._local, 'table') else self._connect_dynamodb()
+        return local.table
+
+    @property
+    def dynamodb(self):
+        local = self._local if hasattr(self._local, 'table') else self._connect_dynamodb()
+        return local.dynamodb
+
+    def connect(self):
+        # A new connection to the primary outside of the pool
+        import psycopg2
+        return psycopg2.connect(self.conn_string)
+
+    def _pool_kwargs(self):
+        return {'min_size': self.pool_min_size, 'max_size': self.pool_max_size, 'idle_timeout': self.pool_idle_timeout,
+                'health_check_interval': self.pool_health_check_interval,
+                'statements': {'customer_lookup': customer_lookup_sql, 'customer_lookup_many': customer_lookup_many_sql}}
+
+    def ensure_pg_pool(self):
+        # Creates the pool of the primary, also when pool_enabled is off, and the replica router next to it
+        with self._connect_lock:
+            if self._pg_pool is None:
+                from ConnectionPool import PostgresPool
+                self._pg_pool = PostgresPool(self.conn_string, **self._pool_kwargs())
+                # Replicas are only used by pooled reads, writes always go to the primary
+                if self.pool_enabled and self.replica_endpoints:
+                    from PostgresRouter import PostgresRouter
+                    self._pg_router = PostgresRouter.from_conn_strings(
+                        self._pg_pool, {endpoint: self.replica_conn_string(endpoint) for endpoint in self.replica_endpoints},
+                        pool_kwargs=self._pool_kwargs(), max_lag=self.replica_max_lag,
+                        sensitive_max_lag=self.replica_sensitive_max_lag,
+                        health_check_interval=self.replica_health_check_interval)
+                    print(f"Read replica lag (seconds): {self._pg_router.lags()}")
+            return self._pg_pool
+
+    @property
+    def pg_pool(self):
+        if self._pg_pool is None and self.pool_enabled:
+            self.ensure_pg_pool()
+        return self._pg_pool
+
+    @property
+    def pg_router(self):
+        if self._pg_pool is None and self.pool_enabled:
+            self.ensure_pg_pool()
+        return self._pg_router
+
+    @property
+    def versioned_rows(self):
+        if self._versioned_rows is None:
+            self._versioned_rows = self.has_version_column()
+        return self._versioned_rows
+
+    def start(self):
+        # Eager startup for services: imports the drivers, creates the clients and pools and opens the connections
+        # now, the pool opens pool_min_size of them. The DynamoDB read is of a key that is never cached as a
+        # customer, it only leaves a kept-alive connection behind. Other threads create their resource on first use.
+        self.table
+        self.pg_pool
+        self.versioned_rows
+        self.get_from_dynamodb('__startup__', "CustomerID", span_name='dynamodb.startup')
+        return self
+
+    def has_version_column(self):
+        # Row versions exist once ChangeSync.py install has run or the table was created by LoadData_RDS.py
+        sql = "SELECT 1 FROM information_schema.columns WHERE table_name = 'customer_info' AND column_name = 'version'"
+        try:
+            if self.pg_pool:
+                with self.pg_pool.connection() as pooled:
+                    cur = pooled.conn.cursor()
+                    cur.execute(sql)
+                    found = cur.fetchone() is not None
+                    cur.close()
+                return found
+            conn = self.connect()
+            cur = conn.cursor()
+            cur.execute(sql)
+            found = cur.fetchone() is not None
+            cur.close()
+            conn.close()
+            return found
+        except Exception as e:
+            print(f"Error checking for the version column in PostgreSQL: {e}")
+            return False
+
+    def new_l1_cache(self):
+        return LocalCache(max_entries=self.l1_cache_max_entries, max_bytes=self.l1_cache_max_bytes,
+                          default_ttl=self.l1_cache_ttl, field_ttls=self.l1_cache_field_ttls)
+
+    def invalidate_l1(self, customer_id):
+        if self.l1_cache is not None:
+            self.l1_cache.invalidate(customer_id)
+
+    def encode_item(self, item):
+        return self.item_codec.encode(item) if self.item_codec else item
+
+    def decode_item(self, item, fields):
+        return self.item_codec.decode(item, fields) if self.item_codec else item
+
+    def storage_projection(self, fields):
+        return self.item_codec.projection(fields) if self.item_codec else ", ".join(fields)
+
+    def negative_projection(self, projection_expression):
+        # With tombstones, reads also fetch the tombstone marker and its expiry, ExpiresAt may already be projected
+        if not self.negative_cache_tombstones:
+            return projection_expression
+        names = [name.strip() for name in projection_expression.split(",")]
+        return ", ".join(names + [name for name in (tombstone_attribute, ttl_attribute) if name not in names])
+
+    def forget_absent(self, customer_id):
+        if self.negative_cache is not None:
+            self.negative_cache.invalidate(customer_id)
+
+    def remember_absent(self, customer_id):
+        if self.negative_cache is not None:
+            self.negative_cache.add(customer_id)
+        if self.negative_cache_tombstones:
+            self.write_to_cache(customer_id, ('tombstone', customer_id))
+
+    def write_tombstone(self, customer_id):
+        from botocore.exceptions import ClientError
+        # Only replaces nothing or an earlier tombstone, never a customer that was cached in the meantime
+        try:
+            with self.tracer.span('dynamodb.put_item', kind_client) as span:
+                self.tracer.record_capacity(span, self.table.put_item(
+                    Item=tombstone_item(customer_id, self.negative_cache_tombstone_ttl),
+                    ConditionExpression="attribute_not_exists(CustomerID) OR attribute_exists(#tombstone)",
+                    ExpressionAttributeNames={'#tombstone': tombstone_attribute}, **self.capacity_args))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"Error writing a tombstone to DynamoDB: {e}")
+
+    def insert_into_dynamodb(self, customer_data):
+        self.invalidate_l1(customer_data['CustomerID'])
+        self.forget_absent(customer_data['CustomerID'])
+        try:
+            with self.tracer.span('dynamodb.put_item', kind_client) as span:
+                self.tracer.record_capacity(span, self.table.put_item(Item=self.encode_item(customer_data),
+                                                                      **self.capacity_args))
+        except Exception as e:
+            print(f"Error inserting data into DynamoDB: {e}")
+
+    def count(self, stat, stats=None):
+        with self._stats_lock:
+            (self.read_stats if stats is None else stats)[stat] += 1
+
+    def conditional_update(self, customer_id, attributes, condition, values, remove=(), raise_errors=False,
+                           lost_stat='lost_conditional_writes'):
+        # SET every given attribute and REMOVE the given ones in one update_item, names are aliased so reserved
+        # words cannot clash. Returns whether the condition held.
+        from botocore.exceptions import ClientError
+        attributes = self.encode_item(attributes)
+        names = {f'#a{i}': name for i, name in enumerate(attributes)}
+        names.update({f'#r{i}': name for i, name in enumerate(remove)})
+        if '#version' in condition:
+            names['#version'] = 'Version'
+        if '#tombstone' in condition:
+            names['#tombstone'] = tombstone_attribute
+        values = {**values, **{f':a{i}': value for i, value in enumerate(attributes.values())}}
+        update_expression = "SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(attributes)))
+        if remove:
+            update_expression += " REMOVE " + ", ".join(f"#r{i}" for i in range(len(remove)))
+        try:
+            with self.tracer.span('dynamodb.update_item', kind_client) as span:
+                self.tracer.record_capacity(span, self.table.update_item(
+                    Key={'CustomerID': customer_id}, UpdateExpression=update_expression, ConditionExpression=condition,
+                    ExpressionAttributeNames=names, ExpressionAttributeValues=values, **self.capacity_args))
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                # A writer with the same or a newer row version got there first
+                if lost_stat:
+                    self.count(lost_stat)
+                return False
+            if raise_errors:
+                raise
+            print(f"Error updating data in DynamoDB: {e}")
+            return False
+
+    def backfill_dynamodb(self, customer_data):
+        with self.tracer.span('backfill'):
+            self.backfill_item(customer_data)
+
+    def backfill_item(self, customer_data):
+        if not self.conditional_writes:
+            self.insert_into_dynamodb(customer_data)
+            return
+        self.invalidate_l1(customer_data['CustomerID'])
+        self.forget_absent(customer_data['CustomerID'])
+        attributes = {key: value for key, value in customer_data.items() if key != 'CustomerID'}
+        # A tombstone of a customer inserted since has no version, it is overwritten and loses its marker. Its
+        # ExpiresAt goes too unless the cache policy stamps a new one.
+        remove = ([tombstone_attribute] + ([] if ttl_attribute in attributes else [ttl_attribute])
+                  if self.negative_cache_tombstones else [])
+        if 'Version' in customer_data:
+            self.conditional_update(customer_data['CustomerID'], attributes,
+                                    "attribute_not_exists(#version) OR #version < :version",
+                                    {':version': customer_data['Version']}, remove)
+        else:
+            # Without row versions from ChangeSync.py install, a backfill never replaces an item that has one
+            self.conditional_update(customer_data['CustomerID'], attributes, "attribute_not_exists(#version)", {}, remove)
+
+    def correct_loyalty_points(self, customer_data):
+        customer_id = customer_data['CustomerID']
+        if not self.conditional_writes:
+            self.insert_into_dynamodb({'CustomerID': customer_id, 'LoyaltyPoints': customer_data['LoyaltyPoints']})
+            return
+        self.invalidate_l1(customer_id)
+        # Only the drifted attribute is written, the rest of the cached item is kept. An equal version is still
+        # overwritten because the value differs from the row of that very version. The item keeps its own Version:
+        # its other fields may still be older, and a newer Version would make the sync and backfills skip the row.
+        attributes = {'LoyaltyPoints': customer_data['LoyaltyPoints']}
+        if 'Version' in customer_data:
+            self.conditional_update(customer_id, attributes,
+                                    "attribute_exists(CustomerID) AND (attribute_not_exists(#version) OR #version <= :version)",
+                                    {':version': customer_data['Version']})
+        else:
+            self.conditional_update(customer_id, attributes, "attribute_exists(CustomerID)", {})
+
+    def get_from_dynamodb(self, customer_id, projection_expression, span_name='dynamodb.get_item'):
+        try:
+            with self.tracer.span(span_name, kind_client) as span:
+                response = self.table.get_item(Key={'CustomerID': customer_id}, ProjectionExpression=projection_expression,
+                                               **self.capacity_args)
+                self.tracer.record_capacity(span, response)
+            return response
+
+        except Exception as e:
+            print(f"Error fetching data from DynamoDB: {e}")
+            return None
+
+    def narrow_query(self, fields):
+        # Returns (statement name, selected fields, sql) of the lookup of just these fields, None if it has to be
+        # the full row. CustomerID and Version are always selected, the loyalty point correction needs them.
+        fields = {f'Address.{field}' if field in address_fields else field for field in fields} - {'CustomerID', 'Version'}
+        if not fields <= field_columns.keys():
+            return None
+        key = tuple(sorted(fields))
+        versioned_rows = self.versioned_rows
+        with self._narrow_queries_lock:
+            if key not in self.narrow_queries:
+                if len(self.narrow_queries) >= narrow_query_cache_size:
+                    return None
+                field_names = ['CustomerID'] + list(key) + (['Version'] if versioned_rows else [])
+                sql = f"SELECT {', '.join(field_columns[field] for field in field_names)} FROM customer_info WHERE customerid = $1"
+                self.narrow_queries[key] = (f"customer_lookup_{len(self.narrow_queries)}", field_names, sql)
+            return self.narrow_queries[key]
+
+    def query_postgresql(self, customer_id, fields=None):
+        # Without fields the whole row is fetched, as a backfill needs it. Returns None only for a customer that
+        # does not exist, errors are raised, so a failed query is never remembered as an absent customer.
+        query = self.narrow_query(fields) if fields is not None else None
+        with self.tracer.span('postgresql.fetch', pooled=self.use_pool, narrow=query is not None):
+            # The full row holds LoyaltyPoints and gets cached, so it counts as a sensitive read too
+            sensitive = query is None or 'LoyaltyPoints' in fields
+            if query:
+                name, field_names, sql = query
+                result = self.fetch_row(customer_id, name, sql, sensitive)
+            else:
+                result = self.fetch_row(customer_id, sensitive=sensitive)
+
+        if result:
+            return row_to_fields(field_names, result) if query else row_to_customer_data(result)
+        else:
+            return None
+
+    def fetch_from_postgresql(self, customer_id, fields=None):
+        try:
+            return self.query_postgresql(customer_id, fields)
+        except Exception as e:
+            print(f"Error fetching data from PostgreSQL: {e}")
+            return None
+
+    def fetch_row(self, customer_id, name='customer_lookup', sql=customer_lookup_sql, sensitive=True):
+        # Connecting (or checking a connection out of the pool) and the query itself are traced separately
+        if self.use_pool:
+            import psycopg2
+            # Reuse a pooled connection and the statement prepared on it instead of a new handshake per lookup
+            with self.tracer.span('postgresql.connect', kind_client) as span:
+                pg_pool, pg_router = self.pg_pool, self.pg_router
+                pool, pooled = pg_router.checkout(sensitive) if pg_router else (pg_pool, pg_pool.checkout())
+                span.set_attribute('replica', pool is not pg_pool)
+            broken = False
+            try:
+                with self.tracer.span('postgresql.query', kind_client):
+                    cur = pooled.execute_prepared(name, sql, (customer_id,))
+                    result = cur.fetchone()
+                    cur.close()
+            except psycopg2.Error:
+                # The session may be in an unknown state after a database error, do not reuse it
+                broken = True
+                raise
+            finally:
+                pool.checkin(pooled, broken)
+            return result
+
+        with self.tracer.span('postgresql.connect', kind_client):
+            conn = self.connect()
+        try:
+            with self.tracer.span('postgresql.query', kind_client):
+                cur = conn.cursor()
+                cur.execute(sql.replace('$1', '%s'), (customer_id,))
+                result = cur.fetchone()
+                cur.close()
+        finally:
+            conn.close()
+        return result
+
+    def sync_is_fresh(self):
+        if self.sync_max_staleness is None:
+            return False
+        from ChangeSync import heartbeat_id
+        # The heartbeat item is re-read at most every sync_heartbeat_cache_ttl seconds
+        now = time.time()
+        if now - self.sync_heartbeat['read_at'] > sync_heartbeat_cache_ttl:
+            response = self.get_from_dynamodb(heartbeat_id, "SyncedAt")
+            if response and 'Item' in response:
+                self.sync_heartbeat['synced_at'] = float(response['Item']['SyncedAt']) / 1000
+            self.sync_heartbeat['read_at'] = now
+        return now - self.sync_heartbeat['synced_at'] <= self.sync_max_staleness
+
+    def evict_from_dynamodb(self, customer_id):
+        self.invalidate_l1(customer_id)
+        try:
+            with self.tracer.span('dynamodb.delete_item', kind_client) as span:
+                self.tracer.record_capacity(span, self.table.delete_item(Key={'CustomerID': customer_id},
+                                                                         **self.capacity_args))
+        except Exception as e:
+            print(f"Error evicting data from DynamoDB: {e}")
+
+    def apply_cache_write(self, operation):
+        # ('backfill', customer_data), ('evict', customer_id) or ('tombstone', customer_id)
+        action, value = operation
+        if action == 'backfill':
+            self.backfill_dynamodb(value)
+        elif action == 'tombstone':
+            self.write_tombstone(value)
+        else:
+            self.evict_from_dynamodb(value)
+
+    def write_to_cache(self, customer_id, operation):
+        # Writes are keyed by CustomerID, so a later backfill or eviction of a still queued key replaces the earlier one
+        if self.backfill_mode == 'write_behind':
+            self.write_behind.submit(customer_id, operation)
+        else:
+            self.apply_cache_write(operation)
+
+    def load_and_backfill(self, customer_id):
+        customer_data = self.query_postgresql(customer_id)
+        if customer_data:
+            self.write_to_cache(customer_id, ('backfill', {**customer_data, **self.cache_policy.item_attributes()}))
+        else:
+            self.cache_policy.removed(customer_id)
+        return customer_data
+
+    def get_customer_data_fields(self, customer_id, fields):
+        if self.access_log is not None:
+            self.access_log.record(customer_id)
+        with self.tracer.span('get_customer_data_fields', customer_id=customer_id) as span:
+            item, outcome = self.read_customer_data_fields(customer_id, fields)
+            span.set_attribute('outcome', outcome)
+        return item
+
+    def read_customer_data_fields(self, customer_id, fields):
+        # Returns the item and how it was served: l1_hit, hit, miss, negative_hit, tombstone, not_found or error
+        for i, field in enumerate(fields):
+            if field in address_fields:
+                fields[i] = f'Address.{field}'
+        projection_expression = self.storage_projection(fields)
+
+        if self.l1_cache is not None:
+            item = self.l1_cache.get(customer_id, fields)
+            if item is not None:
+                return item, 'l1_hit'
+        if self.negative_cache is not None and self.negative_cache.contains(customer_id):
+            self.count('negative_hits')
+            return None, 'negative_hit'
+
+        try:
+            self.cache_policy.record_access(customer_id)
+            response = self.get_from_dynamodb(customer_id,
+                                              self.negative_projection(self.cache_policy.projection(projection_expression)))
+            if 'Item' in response and is_tombstone(response['Item']):
+                if not tombstone_expired(response['Item']):
+                    self.count('negative_hits')
+                    if self.negative_cache is not None:
+                        self.negative_cache.add(customer_id)
+                    return None, 'tombstone'
+                # DynamoDB removes expired items lazily, until then an expired tombstone is a miss
+                del response['Item']
+            if 'Item' in response:
+                response['Item'] = self.decode_item(response['Item'], fields)
+            if 'Item' in response and not has_fields(response['Item'], fields):
+                # A clobbered item that lost some of the requested fields is served like a miss
+                self.count('incomplete_items')
+                del response['Item']
+            if 'Item' in response and self.cache_policy.is_expired(response['Item']):
+                self.count('expired_items')
+                del response['Item']
+            if 'Item' in response:
+                self.count('hits')
+                if ttl_attribute not in fields:
+                    response['Item'].pop(ttl_attribute, None)
+                # Handle the case where the loyalty points have changed in the PostgreSQL database but not in
+                # DynamoDB, unless the change sync is known to be fresh enough
+                if 'LoyaltyPoints' in fields and not self.loyalty_points_trusted(customer_id) and not self.sync_is_fresh():
+                    customer_data = self.fetch_from_postgresql(customer_id, ['LoyaltyPoints'])
+                    if customer_data:
+                        if customer_data['LoyaltyPoints'] != response['Item']['LoyaltyPoints']:
+                            response['Item']['LoyaltyPoints'] = customer_data['LoyaltyPoints']
+                            self.correct_loyalty_points(customer_data)
+                item = response['Item']
+                outcome = 'hit'
+            else:
+                self.count('misses')
+                admit, victims = self.cache_policy.admit(customer_id)
+                for victim in victims:
+                    self.write_to_cache(victim, ('evict', victim))
+                if admit:
+                    flight_key, load = customer_id, lambda: self.load_and_backfill(customer_id)
+                else:
+                    # Nothing is written, so only the requested fields are needed
+                    flight_key, load = (customer_id, tuple(fields)), lambda: self.query_postgresql(customer_id, fields)
+                if self.single_flight_enabled:
+                    # Followers spend the whole span waiting on the leader's fetch and backfill
+                    with self.tracer.span('single_flight'):
+                        customer_data = self.single_flight.do(flight_key, load)
+                else:
+                    customer_data = load()
+                if customer_data:
+                    # The row already holds every requested field, no need to read the backfilled item back
+                    item = project_item(customer_data, fields)
+                    outcome = 'miss'
+                else:
+                    self.remember_absent(customer_id)
+                    return None, 'not_found'
+        except Exception as e:
+            print(f"Error fetching customer data: {e}")
+            return None, 'error'
+
+        if self.l1_cache is not None:
+            self.l1_cache.put(customer_id, fields, item)
+        return item, outcome
+
+    def batch_get_from_dynamodb(self, customer_ids, projection_expression):
+        # CustomerID is always projected so the responses can be matched back to the requested keys
+        projection = projection_expression
+        if 'CustomerID' not in [field.strip() for field in projection_expression.split(",")]:
+            projection = f"CustomerID, {projection_expression}"
+        items = {}
+        for start in range(0, len(customer_ids), batch_get_chunk_size):
+            chunk = customer_ids[start:start + batch_get_chunk_size]
+            request_items = {self.dynamodb_name: {
+                'Keys': [{'CustomerID': customer_id} for customer_id in chunk],
+                'ProjectionExpression': projection
+            }}
+            attempt = 0
+            while request_items:
+                try:
+                    with self.tracer.span('dynamodb.batch_get_item', kind_client,
+                                          keys=len(request_items[self.dynamodb_name]['Keys'])) as span:
+                        response = self.dynamodb.batch_get_item(RequestItems=request_items, **self.capacity_args)
+                        self.tracer.record_capacity(span, response)
+                except Exception as e:
+                    print(f"Error batch fetching data from DynamoDB: {e}")
+                    break
+                for item in response['Responses'].get(self.dynamodb_name, []):
+                    items[item['CustomerID']] = item
+                # Throttled keys come back in UnprocessedKeys and are retried with exponential backoff
+                request_items = response.get('UnprocessedKeys')
+                if request_items:
+                    attempt += 1
+                    if attempt > batch_get_max_retries:
+                        unprocessed = len(request_items[self.dynamodb_name]['Keys'])
+                        print(f"Giving up on {unprocessed} unprocessed keys after {batch_get_max_retries} retries")
+                        break
+                    time.sleep(min(0.05 * 2 ** attempt, 2))
+        if projection != projection_expression:
+            for item in items.values():
+                item.pop('CustomerID', None)
+        return items
+
+    def query_many_postgresql(self, customer_ids):
+        # Returns {CustomerID: row} of the customers that exist, errors are raised
+        with self.tracer.span('postgresql.fetch_many', kind_client, pooled=self.use_pool, keys=len(customer_ids)):
+            if self.use_pool:
+                pool = self.pg_router.pool_for(sensitive=True) if self.pg_router else self.pg_pool
+                with pool.connection() as pooled:
+                    cur = pooled.execute_prepared('customer_lookup_many', customer_lookup_many_sql, (customer_ids,))
+                    results = cur.fetchall()
+                    cur.close()
+            else:
+                conn = self.connect()
+                cur = conn.cursor()
+                cur.execute("SELECT * FROM customer_info WHERE customerid = ANY(%s)", (customer_ids,))
+                results = cur.fetchall()
+                cur.close()
+                conn.close()
+        return {result[0]: row_to_customer_data(result) for result in results}
+
+    def fetch_many_from_postgresql(self, customer_ids):
+        try:
+            return self.query_many_postgresql(customer_ids)
+        except Exception as e:
+            print(f"Error fetching data from PostgreSQL: {e}")
+            return {}
+
+    def batch_insert_into_dynamodb(self, items):
+        try:
+            with self.table.batch_writer() as batch:
+                for item in items:
+                    self.invalidate_l1(item['CustomerID'])
+                    self.forget_absent(item['CustomerID'])
+                    batch.put_item(Item=self.encode_item(item))
+        except Exception as e:
+            print(f"Error batch inserting data into DynamoDB: {e}")
+
+    def get_customers_data_fields(self, customer_ids, fields):
+        # Bulk version of get_customer_data_fields, returns {CustomerID: item or None} in the order requested
+        fields = [f'Address.{field}' if field in address_fields else field for field in fields]
+        projection_expression = self.storage_projection(fields)
+        customer_ids = list(dict.fromkeys(customer_ids))
+        if self.access_log is not None:
+            for customer_id in customer_ids:
+                self.access_log.record(customer_id)
+
+        absent = set()
+        if self.negative_cache is not None:
+            absent = {customer_id for customer_id in customer_ids if self.negative_cache.contains(customer_id)}
+            for _ in absent:
+                self.count('negative_hits')
+        lookup_ids = [customer_id for customer_id in customer_ids if customer_id not in absent]
+
+        for customer_id in lookup_ids:
+            self.cache_policy.record_access(customer_id)
+        hits = self.batch_get_from_dynamodb(lookup_ids,
+                                            self.negative_projection(self.cache_policy.projection(projection_expression)))
+        for customer_id, item in list(hits.items()):
+            if is_tombstone(item):
+                del hits[customer_id]
+                if not tombstone_expired(item):
+                    self.count('negative_hits')
+                    absent.add(customer_id)
+                    if self.negative_cache is not None:
+                        self.negative_cache.add(customer_id)
+                continue
+            item = hits[customer_id] = self.decode_item(item, fields)
+            if self.cache_policy.is_expired(item):
+                self.count('expired_items')
+                del hits[customer_id]
+            elif ttl_attribute not in fields:
+                item.pop(ttl_attribute, None)
+        misses = [customer_id for customer_id in lookup_ids if customer_id not in hits and customer_id not in absent]
+        # Loyalty points of hits are checked against PostgreSQL in the same query that resolves the misses
+        to_check = []
+        if 'LoyaltyPoints' in fields and not self.sync_is_fresh():
+            to_check = [customer_id for customer_id in hits if not self.loyalty_points_trusted(customer_id)]
+        to_fetch = to_check + misses
+        try:
+            rows = self.query_many_postgresql(to_fetch) if to_fetch else {}
+            # Only a query that succeeded proves the customers it did not return absent
+            for customer_id in misses:
+                if customer_id not in rows:
+                    self.remember_absent(customer_id)
+        except Exception as e:
+            print(f"Error fetching data from PostgreSQL: {e}")
+            rows = {}
+
+        for customer_id in to_check:
+            item = hits[customer_id]
+            customer_data = rows.get(customer_id)
+            if customer_data and customer_data['LoyaltyPoints'] != item.get('LoyaltyPoints'):
+                item['LoyaltyPoints'] = customer_data['LoyaltyPoints']
+                self.correct_loyalty_points(customer_data)
+
+        # BatchWriteItem cannot carry conditions. Bulk misses are backfilled like single ones, with a version-conditioned
+        # update_item per customer through write_to_cache, so a row older than the cached item loses.
+        backfill = []
+        for customer_id in misses:
+            if customer_id not in rows:
+                continue
+            admit, victims = self.cache_policy.admit(customer_id)
+            for victim in victims:
+                self.write_to_cache(victim, ('evict', victim))
+            if admit:
+                backfill.append({**rows[customer_id], **self.cache_policy.item_attributes()})
+        if backfill and self.conditional_writes:
+            for customer_data in backfill:
+                self.write_to_cache(customer_data['CustomerID'], ('backfill', customer_data))
+        elif backfill:
+            self.batch_insert_into_dynamodb(backfill)
+
+        results = {}
+        for customer_id in customer_ids:
+            if customer_id in hits:
+                results[customer_id] = hits[customer_id]
+            elif customer_id in rows:
+                results[customer_id] = project_item(rows[customer_id], fields)
+            else:
+                results[customer_id] = None
+        return results
+
+    def loyalty_points_trusted(self, customer_id):
+        # Cached loyalty points are current when every change goes through update_customer_fields and none is
+        # still queued for this customer
+        return self.write_api_only and not self.write_queue.is_pending(customer_id)
+
+    def update_in_primary(self, customer_id, fields, increments):
+        # One UPDATE ... RETURNING * on the primary, the committed row and its new version come back in the same
+        # round trip. fields sets values, increments adds to numeric columns such as LoyaltyPoints.
+        assert fields or increments, "Nothing to update"
+        assignments = ([f"{field_columns[field]} = %s" for field in fields] +
+                       [f"{field_columns[field]} = {field_columns[field]} + %s" for field in increments])
+        # The version is bumped here too, not only by the trigger of ChangeSync.py install, which sets the same
+        # OLD.version + 1. Without a new version the refresh of the cached item would be skipped.
+        if self.versioned_rows:
+            assignments.append("version = version + 1")
+        sql = f"UPDATE customer_info SET {', '.join(assignments)} WHERE customerid = %s RETURNING *"
+        params = list(fields.values()) + list(increments.values()) + [customer_id]
+        pg_pool = self.pg_pool
+        with self.tracer.span('postgresql.update', kind_client, pooled=bool(pg_pool)):
+            if pg_pool:
+                with pg_pool.connection() as pooled:
+                    cur = pooled.conn.cursor()
+                    cur.execute(sql, params)
+                    result = cur.fetchone()
+                    cur.close()
+            else:
+                conn = self.connect()
+                try:
+                    cur = conn.cursor()
+                    cur.execute(sql, params)
+                    result = cur.fetchone()
+                    cur.close()
+                    conn.commit()
+                finally:
+                    conn.close()
+        return row_to_customer_data(result) if result else None
+
+    def refresh_cached_item(self, customer_data):
+        # Writes a committed row over the cached item if there is one and it is older. A customer that is not
+        # cached stays that way, writes never add items the cache policy did not admit. A tombstone is no cached
+        # customer either, it is left to its ExpiresAt or to ChangeSync.py. Errors are raised, so the write queue
+        # retries them.
+        customer_id = customer_data['CustomerID']
+        self.invalidate_l1(customer_id)
+        attributes = {key: value for key, value in customer_data.items() if key != 'CustomerID'}
+        cached = ("attribute_exists(CustomerID) AND attribute_not_exists(#tombstone)" if self.negative_cache_tombstones
+                  else "attribute_exists(CustomerID)")
+        if 'Version' in customer_data:
+            refreshed = self.conditional_update(
+                customer_id, attributes, cached + " AND (attribute_not_exists(#version) OR #version < :version)",
+                {':version': customer_data['Version']}, raise_errors=True, lost_stat=None)
+        else:
+            # Without row versions from ChangeSync.py install, concurrent updates of one customer may land out of order
+            refreshed = self.conditional_update(customer_id, attributes, cached, {}, raise_errors=True, lost_stat=None)
+        self.count('refreshed' if refreshed else 'skipped', self.write_stats)
+
+    def drop_cached_item(self, customer_data):
+        # The update of the cached item failed for good, deleting the item makes the next read backfill the row
+        self.evict_from_dynamodb(customer_data['CustomerID'])
+
+    def update_customer_fields(self, customer_id, fields=None, increments=None, mode=None):
+        # Write path next to get_customer_data_fields: commits the change to PostgreSQL, then brings a cached item
+        # up to date, before returning with write_through, through the retrying write queue with write_behind.
+        # Returns the committed customer data, None if there is no such customer.
+        mode = mode or self.write_mode
+        fields = {f'Address.{field}' if field in address_fields else field: value for field, value in (fields or {}).items()}
+        increments = increments or {}
+        unknown = [field for field in list(fields) + list(increments) if field not in field_columns or field in ('CustomerID', 'Version')]
+        assert not unknown, f"Fields {', '.join(unknown)} cannot be updated"
+        with self.tracer.span('update_customer_fields', customer_id=customer_id, mode=mode):
+            customer_data = self.update_in_primary(customer_id, fields, increments)
+            self.count('updates', self.write_stats)
+            if customer_data is None:
+                self.count('not_found', self.write_stats)
+                return None
+            self.invalidate_l1(customer_id)
+            self.forget_absent(customer_id)
+            if mode == 'write_through':
+                try:
+                    self.refresh_cached_item(customer_data)
+                    return customer_data
+                except Exception as e:
+                    # PostgreSQL has committed, the queue keeps retrying the cached item
+                    print(f"Error updating the cached item, queued for retry: {e}")
+                    self.count('write_through_failures', self.write_stats)
+            self.write_queue.submit(customer_id, customer_data)
+            self.count('queued', self.write_stats)
+        return customer_data
+
+    def delete_from_dynamodb(self, customer_id):
+        # Removes a customer from the cache. Queued backfills are written first, otherwise they would land after
+        # the delete and turn the next misses into hits.
+        self.write_behind.flush()
+        self.invalidate_l1(customer_id)
+        self.cache_policy.removed(customer_id)
+        try:
+            self.table.delete_item(Key={'CustomerID': customer_id})
+        except Exception as e:
+            print(f"Error deleting data from DynamoDB: {e}")
+
+    def delete_many_from_dynamodb(self, customer_ids):
+        self.write_behind.flush()
+        for customer_id in customer_ids:
+            self.invalidate_l1(customer_id)
+            self.cache_policy.removed(customer_id)
+        try:
+            with self.table.batch_writer() as batch:
+                for customer_id in customer_ids:
+                    batch.delete_item(Key={'CustomerID': customer_id})
+        except Exception as e:
+            print(f"Error deleting data from DynamoDB: {e}")
+
+    def stats(self):
+        # Counters of every tier that exists, for logs and benchmark output
+        stats = {'reads': dict(self.read_stats), 'writes': dict(self.write_stats),
+                 'single_flight': dict(self.single_flight.stats),
+                 'cache_policy': {'policy': self.cache_policy.describe(), **self.cache_policy.stats},
+                 'write_behind': dict(self.write_behind.stats), 'write_queue': dict(self.write_queue.stats)}
+        if self.l1_cache is not None:
+            stats['l1_cache'] = dict(self.l1_cache.stats)
+        if self.negative_cache is not None:
+            stats['negative_cache'] = dict(self.negative_cache.stats)
+        if self.access_log is not None:
+            stats['access_log'] = {'recorded': self.access_log.recorded, 'path': self.access_log.path}
+        if self.item_codec:
+            stats['item_codec'] = dict(self.item_codec.stats)
+        if self._shard_stats:
+            # Summed over the routers of all threads
+            with self._connect_lock:
+                stats['shard_router'] = {stat: sum(router_stats[stat] for router_stats in self._shard_stats)
+                                         for stat in self._shard_stats[0]}
+        if self._pg_router:
+            stats['read_routing'] = {**self._pg_router.stats, 'replica_lag': self._pg_router.lags()}
+        if self._pg_pool:
+            stats['connection_pool'] = dict(self._pg_pool.stats)
+        return stats
+
+    def close(self):
+        # Writes everything still queued, then closes the pools. Clients that were never used were never created.
+        if self.access_log is not None:
+            self.access_log.close()
+        self.write_behind.close()
+        self.write_queue.close()
+        if self._pg_router:
+            self._pg_router.close(close_primary=False)
+        if self._pg_pool:
+            self._pg_pool.close()
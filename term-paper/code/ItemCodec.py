@@ -0,0 +1,174 @@
+import json
+import math
+import struct
+import zlib
+from datetime import date
+from decimal import Decimal
+
+# Attributes stored as they are: the key, the row version used in condition expressions and the TTL attribute
+plain_attributes = ('CustomerID', 'Version', 'ExpiresAt')
+# Short names of the hot fields, which stay separate attributes so a ProjectionExpression can still pick them.
+# Every code ends in a digit so none of them is a DynamoDB reserved word.
+hot_codes = {'FirstName': 'f0', 'LastName': 'l0', 'Email': 'e0', 'LoyaltyPoints': 'p0', 'Address.Street': 's0'}
+# Cold dates are packed into one binary attribute as three day numbers, 0 for a missing date
+packed_attribute = 'd0'
+packed_fields = ('DateOfBirth', 'AccountCreationDate', 'LastPurchaseDate')
+packed_format = '>3i'
+# Every other field goes into one blob, compressed with zlib when that makes it smaller
+blob_attribute = 'z0'
+blob_raw = b'\x00'
+blob_zlib = b'\x01'
+
+
+def flatten(item):
+    # {'Address': {'City': ...}} becomes {'Address.City': ...}, the field names the read path uses
+    fields = {}
+    for name, value in item.items():
+        if isinstance(value, dict):
+            for sub_name, sub_value in value.items():
+                fields[f'{name}.{sub_name}'] = sub_value
+        else:
+            fields[name] = value
+    return fields
+
+
+def set_field(item, field, value):
+    if '.' in field:
+        name, sub_name = field.split('.', 1)
+        item.setdefault(name, {})[sub_name] = value
+    else:
+        item[field] = value
+
+
+def json_value(value):
+    # Numbers read back from DynamoDB are Decimals
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Cannot store {type(value).__name__} in the item blob")
+
+
+# Compact storage format of the cached items. Hot fields keep their own short attribute, the dates are packed
+# into 12 bytes and all remaining fields share one compressed blob. encode() accepts partial items, but the
+# packed and blob attributes are always rewritten whole, so a partial write may only touch hot and plain fields,
+# like the LoyaltyPoints correction does.
+class ItemCodec:
+    def __init__(self, hot_codes=hot_codes, compression_level=9):
+        self.hot_codes = hot_codes
+        self.compression_level = compression_level
+        self.stats = {'encoded': 0, 'decoded': 0, 'blobs_compressed': 0, 'blobs_raw': 0}
+
+    def attribute_for(self, field):
+        if field in plain_attributes:
+            return field
+        if field in self.hot_codes:
+            return self.hot_codes[field]
+        if field in packed_fields:
+            return packed_attribute
+        return blob_attribute
+
+    def projection(self, fields):
+        # ProjectionExpression of the stored attributes holding these fields, a whole map like Address needs
+        # its hot sub-fields and the blob
+        attributes = []
+        for field in fields:
+            if field in plain_attributes or field in self.hot_codes or field in packed_fields or '.' in field:
+                names = [self.attribute_for(field)]
+            else:
+                names = [code for hot_field, code in self.hot_codes.items() if hot_field.startswith(f'{field}.')]
+                names.append(blob_attribute)
+            attributes.extend(name for name in names if name not in attributes)
+        return ", ".join(attributes)
+
+    def encode(self, item):
+        encoded = {}
+        dates = {}
+        blob = {}
+        for field, value in flatten(item).items():
+            if field in plain_attributes:
+                encoded[field] = value
+            elif field in self.hot_codes:
+                encoded[self.hot_codes[field]] = value
+            elif field in packed_fields:
+                dates[field] = value
+            else:
+                blob[field] = value
+        if dates:
+            encoded[packed_attribute] = struct.pack(packed_format, *(
+                date.fromisoformat(dates[field]).toordinal() if dates.get(field) else 0 for field in packed_fields))
+        if blob:
+            encoded[blob_attribute] = self.pack_blob(blob)
+        self.stats['encoded'] += 1
+        return encoded
+
+    def pack_blob(self, blob):
+        raw = json.dumps(blob, separators=(',', ':'), default=json_value).encode()
+        compressed = zlib.compress(raw, self.compression_level)
+        # Short blobs often grow when compressed, they are stored raw
+        if len(compressed) < len(raw):
+            self.stats['blobs_compressed'] += 1
+            return blob_zlib + compressed
+        self.stats['blobs_raw'] += 1
+        return blob_raw + raw
+
+    def decode(self, item, fields=None):
+        # Returns the item in the nested format of PostgreSQL rows, limited to fields if given. The packed dates
+        # and the blob are only unpacked when one of their fields is wanted.
+        wanted = set(fields) if fields is not None else None
+
+        def is_wanted(field):
+            return wanted is None or field in wanted or field.split('.', 1)[0] in wanted
+
+        decoded = {}
+        for name in plain_attributes:
+            if name in item:
+                decoded[name] = item[name]
+        for field, code in self.hot_codes.items():
+            if code in item and is_wanted(field):
+                set_field(decoded, field, item[code])
+        if packed_attribute in item and any(is_wanted(field) for field in packed_fields):
+            days = struct.unpack(packed_format, bytes(item[packed_attribute]))
+            for field, day in zip(packed_fields, days):
+                if day and is_wanted(field):
+                    decoded[field] = date.fromordinal(day).isoformat()
+        if blob_attribute in item:
+            blob = bytes(item[blob_attribute])
+            blob_wanted = wanted is None or bool(wanted - set(self.hot_codes) - set(packed_fields) - set(plain_attributes))
+            if blob_wanted:
+                raw = zlib.decompress(blob[1:]) if blob[:1] == blob_zlib else blob[1:]
+                for field, value in json.loads(raw).items():
+                    if is_wanted(field):
+                        set_field(decoded, field, value)
+        self.stats['decoded'] += 1
+        return decoded
+
+
+def number_size(value):
+    # DynamoDB stores numbers in roughly one byte per two significant digits plus one
+    digits = str(value).lstrip('-').replace('.', '').strip('0') or '0'
+    return (len(digits) + 1) // 2 + 1
+
+
+def attribute_size(value):
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return number_size(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(name.encode()) + attribute_size(sub_value) + 1 for name, sub_value in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(element) + 1 for element in value)
+    return len(bytes(value))
+
+
+def item_size(item):
+    # Size DynamoDB bills for, attribute names count as much as the values
+    return sum(len(name.encode()) + attribute_size(value) for name, value in item.items())
+
+
+def capacity_units(size):
+    # (write units of a put, read units of a strongly consistent get, read units of an eventually consistent get)
+    # A get is billed on the whole item even with a ProjectionExpression.
+    reads = math.ceil(size / 4096)
+    return math.ceil(size / 1024), reads, reads / 2
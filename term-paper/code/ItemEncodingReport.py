@@ -0,0 +1,112 @@
+import argparse
+import os
+import boto3
+from dotenv import load_dotenv
+from prettytable import PrettyTable
+from ItemCodec import ItemCodec, capacity_units, item_size
+from LoadData_NOSQL import read_segment
+from Measurement import LatencyHistogram
+
+# Bytes per item and consumed capacity of the verbose and the compact item format. The sizes are computed with
+# DynamoDB's item size rules; --measure also writes the items to the table and reads them back with
+# ReturnConsumedCapacity. --extra-bytes adds a rarely read Preferences attribute of that size to every item to
+# see how the formats behave as the schema grows. That text is synthetic and repetitive, real attributes compress
+# less well.
+local_sample_data = 'term-paper/data/customer_info_sample.csv'
+measure_prefix = 'ENCODING-'
+
+
+def grow(item, extra_bytes):
+    if not extra_bytes:
+        return item
+    words = ['newsletter', 'weekly', 'email', 'sms', 'promotions', 'electronics', 'books', 'garden', 'sports', 'none']
+    text = ""
+    i = int(item['CustomerID'][3:]) if item['CustomerID'][3:].isdigit() else 0
+    while len(text) < extra_bytes:
+        text += f"{words[i % len(words)]}:{words[(i * 7 + 3) % len(words)]};"
+        i += 1
+    return {**item, 'Preferences': text[:extra_bytes]}
+
+
+def size_stats(items):
+    histogram = LatencyHistogram()
+    units = [0, 0, 0.0]
+    over = {1024: 0, 4096: 0}
+    for item in items:
+        size = item_size(item)
+        histogram.record(size)
+        for i, value in enumerate(capacity_units(size)):
+            units[i] += value
+        for boundary in over:
+            over[boundary] += size > boundary
+    return {'mean': histogram.mean(), 'p99': histogram.percentile(99), 'max': histogram.max,
+            'wcu': units[0] / len(items), 'rcu': units[2] / len(items), 'over_1kb': over[1024], 'over_4kb': over[4096]}
+
+
+def consumed_capacity(table, items, projection):
+    # Writes the items under a separate key prefix, reads them back and deletes them again
+    written = read = 0.0
+    payload = 0
+    try:
+        for item in items:
+            item = {**item, 'CustomerID': measure_prefix + item['CustomerID']}
+            response = table.put_item(Item=item, ReturnConsumedCapacity='TOTAL')
+            written += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+            response = table.get_item(Key={'CustomerID': item['CustomerID']}, ProjectionExpression=projection,
+                                      ReturnConsumedCapacity='TOTAL')
+            read += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+            payload += item_size(response.get('Item', {}))
+    finally:
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.delete_item(Key={'CustomerID': measure_prefix + item['CustomerID']})
+    return {'wcu': written / len(items), 'rcu': read / len(items), 'payload': payload / len(items)}
+
+
+def main(args):
+    items = [grow(item, args.extra_bytes) for _, item in read_segment(args.file, 0, 1, args.items, 0)]
+    codec = ItemCodec()
+    formats = {'verbose': items, 'compact': [codec.encode(item) for item in items]}
+    fields = [f.strip() for f in args.fields.split(",")]
+    projections = {'verbose': ", ".join(fields), 'compact': codec.projection(fields)}
+
+    results = PrettyTable()
+    results.field_names = ["Format", "Mean bytes/item", "p99 bytes", "Max bytes", "WCU/put", "RCU/get (eventual)",
+                           "Items > 1 KB", "Items > 4 KB"]
+    for name, stored in formats.items():
+        stats = size_stats(stored)
+        results.add_row([name, round(stats['mean'], 1), stats['p99'], stats['max'], round(stats['wcu'], 3),
+                         round(stats['rcu'], 3), stats['over_1kb'], stats['over_4kb']])
+    print(f"{len(items)} items, {args.extra_bytes} extra bytes each")
+    print(results)
+    print(f"Compact blobs: {codec.stats['blobs_compressed']} compressed, {codec.stats['blobs_raw']} stored raw")
+
+    if args.measure:
+        session = boto3.Session(
+            aws_access_key_id=os.getenv("ACCESS_KEY", "local"),
+            aws_secret_access_key=os.getenv("SECRET_KEY", "local"),
+            aws_session_token=os.getenv("SESSION_TOKEN")
+        )
+        dynamodb = session.resource('dynamodb', region_name=os.getenv("AWS_REGION", "us-east-1"),
+                                    endpoint_url=os.getenv("DYNAMODB_ENDPOINT"))
+        table = dynamodb.Table(os.getenv("NOSQL_NAME", "customer_info"))
+        measured = PrettyTable()
+        measured.field_names = ["Format", "Consumed WCU/put", "Consumed RCU/get", "Projected bytes/get"]
+        for name, stored in formats.items():
+            stats = consumed_capacity(table, stored[:args.measure], projections[name])
+            measured.add_row([name, round(stats['wcu'], 3), round(stats['rcu'], 3), round(stats['payload'], 1)])
+        print(f"Measured on {table.name} with {args.measure} items per format, reads project {args.fields}")
+        print(measured)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Bytes per item and consumed capacity of the DynamoDB item formats")
+    parser.add_argument("--file", default=local_sample_data, help="CSV file with the items")
+    parser.add_argument("--items", type=int, default=3000, help="Number of items to size")
+    parser.add_argument("--extra-bytes", type=int, default=0, help="Size of a rarely read attribute added to every item")
+    parser.add_argument("--fields", default="FirstName, LastName, Email, Address.Street", help="Fields the measured reads fetch")
+    parser.add_argument("--measure", type=int, default=0,
+                        help="Write and read this many items per format against NOSQL_NAME (DYNAMODB_ENDPOINT for DynamoDB Local)")
+    main(parser.parse_args())
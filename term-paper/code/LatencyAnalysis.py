@@ -0,0 +1,69 @@
+import numpy as np
+from Measurement import read_results_header
+
+
+def map_results(path):
+    # Every scenario of a results file with its latencies as a read-only memory map (int64 nanoseconds), nothing
+    # is read into memory until it is used
+    header = read_results_header(path)
+    results = {}
+    for name, scenario in header['scenarios'].items():
+        latencies = (np.memmap(path, dtype='<i8', mode='r', offset=scenario['offset'], shape=(scenario['count'],))
+                     if scenario['count'] else np.empty(0, dtype='<i8'))
+        results[name] = {**scenario, 'latencies_ns': latencies}
+    return results
+
+
+def cumulative_seconds(latencies_ns):
+    # Running total after every request, summed in int64 nanoseconds so long runs do not lose precision
+    return np.cumsum(latencies_ns, dtype=np.int64) / 1e9
+
+
+def percentiles(latencies_ns, ps):
+    return np.percentile(latencies_ns, ps)
+
+
+def downsample(values, points=2000):
+    # (request numbers, values) at no more than points evenly spaced requests, enough to draw a curve of any length
+    if len(values) <= points:
+        return np.arange(1, len(values) + 1), np.asarray(values)
+    indexes = np.linspace(0, len(values) - 1, points).astype(np.int64)
+    return indexes + 1, np.asarray(values[indexes])
+
+
+# Latency of a workload with any miss rate, modelled from the measured latencies of hits (the best case scenario)
+# and misses (the worst case scenario) instead of blending their means. The distribution at miss rate m is the
+# mixture F(x) = (1 - m) * F_hit(x) + m * F_miss(x), its percentiles are found exactly on the measured values.
+class MissRateModel:
+    def __init__(self, hit_latencies_ns, miss_latencies_ns):
+        self.hits = np.sort(hit_latencies_ns)
+        self.misses = np.sort(miss_latencies_ns)
+        # Both empirical CDFs at every measured value, computed once for all miss rates
+        self.values = np.concatenate([self.hits, self.misses])
+        self.values.sort()
+        self.hit_cdf = np.searchsorted(self.hits, self.values, side='right') / len(self.hits)
+        self.miss_cdf = np.searchsorted(self.misses, self.values, side='right') / len(self.misses)
+
+    def percentiles(self, miss_rate, ps):
+        cdf = (1 - miss_rate) * self.hit_cdf + miss_rate * self.miss_cdf
+        indexes = np.searchsorted(cdf, np.asarray(ps, dtype=float) / 100 - 1e-12)
+        return self.values[np.minimum(indexes, len(self.values) - 1)]
+
+    def mean(self, miss_rate):
+        return (1 - miss_rate) * self.hits.mean() + miss_rate * self.misses.mean()
+
+    def curve(self, miss_rates, ps=(50, 99)):
+        # {percentile: values over miss_rates, 'mean': values over miss_rates}
+        rows = np.array([self.percentiles(miss_rate, ps) for miss_rate in miss_rates])
+        curve = {p: rows[:, i] for i, p in enumerate(ps)}
+        curve['mean'] = np.array([self.mean(miss_rate) for miss_rate in miss_rates])
+        return curve
+
+    def simulate(self, miss_rate, requests, seed=42):
+        # Latencies of requests that miss independently with probability miss_rate, each drawn from the measured
+        # hit or miss latencies, so a modelled run keeps the spread and the tail of the measurements
+        rng = np.random.default_rng(seed)
+        missed = rng.random(requests) < miss_rate
+        latencies = rng.choice(self.hits, size=requests)
+        latencies[missed] = rng.choice(self.misses, size=int(missed.sum()))
+        return latencies
@@ -1,69 +1,240 @@
-import boto3
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
+import argparse
 import os
 import csv
+import json
+import queue
+import threading
+import time
+import zlib
+from HybridDatastore import HybridDatastore, aws_variables, flag
+from ItemCodec import ItemCodec
+from ShardRouter import ShardRouter, shards_from_spec
 
-load_dotenv()
-variable_names = ["ACCESS_KEY", "SECRET_KEY", "SESSION_TOKEN", "NOSQL_NAME", "AWS_REGION"]
-
-assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
-env_vars = {var: os.getenv(var) for var in variable_names}
-access_key = env_vars["ACCESS_KEY"]
-secret_key = env_vars["SECRET_KEY"]
-session_token = env_vars["SESSION_TOKEN"]
-dynamodb_name = env_vars["NOSQL_NAME"]
-aws_region = env_vars["AWS_REGION"]
 local_sample_data = 'term-paper/data/customer_info_sample.csv'
+checkpoint_file = 'term-paper/data/load_nosql_checkpoint.json'
+throttling_errors = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+
+
+def row_to_item(row):
+    return {
+        'CustomerID': row[0],
+        'FirstName': row[1],
+        'LastName': row[2],
+        'Email': row[3],
+        'PhoneNumber': row[4],
+        'Address': {
+            'Street': row[5],
+            'City': row[6],
+            'State': row[7],
+            'PostalCode': row[8]
+        },
+        'DateOfBirth': row[9],
+        'AccountCreationDate': row[10],
+        'LastPurchaseDate': row[11],
+        'LoyaltyPoints': int(row[12])
+    }
+
+
+def segment_of(customer_id, segments):
+    # Every segment owns a fixed range of the CRC32 hash space of the key
+    return zlib.crc32(customer_id.encode()) * segments >> 32
+
+
+def read_segment(file_path, segment, segments, limit, after_row):
+    # Lazily yields (row number, item) for the rows of one segment, skipping rows already loaded before
+    with open(file_path, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)
+        for i, row in enumerate(reader, start=1):
+            if limit and i > limit:
+                break
+            if i <= after_row or segment_of(row[0], segments) != segment:
+                continue
+            yield i, row_to_item(row)
+
 
-session = boto3.Session(
-    aws_access_key_id=access_key,
-    aws_secret_access_key=secret_key,
-    aws_session_token=session_token
-)
-
-dynamodb = session.resource('dynamodb', region_name=aws_region)
-table = dynamodb.Table(dynamodb_name)
-
-
-# Inserts first 1000 records from the sample data into the DynamoDB table
-sample_data = []
-
-with open(local_sample_data, 'r') as file:
-    reader = csv.reader(file)
-    for i, row in enumerate(reader):
-        if i == 0:
-            continue
-        if i > 1000:
-            break
-        item = {
-            'CustomerID': row[0],
-            'FirstName': row[1],
-            'LastName': row[2],
-            'Email': row[3],
-            'PhoneNumber': row[4],
-            'Address': {
-                'Street': row[5],
-                'City': row[6],
-                'State': row[7],
-                'PostalCode': row[8]
-            },
-            'DateOfBirth': row[9],
-            'AccountCreationDate': row[10],
-            'LastPurchaseDate': row[11],
-            'LoyaltyPoints': int(row[12])
-        }
-        sample_data.append(item)  
-
-for item in sample_data:
+def split_segments(file_path, segments, limit, after_rows, queues):
+    # One pass over the file for all segments: every row is hashed once and put on the bounded queue of its
+    # segment, a None on every queue ends the segments
     try:
-        table.put_item(Item=item)
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'ConditionalCheckFailedException':
-            print(f"Conditional check failed for item {item['CustomerID']}.")
-        else:
-            print(f"Failed to insert item {item['CustomerID']}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred for item {item['CustomerID']}: {e}")
-print(f'Data loading process completed. Total of {len(sample_data)} items loaded into the table.')
\ No newline at end of file
+        with open(file_path, 'r') as file:
+            reader = csv.reader(file)
+            next(reader)
+            for i, row in enumerate(reader, start=1):
+                if limit and i > limit:
+                    break
+                segment = segment_of(row[0], segments)
+                if i > after_rows[segment]:
+                    queues[segment].put((i, row_to_item(row)))
+    finally:
+        for rows in queues:
+            rows.put(None)
+
+
+# Shared by all segments: grows the pause between chunks on throttling and shrinks it again on success
+class AdaptiveBackoff:
+    def __init__(self, initial=0.05, maximum=5.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self.delay = min(max(self.delay * 2, self.initial), self.maximum)
+            return self.delay
+
+    def succeeded(self):
+        with self._lock:
+            self.delay = self.delay * 0.8 if self.delay > self.initial / 10 else 0.0
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+
+class Checkpoint:
+    def __init__(self, path, settings, reset=False):
+        self.path = path
+        self.settings = settings
+        self.rows = {}
+        self._lock = threading.Lock()
+        if not reset and os.path.exists(path):
+            with open(path, 'r') as file:
+                saved = json.load(file)
+            assert saved['settings'] == settings, f"Checkpoint {path} was written with other settings, rerun with --reset"
+            self.rows = {int(segment): row for segment, row in saved['rows'].items()}
+
+    def last_row(self, segment):
+        return self.rows.get(segment, 0)
+
+    def save(self, segment, row):
+        with self._lock:
+            self.rows[segment] = row
+            # Write then rename so an interrupted save never leaves a broken checkpoint
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump({'settings': self.settings, 'rows': self.rows}, file)
+            os.replace(self.path + '.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def write_chunk(table, items, backoff):
+    while True:
+        backoff.wait()
+        try:
+            with table.batch_writer() as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+            backoff.succeeded()
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] not in throttling_errors:
+                raise
+            # put_item is idempotent, so the whole chunk can simply be written again
+            print(f"Throttled, backing off for {backoff.throttled():.2f} seconds")
+
+
+def load_segment(table, rows, segment, chunk_size, checkpoint, backoff, progress, codec=None):
+    chunk = []
+    last_row = checkpoint.last_row(segment)
+    for i, item in iter(rows.get, None):
+        chunk.append(codec.encode(item) if codec else item)
+        last_row = i
+        if len(chunk) >= chunk_size:
+            write_chunk(table, chunk, backoff)
+            checkpoint.save(segment, last_row)
+            progress[segment] += len(chunk)
+            chunk = []
+    if chunk:
+        write_chunk(table, chunk, backoff)
+        checkpoint.save(segment, last_row)
+        progress[segment] += len(chunk)
+
+
+def load(session, region, table_name, file_path=local_sample_data, limit=1000, segments=8, chunk_size=500,
+         checkpoint_path=checkpoint_file, reset=False, shards=None, compact=False, endpoint_url=None, config=None):
+    # The item format is part of the settings, a checkpoint of a load in the other format is not resumed
+    checkpoint = Checkpoint(checkpoint_path, {'file': file_path, 'limit': limit, 'segments': segments, 'compact': compact}, reset)
+    backoff = AdaptiveBackoff()
+    progress = [0] * segments
+    errors = []
+    # boto3 resources are not thread safe, every segment gets its own, created here before the threads start
+    # With shards, a spec as in DYNAMODB_SHARDS, every item goes to the shard the router assigns it to
+    if shards:
+        tables = [ShardRouter(shards_from_spec(shards, session, table_name, region, config)) for _ in range(segments)]
+    else:
+        # endpoint_url points at DynamoDB Local or a moto server instead of AWS, config is the botocore Config
+        tables = [session.resource('dynamodb', region_name=region, endpoint_url=endpoint_url, config=config).Table(table_name)
+                  for _ in range(segments)]
+
+    # The file is read once by one reader thread, a queue holds two chunks per segment
+    queues = [queue.Queue(maxsize=2 * chunk_size) for _ in range(segments)]
+
+    def read():
+        try:
+            split_segments(file_path, segments, limit, [checkpoint.last_row(segment) for segment in range(segments)], queues)
+        except Exception as e:
+            errors.append(e)
+            print(f"Reading {file_path} failed, rerun to resume from the checkpoint: {e}")
+
+    def run(segment):
+        try:
+            load_segment(tables[segment], queues[segment], segment, chunk_size, checkpoint, backoff, progress,
+                         ItemCodec() if compact else None)
+        except Exception as e:
+            errors.append(e)
+            print(f"Segment {segment} failed, rerun to resume from the checkpoint: {e}")
+            # Keeps taking the rows of the failed segment, so the reader is never blocked on its full queue
+            for _ in iter(queues[segment].get, None):
+                pass
+
+    start = time.time()
+    threads = [threading.Thread(target=read)] + [threading.Thread(target=run, args=(segment,)) for segment in range(segments)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(5)
+            if thread.is_alive():
+                print(f"{sum(progress)} items loaded, {sum(progress) / (time.time() - start):.1f} items/sec")
+    elapsed = time.time() - start
+    loaded = sum(progress)
+    print(f"Loaded {loaded} items in {elapsed:.1f} seconds ({loaded / elapsed if elapsed else 0:.1f} items/sec, "
+          f"{backoff.throttles} throttled chunks)")
+    if not errors:
+        checkpoint.remove()
+    return loaded
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    variable_names = ["NOSQL_NAME", "AWS_REGION"] + ([] if os.getenv("DYNAMODB_ENDPOINT") else aws_variables)
+    assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
+
+    parser = argparse.ArgumentParser(description="Load sample data into DynamoDB with parallel batch writers")
+    parser.add_argument("--file", default=local_sample_data, help="CSV file to load")
+    parser.add_argument("--limit", type=int, default=1000, help="Load only the first N rows, 0 loads all of them")
+    parser.add_argument("--segments", type=int, default=8, help="Number of parallel writers, each owns a key range")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Items written between checkpoints")
+    parser.add_argument("--checkpoint", default=checkpoint_file, help="Checkpoint file used to resume a load")
+    parser.add_argument("--reset", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--shards", default=os.getenv("DYNAMODB_SHARDS"),
+                        help="Shard spec as in DYNAMODB_SHARDS, defaults to that variable")
+    parser.add_argument("--compact", action="store_true", default=flag(os.getenv("COMPACT_ITEMS") or "0"),
+                        help="Store the items in the compact format of ItemCodec.py, defaults to COMPACT_ITEMS")
+    args = parser.parse_args()
+
+    # Only the session and the client settings of the datastore are used, the loader makes its own resources
+    store = HybridDatastore.from_env()
+    loaded = load(store.session, store.aws_region, store.dynamodb_name, args.file, args.limit, args.segments,
+                  args.chunk_size, args.checkpoint, args.reset, args.shards, args.compact, store.dynamodb_endpoint,
+                  store.client_config())
+    store.close()
+    print(f'Data loading process completed. Total of {loaded} items loaded into the table.')
@@ -2,72 +2,242 @@
 import psycopg2
 from psycopg2 import OperationalError, errors
 from dotenv import load_dotenv
+import argparse
+import io
 import os
+import time
+from ChangeSync import install_sql, trigger_sql
 
-load_dotenv()
-variable_names = [
-    "DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_ENDPOINT",
-    "DATABASE_NAME"
-]
-assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
-env_vars = {var: os.getenv(var) for var in variable_names}
-rds_user = env_vars["DATABASE_USERNAME"]
-rds_pass = env_vars["DATABASE_PASSWORD"]
-rds_endpoint = env_vars["DATABASE_ENDPOINT"]
-rds_name = env_vars["DATABASE_NAME"]
 local_sample_data = 'term-paper/data/customer_info_sample.csv'
+columns = ('customerid', 'firstname', 'lastname', 'email', 'phonenumber', 'street', 'city', 'state', 'postalcode',
+           'dateofbirth', 'accountcreationdate', 'lastpurchasedate', 'loyaltypoints')
 
-try:
-    conn_string = f"dbname='{rds_name}' user='{rds_user}' host='{rds_endpoint}' password='{rds_pass}'"
-    conn = psycopg2.connect(conn_string)
+# The version and updatedat columns are only added together with the triggers of ChangeSync.py that maintain them
+create_table_sql = """
+CREATE TABLE IF NOT EXISTS customer_info (
+    CustomerID VARCHAR PRIMARY KEY,
+    FirstName VARCHAR,
+    LastName VARCHAR,
+    Email VARCHAR UNIQUE,
+    PhoneNumber VARCHAR,
+    Street VARCHAR,
+    City VARCHAR,
+    State VARCHAR,
+    PostalCode VARCHAR,
+    DateOfBirth DATE,
+    AccountCreationDate DATE,
+    LastPurchaseDate DATE,
+    LoyaltyPoints INT
+);
+""" + install_sql
+
+
+def read_chunks(file_path, chunk_size):
+    # Yields the CSV in chunks of chunk_size lines, so memory stays bounded however large the file is
+    with open(file_path, 'r') as f:
+        next(f)
+        while True:
+            chunk = io.StringIO()
+            lines = 0
+            for line in f:
+                chunk.write(line)
+                lines += 1
+                if lines == chunk_size:
+                    break
+            if not lines:
+                return
+            chunk.seek(0)
+            yield chunk, lines
+
+
+def copy_into(conn, table_name, file_path, chunk_size):
+    cursor = conn.cursor()
+    rows = 0
+    start = time.time()
+    for chunk, lines in read_chunks(file_path, chunk_size):
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", chunk)
+        conn.commit()
+        rows += lines
+        print(f"{rows} rows copied into '{table_name}' ({rows / (time.time() - start):.1f} rows/sec)")
+    cursor.close()
+    return rows, time.time() - start
+
+
+def covering_columns(fields):
+    # Field names as used by the hybrid reads (FirstName, Street or Address.Street) to customer_info columns
+    selected = [field.split('.')[-1].strip().lower() for field in fields]
+    unknown = [column for column in selected if column not in columns[1:]]
+    assert not unknown, f"Unknown fields for the covering index: {', '.join(unknown)}"
+    return selected
+
+
+def has_version_column(cursor, table_name):
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'version'", (table_name,))
+    return cursor.fetchone() is not None
+
+
+def create_covering_index(cursor, table_name, index_name, fields, concurrently=False):
+    # The narrow lookups of PerformanceEval.py select customerid, the requested columns and version. With all of
+    # them in the index, PostgreSQL answers them with an index-only scan once the visibility map is set by VACUUM.
+    # concurrently keeps a live table writable during the build, it cannot run inside a transaction block.
+    versioned = has_version_column(cursor, table_name)
+    included = ", ".join(dict.fromkeys(covering_columns(fields) + (['version'] if versioned else [])))
+    cursor.execute(f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {index_name} "
+                   f"ON {table_name} (customerid) INCLUDE ({included})")
+
+
+def vacuum_analyze(conn):
+    # VACUUM cannot run inside a transaction block
+    conn.autocommit = True
     cursor = conn.cursor()
+    cursor.execute("VACUUM (ANALYZE) customer_info")
+    cursor.close()
+    conn.autocommit = False
+
+
+def has_change_triggers(cursor):
+    cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'customer_info_changes' AND tgrelid = 'customer_info'::regclass")
+    return cursor.fetchone() is not None
+
 
-    # Create the table if it doesn't exist
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS customer_info (
-        CustomerID VARCHAR PRIMARY KEY,
-        FirstName VARCHAR,
-        LastName VARCHAR,
-        Email VARCHAR UNIQUE,
-        PhoneNumber VARCHAR,
-        Street VARCHAR,
-        City VARCHAR,
-        State VARCHAR,
-        PostalCode VARCHAR,
-        DateOfBirth DATE,
-        AccountCreationDate DATE,
-        LastPurchaseDate DATE,
-        LoyaltyPoints INT
-    );
-    """
-    cursor.execute(create_table_sql)
+def swap_load(conn, file_path, chunk_size, covering_fields=None):
+    # Full reload: COPY into a new unlogged table without indexes, make it logged, build the indexes, then swap it
+    # in with renames. Readers keep using the old table until the swap transaction commits.
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS customer_info_new")
+    cursor.execute("CREATE UNLOGGED TABLE customer_info_new (LIKE customer_info INCLUDING DEFAULTS)")
     conn.commit()
-    print("Table 'customer_info' has been created.")
+    rows, copy_time = copy_into(conn, 'customer_info_new', file_path, chunk_size)
 
-    # Delete all pre-existing rows in the table
-    cursor.execute("DELETE FROM customer_info;")
+    start = time.time()
+    versioned = has_version_column(cursor, 'customer_info')
+    if versioned:
+        # Reloaded rows continue from the old row versions, so version-conditioned cache writes keep working
+        cursor.execute("""
+            UPDATE customer_info_new SET version = customer_info.version + 1
+            FROM customer_info WHERE customer_info_new.customerid = customer_info.customerid
+        """)
+    cursor.execute("ALTER TABLE customer_info_new SET LOGGED")
+    cursor.execute("ALTER TABLE customer_info_new ADD CONSTRAINT customer_info_new_pkey PRIMARY KEY (customerid)")
+    cursor.execute("CREATE UNIQUE INDEX customer_info_new_email_key ON customer_info_new (email)")
+    if versioned:
+        cursor.execute("CREATE INDEX customer_info_new_updatedat ON customer_info_new (updatedat)")
+    if covering_fields:
+        create_covering_index(cursor, 'customer_info_new', 'customer_info_new_covering', covering_fields)
     conn.commit()
-    print("All pre-existing rows in 'customer_info' have been deleted.")
-
-    # Load sample data into the table
-    with open(local_sample_data, 'r') as f:
-        next(f)  
-        cursor.copy_from(f, 'customer_info', sep=',', columns=('customerid', 'firstname', 'lastname',
-                                                       'email', 'phonenumber', 'street',
-                                                       'city', 'state', 'postalcode',
-                                                       'dateofbirth', 'accountcreationdate', 
-                                                       'lastpurchasedate', 'loyaltypoints'))
+    index_time = time.time() - start
+    print(f"Indexes built in {index_time:.2f} seconds.")
+
+    start = time.time()
+    cursor.execute("SET LOCAL lock_timeout = '10s'")
+    triggers = has_change_triggers(cursor)
+    cursor.execute("ALTER TABLE customer_info RENAME TO customer_info_old")
+    cursor.execute("ALTER TABLE customer_info_new RENAME TO customer_info")
+    cursor.execute("DROP TABLE customer_info_old")
+    cursor.execute("ALTER INDEX customer_info_new_pkey RENAME TO customer_info_pkey")
+    cursor.execute("ALTER INDEX customer_info_new_email_key RENAME TO customer_info_email_key")
+    if versioned:
+        cursor.execute("ALTER INDEX customer_info_new_updatedat RENAME TO customer_info_updatedat")
+    if covering_fields:
+        cursor.execute("ALTER INDEX customer_info_new_covering RENAME TO customer_info_covering")
+    if triggers:
+        # The change sync triggers of ChangeSync.py belong to the old table and have to be recreated. Only the
+        # triggers, the indexes were all built before the lock was taken.
+        cursor.execute(trigger_sql)
     conn.commit()
-    print("Sample data has been loaded into the 'customer_info' table.")
-
-except OperationalError as e:
-    print(f"A connection error occurred: {e}")
-except errors.UniqueViolation as e:
-    print(f"An error occurred within psycopg2: {e}")
-    conn.rollback()
-except Exception as e:
-    print(f"An unexpected error occurred: {e}")
-    conn.rollback()
-finally:
+    lock_time = time.time() - start
     cursor.close()
-    conn.close()
\ No newline at end of file
+    return rows, copy_time, lock_time
+
+
+def merge_load(conn, file_path, chunk_size, covering_fields=None):
+    # Incremental delta: COPY into an unlogged staging table, then upsert into customer_info. Only rows that
+    # actually changed are updated, and the live table is never emptied.
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS customer_info_staging")
+    cursor.execute(f"CREATE UNLOGGED TABLE customer_info_staging AS SELECT {', '.join(columns)} FROM customer_info WITH NO DATA")
+    conn.commit()
+    rows, copy_time = copy_into(conn, 'customer_info_staging', file_path, chunk_size)
+
+    start = time.time()
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+    changed = " OR ".join(f"customer_info.{column} IS DISTINCT FROM EXCLUDED.{column}" for column in columns[1:])
+    cursor.execute(f"""
+        INSERT INTO customer_info ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM customer_info_staging
+        ON CONFLICT (customerid) DO UPDATE SET {updates}
+        WHERE {changed}
+    """)
+    print(f"{cursor.rowcount} rows inserted or updated.")
+    conn.commit()
+    lock_time = time.time() - start
+    cursor.execute("DROP TABLE customer_info_staging")
+    conn.commit()
+    if covering_fields:
+        # customer_info stays live, so the index is built without blocking its writes
+        conn.autocommit = True
+        create_covering_index(cursor, 'customer_info', 'customer_info_covering', covering_fields, concurrently=True)
+        conn.autocommit = False
+    cursor.close()
+    return rows, copy_time, lock_time
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    variable_names = [
+        "DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_ENDPOINT",
+        "DATABASE_NAME"
+    ]
+    assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
+    env_vars = {var: os.getenv(var) for var in variable_names}
+    rds_user = env_vars["DATABASE_USERNAME"]
+    rds_pass = env_vars["DATABASE_PASSWORD"]
+    rds_endpoint = env_vars["DATABASE_ENDPOINT"]
+    rds_name = env_vars["DATABASE_NAME"]
+    rds_port = os.getenv("DATABASE_PORT")
+
+    parser = argparse.ArgumentParser(description="Load sample data into the customer_info table")
+    parser.add_argument("--file", default=local_sample_data, help="CSV file to load")
+    parser.add_argument("--mode", choices=['swap', 'merge'], default='swap',
+                        help="swap replaces the whole table atomically, merge upserts the file as a delta")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Lines per COPY chunk")
+    parser.add_argument("--covering-index", type=lambda value: value.split(","), default=None,
+                        help="Comma separated fields, for example FirstName,LastName,Email,Street,LoyaltyPoints, to "
+                             "include in an index on customerid so narrow lookups become index-only scans")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        conn_string = (f"dbname='{rds_name}' user='{rds_user}' host='{rds_endpoint}' password='{rds_pass}'" +
+                       (f" port='{rds_port}'" if rds_port else ""))
+        conn = psycopg2.connect(conn_string)
+        cursor = conn.cursor()
+
+        # Create the table if it doesn't exist
+        cursor.execute(create_table_sql)
+        conn.commit()
+        cursor.close()
+        print("Table 'customer_info' has been created.")
+
+        if args.mode == 'swap':
+            rows, copy_time, lock_time = swap_load(conn, args.file, args.chunk_size, args.covering_index)
+        else:
+            rows, copy_time, lock_time = merge_load(conn, args.file, args.chunk_size, args.covering_index)
+        if args.covering_index:
+            vacuum_analyze(conn)
+            print("Covering index 'customer_info_covering' is ready for index-only scans.")
+        print(f"Sample data has been loaded into the 'customer_info' table: {rows} rows copied in {copy_time:.2f} seconds "
+              f"({rows / copy_time if copy_time else 0:.1f} rows/sec), customer_info locked for {lock_time:.3f} seconds.")
+
+    except OperationalError as e:
+        print(f"A connection error occurred: {e}")
+    except errors.UniqueViolation as e:
+        print(f"An error occurred within psycopg2: {e}")
+        conn.rollback()
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
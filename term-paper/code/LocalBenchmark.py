@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+import boto3
+import psycopg2
+from Emulator import (LatencyProxy, create_table, dynamodb_images, postgres_image, start_container, stop_container,
+                      wait_for_dynamodb, wait_for_postgres)
+from LoadData_NOSQL import load
+from LoadData_RDS import create_table_sql, swap_load
+
+# Runs the PerformanceEval.py scenarios without AWS: DynamoDB Local (or a moto server) and PostgreSQL run in
+# docker, are seeded through the loaders, and optionally sit behind a proxy that adds network latency.
+#   python term-paper/code/LocalBenchmark.py --latency-ms 2 --scenarios nosql,batched,pooling
+# The first run with a baseline name saves the results as term-paper/data/baselines/<name>.bin, later runs are
+# compared with it and exit with status 1 when a scenario's p50 or p99 regressed.
+local_sample_data = 'term-paper/data/customer_info_sample.csv'
+baseline_dir = 'term-paper/data/baselines'
+local_results_file = 'term-paper/data/local_time_data.bin'
+local_checkpoint_file = 'term-paper/data/local_load_checkpoint.json'
+credentials = {'user': 'hybrid', 'password': 'hybrid', 'dbname': 'hybrid'}
+table_name = 'customer_info'
+region = 'us-east-1'
+
+
+def conn_string_for(host, port):
+    return (f"dbname='{credentials['dbname']}' user='{credentials['user']}' host='{host}' "
+            f"password='{credentials['password']}' port='{port}'")
+
+
+def seed(dynamodb_url, postgres_port, rows, compact):
+    # PostgreSQL gets every sample row, DynamoDB the first 1000 customers the scenarios expect to be cached
+    conn = psycopg2.connect(conn_string_for('127.0.0.1', postgres_port))
+    try:
+        cursor = conn.cursor()
+        cursor.execute(create_table_sql)
+        conn.commit()
+        cursor.close()
+        loaded, _, _ = swap_load(conn, local_sample_data, 100000)
+        print(f"Loaded {loaded} rows into PostgreSQL")
+    finally:
+        conn.close()
+    session = boto3.Session(aws_access_key_id='local', aws_secret_access_key='local')
+    resource = session.resource('dynamodb', region_name=region, endpoint_url=dynamodb_url)
+    create_table(resource, table_name)
+    load(session, region, table_name, local_sample_data, limit=rows, checkpoint_path=local_checkpoint_file, reset=True,
+         compact=compact, endpoint_url=dynamodb_url)
+
+
+def main(args):
+    image, container_port = dynamodb_images[args.dynamodb]
+    dynamodb_container = f'hybrid-bench-{args.dynamodb}'
+    postgres_container = 'hybrid-bench-postgres'
+    proxies = []
+    if not args.no_containers:
+        start_container(dynamodb_container, image, container_port, args.dynamodb_port)
+        start_container(postgres_container, postgres_image[0], postgres_image[1], args.postgres_port,
+                        {'POSTGRES_USER': credentials['user'], 'POSTGRES_PASSWORD': credentials['password'],
+                         'POSTGRES_DB': credentials['dbname']})
+    try:
+        dynamodb_url = f'http://127.0.0.1:{args.dynamodb_port}'
+        wait_for_postgres(conn_string_for('127.0.0.1', args.postgres_port))
+        wait_for_dynamodb(boto3.Session(aws_access_key_id='local', aws_secret_access_key='local').resource(
+            'dynamodb', region_name=region, endpoint_url=dynamodb_url))
+        if not args.skip_seed:
+            seed(dynamodb_url, args.postgres_port, 1000, args.compact)
+
+        # Seeding goes direct, only the benchmark pays the injected latency
+        dynamodb_port = args.dynamodb_port
+        postgres_port = args.postgres_port
+        if args.latency_ms or args.jitter_ms:
+            proxies = [LatencyProxy('127.0.0.1', port, args.latency_ms / 1000, args.jitter_ms / 1000).start()
+                       for port in (args.dynamodb_port, args.postgres_port)]
+            dynamodb_port, postgres_port = (proxy.port for proxy in proxies)
+            print(f"Adding {args.latency_ms} ms (+ up to {args.jitter_ms} ms) to every round trip")
+
+        # PerformanceEval.py reads its benchmark knobs when it is imported and HybridDatastore.from_env() the
+        # datastore settings when the run starts, both from the environment. Empty values turn off options a .env
+        # file may set for the AWS deployment.
+        os.environ.update({
+            'DYNAMODB_ENDPOINT': f'http://127.0.0.1:{dynamodb_port}', 'NOSQL_NAME': table_name, 'AWS_REGION': region,
+            'ACCESS_KEY': 'local', 'SECRET_KEY': 'local', 'SESSION_TOKEN': '',
+            'DATABASE_ENDPOINT': '127.0.0.1', 'DATABASE_PORT': str(postgres_port),
+            'DATABASE_USERNAME': credentials['user'], 'DATABASE_PASSWORD': credentials['password'],
+            'DATABASE_NAME': credentials['dbname'],
+            'DYNAMODB_SHARDS': '', 'DATABASE_REPLICA_ENDPOINTS': '', 'COMPACT_ITEMS': '1' if args.compact else '0',
+        })
+        import PerformanceEval
+
+        argv = ['--results', args.results, '--regression-threshold', str(args.regression_threshold)]
+        if args.scenarios:
+            argv += ['--scenarios', args.scenarios]
+        if args.warmup is not None:
+            argv += ['--warmup', str(args.warmup)]
+        if args.workload_requests is not None:
+            argv += ['--workload-requests', str(args.workload_requests)]
+        baseline_name = args.baseline or f"{args.dynamodb}-{args.latency_ms:g}ms"
+        baseline_path = os.path.join(baseline_dir, f"{baseline_name}.bin")
+        if os.path.exists(baseline_path) and not args.update_baseline:
+            argv += ['--compare-baseline', baseline_path]
+        else:
+            os.makedirs(baseline_dir, exist_ok=True)
+            argv += ['--save-baseline', baseline_path]
+        return PerformanceEval.main(argv)
+    finally:
+        for proxy in proxies:
+            proxy.stop()
+        if not args.no_containers and not args.keep:
+            stop_container(dynamodb_container)
+            stop_container(postgres_container)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios against local DynamoDB and PostgreSQL emulators")
+    parser.add_argument("--dynamodb", choices=list(dynamodb_images), default='dynamodb-local', help="DynamoDB emulator")
+    parser.add_argument("--dynamodb-port", type=int, default=8000, help="Host port of the DynamoDB emulator")
+    parser.add_argument("--postgres-port", type=int, default=55432, help="Host port of PostgreSQL")
+    parser.add_argument("--no-containers", action="store_true",
+                        help="Use emulators already listening on the ports instead of starting containers")
+    parser.add_argument("--keep", action="store_true", help="Leave the containers running afterwards")
+    parser.add_argument("--skip-seed", action="store_true", help="Do not reload the sample data")
+    parser.add_argument("--compact", action="store_true", help="Store the DynamoDB items in the compact format")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every round trip to either datastore")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency of up to this much per round trip")
+    parser.add_argument("--scenarios", help="Comma separated PerformanceEval.py scenarios, default all")
+    parser.add_argument("--warmup", type=int, help="Untimed requests before every scenario")
+    parser.add_argument("--workload-requests", type=int, help="Requests per workload")
+    parser.add_argument("--results", default=local_results_file, help="Binary results file to write")
+    parser.add_argument("--baseline", help="Baseline name, defaults to <emulator>-<latency>ms")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite the baseline with this run")
+    parser.add_argument("--regression-threshold", type=float, default=0.25,
+                        help="Relative p50/p99 slowdown against the baseline that counts as a regression")
+    sys.exit(main(parser.parse_args()))
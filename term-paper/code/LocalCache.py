@@ -0,0 +1,99 @@
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    # Rough in-memory footprint of a cached item, good enough to bound the cache by bytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+# In-process L1 cache in front of DynamoDB, keyed by (CustomerID, projected field set).
+# Entries expire after the shortest TTL of the fields they hold, a TTL of 0 makes a field uncacheable.
+class LocalCache:
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, default_ttl=60, field_ttls=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.field_ttls = field_ttls or {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self._entries = OrderedDict()
+        self._keys_by_customer = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(customer_id, fields):
+        return customer_id, tuple(sorted(fields))
+
+    def ttl_for(self, fields):
+        return min((self.field_ttls.get(field, self.default_ttl) for field in fields), default=self.default_ttl)
+
+    def get(self, customer_id, fields):
+        key = self.make_key(customer_id, fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            item, expires_at, _ = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy.deepcopy(item)
+
+    def put(self, customer_id, fields, item):
+        ttl = self.ttl_for(fields)
+        if ttl <= 0 or item is None:
+            return
+        key = self.make_key(customer_id, fields)
+        item = copy.deepcopy(item)
+        size = estimate_size(key) + estimate_size(item)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (item, time.monotonic() + ttl, size)
+            self._keys_by_customer.setdefault(customer_id, set()).add(key)
+            self._bytes += size
+            # Evict least recently used entries until both bounds hold again
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, customer_id):
+        with self._lock:
+            keys = self._keys_by_customer.get(customer_id)
+            if keys:
+                for key in list(keys):
+                    self._remove(key)
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_customer.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._keys_by_customer[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_customer[key[0]]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,208 @@
+import base64
+import json
+import math
+import struct
+import sys
+import time
+from array import array
+
+results_magic = b'HDSRES01'
+
+
+# HDR-style latency histogram over integer nanoseconds. Values are kept to significant_figures decimal digits
+# in log-linear buckets, so memory does not grow with the number of samples and histograms of the same precision
+# can be merged exactly. count, total, min and max are tracked exactly.
+class LatencyHistogram:
+    def __init__(self, significant_figures=3):
+        self.significant_figures = significant_figures
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def index_of(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        bucket = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (bucket - 1) * self.sub_bucket_half + (value >> bucket) - self.sub_bucket_half
+
+    def highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        bucket, sub_bucket = divmod(index - self.sub_bucket_count, self.sub_bucket_half)
+        bucket += 1
+        return ((sub_bucket + self.sub_bucket_half + 1) << bucket) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self.index_of(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        assert other.significant_figures == self.significant_figures, "Only histograms of the same precision can be merged"
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.highest_equivalent(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max,
+        }
+
+    def to_bytes(self):
+        header = struct.pack('<BqqqI', self.significant_figures, self.count, self.total, self.max, len(self.counts))
+        return header + b''.join(struct.pack('<iq', index, count) for index, count in sorted(self.counts.items()))
+
+    @classmethod
+    def from_bytes(cls, data):
+        significant_figures, count, total, maximum, buckets = struct.unpack_from('<BqqqI', data)
+        histogram = cls(significant_figures)
+        offset = struct.calcsize('<BqqqI')
+        for _ in range(buckets):
+            index, bucket_count = struct.unpack_from('<iq', data, offset)
+            histogram.counts[index] = bucket_count
+            offset += struct.calcsize('<iq')
+        histogram.count = count
+        histogram.total = total
+        histogram.max = maximum
+        histogram.min = min((histogram.highest_equivalent(index) for index in histogram.counts), default=None)
+        return histogram
+
+
+# Raw per-request latencies in nanoseconds plus their histogram
+class Recording:
+    def __init__(self, significant_figures=3):
+        self.latencies_ns = array('q')
+        self.histogram = LatencyHistogram(significant_figures)
+
+    def record(self, latency_ns):
+        self.latencies_ns.append(latency_ns)
+        self.histogram.record(latency_ns)
+
+    def __len__(self):
+        return len(self.latencies_ns)
+
+
+def measure(items, request, before=None, after=None, warmup=0):
+    # The first warmup items are requested once untimed, then every item is timed with perf_counter_ns.
+    # before and after run outside the timed section.
+    recording = Recording()
+    for timed, item in [(False, item) for item in items[:warmup]] + [(True, item) for item in items]:
+        if before:
+            before(item)
+        start = time.perf_counter_ns()
+        request(item)
+        end = time.perf_counter_ns()
+        if timed:
+            recording.record(end - start)
+        if after:
+            after(item)
+    return recording
+
+
+# Results file: magic, 8 byte header length, JSON header, then one little-endian int64 column of latencies per
+# scenario, each starting at an 8 byte aligned offset so it can be memory-mapped directly
+def save_results(path, recordings, metadata=None):
+    metadata = metadata or {}
+    scenarios = {}
+    offset = 0
+    for name, recording in recordings.items():
+        scenarios[name] = {
+            **metadata.get(name, {}),
+            'count': len(recording),
+            'relative_offset': offset,
+            'histogram': base64.b64encode(recording.histogram.to_bytes()).decode(),
+        }
+        offset += len(recording) * 8
+    header = json.dumps({'version': 1, 'unit': 'ns', 'scenarios': scenarios}).encode()
+    header += b' ' * (-(len(results_magic) + 8 + len(header)) % 8)
+    data_start = len(results_magic) + 8 + len(header)
+    with open(path, 'wb') as file:
+        file.write(results_magic)
+        file.write(struct.pack('<Q', len(header)))
+        file.write(header)
+        for name, recording in recordings.items():
+            column = array('q', recording.latencies_ns)
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(file)
+    return data_start
+
+
+def read_results_header(path):
+    # Returns the scenario metadata with absolute byte offsets of every latency column
+    with open(path, 'rb') as file:
+        assert file.read(len(results_magic)) == results_magic, f"{path} is not a results file"
+        header_length, = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(header_length))
+    data_start = len(results_magic) + 8 + header_length
+    for scenario in header['scenarios'].values():
+        scenario['offset'] = data_start + scenario.pop('relative_offset')
+    return header
+
+
+def load_results(path):
+    header = read_results_header(path)
+    results = {}
+    with open(path, 'rb') as file:
+        for name, scenario in header['scenarios'].items():
+            file.seek(scenario['offset'])
+            latencies_ns = array('q')
+            latencies_ns.frombytes(file.read(scenario['count'] * 8))
+            if sys.byteorder != 'little':
+                latencies_ns.byteswap()
+            results[name] = {
+                **scenario,
+                'latencies_ns': latencies_ns,
+                'histogram': LatencyHistogram.from_bytes(base64.b64decode(scenario['histogram'])),
+            }
+    return results
+
+
+def compare_results(baseline, recordings, threshold=0.25, percentiles=(50, 99)):
+    # Compares the percentiles of every scenario present in both a loaded baseline and the current recordings.
+    # A statistic regressed when it is more than threshold (relative) slower than the baseline.
+    rows = []
+    for name, recording in recordings.items():
+        if name not in baseline or not len(recording):
+            continue
+        for p in percentiles:
+            before = baseline[name]['histogram'].percentile(p)
+            after = recording.histogram.percentile(p)
+            change = after / before - 1 if before else 0.0
+            rows.append({'scenario': name, 'statistic': f'p{p}', 'baseline': before, 'current': after,
+                         'change': change, 'regression': change > threshold})
+    return rows
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from CachePolicy import ttl_attribute
+
+# Item written to DynamoDB for a CustomerID that PostgreSQL does not have. It carries the ExpiresAt TTL attribute,
+# so DynamoDB removes it eventually, and reads check ExpiresAt themselves until then.
+tombstone_attribute = 'Tombstone'
+
+
+def tombstone_item(customer_id, ttl):
+    return {'CustomerID': customer_id, tombstone_attribute: True, ttl_attribute: int(time.time() + ttl)}
+
+
+def is_tombstone(item):
+    return bool(item.get(tombstone_attribute))
+
+
+def tombstone_expired(item):
+    return item.get(ttl_attribute, 0) <= time.time()
+
+
+# In-process LRU of CustomerIDs that were not found in PostgreSQL. Entries expire after ttl seconds, which bounds
+# how long a customer inserted by another process is still reported as absent. The process forgets an entry as
+# soon as it writes or finds that customer itself.
+class NegativeCache:
+    def __init__(self, max_entries=100000, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'added': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self._expires_at = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, customer_id):
+        with self._lock:
+            expires_at = self._expires_at.get(customer_id)
+            if expires_at is None:
+                return False
+            if time.monotonic() >= expires_at:
+                del self._expires_at[customer_id]
+                self.stats['expirations'] += 1
+                return False
+            self._expires_at.move_to_end(customer_id)
+            self.stats['hits'] += 1
+            return True
+
+    def add(self, customer_id, ttl=None):
+        with self._lock:
+            self._expires_at[customer_id] = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._expires_at.move_to_end(customer_id)
+            self.stats['added'] += 1
+            while len(self._expires_at) > self.max_entries:
+                self._expires_at.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, customer_id):
+        with self._lock:
+            if self._expires_at.pop(customer_id, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._expires_at.clear()
+
+    def __len__(self):
+        return len(self._expires_at)
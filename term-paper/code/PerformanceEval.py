@@ -1,119 +1,42 @@
-import boto3
-import psycopg2
 from dotenv import load_dotenv
+import argparse
 import os
+import sys
 import time
 from prettytable import PrettyTable
 import csv
-import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from HybridDatastore import HybridDatastore, check_environment
+from Workload import Workload
+from Measurement import Recording, compare_results, load_results, measure, save_results
+from CachePolicy import make_policy
+from AccessLog import AccessLog, most_accessed
+from WarmCache import warm
 
+# Benchmark of the hybrid datastore of HybridDatastore.py. Importing this module connects to nothing, main()
+# checks the environment, builds the datastore from it and runs the scenarios. DYNAMODB_ENDPOINT points DynamoDB at
+# DynamoDB Local or a moto server, which accept any credentials, and DATABASE_PORT selects a non-default
+# PostgreSQL port, see LocalBenchmark.py.
 load_dotenv()
-variable_names = [
-    "DATABASE_USERNAME", "DATABASE_PASSWORD", "DATABASE_ENDPOINT",
-    "DATABASE_NAME", "NOSQL_NAME", "AWS_REGION", "ACCESS_KEY",
-    "SECRET_KEY", "SESSION_TOKEN"
-]
-assert all(os.getenv(var) for var in variable_names), "One or more environment variables are missing or empty"
-env_vars = {var: os.getenv(var) for var in variable_names}
-access_key = env_vars["ACCESS_KEY"]
-secret_key = env_vars["SECRET_KEY"]
-session_token = env_vars["SESSION_TOKEN"]
-rds_user = env_vars["DATABASE_USERNAME"]
-rds_pass = env_vars["DATABASE_PASSWORD"]
-rds_endpoint = env_vars["DATABASE_ENDPOINT"]
-rds_name = env_vars["DATABASE_NAME"]
-dynamodb_name = env_vars["NOSQL_NAME"]
-aws_region = env_vars["AWS_REGION"]
-conn_string = f"dbname='{rds_name}' user='{rds_user}' host='{rds_endpoint}' password='{rds_pass}'"
-address_fields = {'Street', 'City', 'State', 'PostalCode'}
 local_sample_data = 'term-paper/data/customer_info_sample.csv'
+batch_page_size = int(os.getenv("BATCH_PAGE_SIZE", "100"))
+stress_workers = int(os.getenv("STRESS_WORKERS", "16"))
+workload_requests = int(os.getenv("WORKLOAD_REQUESTS", "3000"))
+workload_seed = int(os.getenv("WORKLOAD_SEED", "42"))
+# Parallel batch writers of the warming scenario
+warming_workers = 4
+# Requests run untimed at the start of every scenario before the timed phase
+warmup_requests = int(os.getenv("WARMUP_REQUESTS", "50"))
+results_file = 'term-paper/data/time_data.bin'
+# Per-stage spans of the read path are written as OTLP/JSON to TRACE_OUTPUT and, with TRACE_OTLP_ENDPOINT set,
+# posted to a local OpenTelemetry collector. Tracing is off unless one of them is set.
+trace_output = os.getenv("TRACE_OUTPUT")
+trace_otlp_endpoint = os.getenv("TRACE_OTLP_ENDPOINT")
 
-session = boto3.Session(
-    aws_access_key_id=access_key,
-    aws_secret_access_key=secret_key,
-    aws_session_token=session_token
-)
-dynamodb = session.resource('dynamodb', region_name=aws_region)
-table = dynamodb.Table(dynamodb_name)
-
-def insert_into_dynamodb(customer_data):
-    try:
-        table.put_item(Item=customer_data)
-    except Exception as e:
-        print(f"Error inserting data into DynamoDB: {e}")
-
-def get_from_dynamodb(customer_id, projection_expression):
-    try:
-        response = table.get_item(Key={'CustomerID': customer_id}, ProjectionExpression=projection_expression)
-        return response
-
-    except Exception as e:
-        print(f"Error fetching data from DynamoDB: {e}")
-        return None
-
-def fetch_from_postgresql(customer_id):
-    try:
-        conn = psycopg2.connect(conn_string)
-        cur = conn.cursor()
-        
-        cur.execute(f"SELECT * FROM customer_info WHERE customerid = %s", (customer_id,))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if result:
-            customer_data = {
-                'CustomerID': result[0],
-                'FirstName': result[1],
-                'LastName': result[2],
-                'Email': result[3],
-                'PhoneNumber': result[4],
-                'Address': {
-                    'Street': result[5],
-                    'City': result[6],
-                    'State': result[7],
-                    'PostalCode': result[8]
-                },
-                'DateOfBirth': result[9].strftime('%Y-%m-%d'),
-                'AccountCreationDate': result[10].strftime('%Y-%m-%d'),
-                'LastPurchaseDate': result[11].strftime('%Y-%m-%d'),
-                'LoyaltyPoints': result[12]
-            }
-            return customer_data
-        else:
-            return None
-    except Exception as e:
-        print(f"Error fetching data from PostgreSQL: {e}")
-        return None
-
-def get_customer_data_fields(customer_id, fields):
-
-    for i, field in enumerate(fields):
-        if field in address_fields:
-            fields[i] = f'Address.{field}'
-    projection_expression = ", ".join(fields)
-    
-    try:
-        response = get_from_dynamodb(customer_id, projection_expression)
-        if 'Item' in response:
-            # Handle the case where the loyalty points have changed in the PostgreSQL database but not in DynamoDB
-            if 'LoyaltyPoints' in fields:
-                customer_data = fetch_from_postgresql(customer_id)
-                if customer_data:
-                    if customer_data['LoyaltyPoints'] != response['Item']['LoyaltyPoints']:
-                        response['Item']['LoyaltyPoints'] = customer_data['LoyaltyPoints']
-                        insert_into_dynamodb({'CustomerID': customer_id, 'LoyaltyPoints': customer_data['LoyaltyPoints']})
-                return response['Item']
-        else:
-            customer_data = fetch_from_postgresql(customer_id)
-            if customer_data:
-                insert_into_dynamodb(customer_data)
-                return get_from_dynamodb(customer_id, projection_expression)['Item']
-            else:
-                return None
-    except Exception as e:
-        print(f"Error fetching customer data: {e}")
-        return None
+# The datastore under test, built by main()
+store = None
 
 def get_customer_ids_from_csv(file_path, start, end):
     customer_ids = []
@@ -130,100 +53,488 @@ def get_customer_ids_from_csv(file_path, start, end):
             customer_ids.append(customer_id)
     return customer_ids
 
+def pages(customer_ids):
+    return [customer_ids[i:i + batch_page_size] for i in range(0, len(customer_ids), batch_page_size)]
 
-nosql_id = get_customer_ids_from_csv(local_sample_data, 1, 1000)
-fields_to_fetch = ['FirstName', 'LastName', 'Email', 'Street']
-nosql_time_used = []
-nosql_total_time = 0
+def alter_loyalty_points(customer_id):
+    # alters the loyalty points of a customer in DynamoDB to force a difference between the two datastores
+    store.invalidate_l1(customer_id)
+    try:
+        points_attribute = store.item_codec.attribute_for('LoyaltyPoints') if store.item_codec else 'LoyaltyPoints'
+        store.table.update_item(Key={'CustomerID': customer_id}, UpdateExpression="SET #points = :points",
+                                ConditionExpression="attribute_exists(CustomerID)", ExpressionAttributeNames={'#points': points_attribute},
+                                ExpressionAttributeValues={':points': 10001})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"Error updating data in DynamoDB: {e}")
 
-for customer_id in nosql_id:
-    start = time.time()
-    customer_data = get_customer_data_fields(customer_id, fields_to_fetch)
-    end = time.time()
-    nosql_time_used.append(end - start)
-    nosql_total_time += end - start
+def stress_backfill(customer_ids, requests_per_customer):
+    # Concurrent mix of plain reads and sensitive reads with injected drift on a cold set of hot customers.
+    # Every miss beyond the first one per customer was caused by a clobbered item, a racing backfill or a backfill
+    # still waiting in the write-behind queue. Every worker reaches DynamoDB through its own resource of the store,
+    # so a shared, non thread-safe client is not one of the causes.
+    store.delete_many_from_dynamodb(customer_ids)
+    for stat in store.read_stats:
+        store.read_stats[stat] = 0
+    coalesced_before = store.single_flight.stats['coalesced']
 
-avg_nosql_time = sum(nosql_time_used) / len(nosql_time_used)
-print(f"Average time used for fetching data from DynamoDB: {avg_nosql_time} seconds")
-print(f"Total time used for fetching data from DynamoDB: {nosql_total_time} seconds")
+    def request(n):
+        customer_id = customer_ids[n % len(customer_ids)]
+        if n % 4 == 0:
+            alter_loyalty_points(customer_id)
+            store.get_customer_data_fields(customer_id, list(sensitive_fields_to_fetch))
+        else:
+            store.get_customer_data_fields(customer_id, list(fields_to_fetch))
 
-hybrid_id = get_customer_ids_from_csv(local_sample_data, 1001, 2000)
-fields_to_fetch = ['FirstName', 'LastName', 'Email', 'Street']
-hybrid_time_used = []
-hybrid_total_time = 0
+    with ThreadPoolExecutor(max_workers=stress_workers) as executor:
+        list(executor.map(request, range(len(customer_ids) * requests_per_customer)))
+    store.write_behind.flush()
+    stats = dict(store.read_stats)
+    stats['extra_misses'] = stats['misses'] - len(customer_ids)
+    stats['coalesced'] = store.single_flight.stats['coalesced'] - coalesced_before
+    return stats
 
-for customer_id in hybrid_id:
-    start = time.time()
-    customer_data = get_customer_data_fields(customer_id, fields_to_fetch)
-    end = time.time()
-    hybrid_time_used.append(end - start)
-    hybrid_total_time += end - start
+def touch_in_postgresql(customer_id):
+    # A no-op update still bumps the row version and makes the change sync push the row again
+    try:
+        conn = store.connect()
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("UPDATE customer_info SET loyaltypoints = loyaltypoints WHERE customerid = %s", (customer_id,))
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error updating data in PostgreSQL: {e}")
 
-    # Delete data from DynamoDB so the hybrid datastore can be tested again
+def update_in_postgresql(customer_id):
     try:
-        table.delete_item(Key={'CustomerID': customer_id})
+        with store.pg_pool.connection() as pooled:
+            cur = pooled.conn.cursor()
+            cur.execute("UPDATE customer_info SET loyaltypoints = loyaltypoints + 1 WHERE customerid = %s", (customer_id,))
+            cur.close()
     except Exception as e:
-        print(f"Error deleting data from DynamoDB: {e}")
+        print(f"Error updating data in PostgreSQL: {e}")
 
-avg_hybrid_time = sum(hybrid_time_used) / len(hybrid_time_used)
-print(f"Average time used for fetching data from the hybrid datastore: {avg_hybrid_time} seconds")
-print(f"Total time used for fetching data from the hybrid datastore: {hybrid_total_time} seconds")
+def run_workload(workload, cached_ids):
+    # Replays the workload through the real read path, updates go to PostgreSQL. Customers that were not cached
+    # before are removed from DynamoDB afterwards so every workload starts from the same cache contents.
+    # There is no warm-up phase, the cold start of a workload is part of its measured hit rate.
+    stats_before = dict(store.read_stats)
+    recording = Recording()
+    touched = set()
+    for operation, customer_id in workload.operations(workload_requests):
+        start = time.perf_counter_ns()
+        if operation == 'read':
+            store.get_customer_data_fields(customer_id, list(fields_to_fetch))
+        else:
+            update_in_postgresql(customer_id)
+        end = time.perf_counter_ns()
+        recording.record(end - start)
+        touched.add(customer_id)
+    hits = store.read_stats['hits'] - stats_before['hits']
+    misses = store.read_stats['misses'] - stats_before['misses']
+    store.delete_many_from_dynamodb([customer_id for customer_id in touched if customer_id not in cached_ids])
+    return recording, hits / (hits + misses) if hits + misses else 0.0
 
-rds_id = get_customer_ids_from_csv(local_sample_data, 2001, 3000)
-rds_time_used = []
-rds_total_time = 0
+def replay_recovery(workload, window):
+    # Replays the reads of the workload and returns the recording, the hit rate and the hit rate of every window
+    # of requests
+    recording = Recording()
+    windows = []
+    stats_start = stats_before = dict(store.read_stats)
+    for i, (_, customer_id) in enumerate(workload.operations(workload_requests), start=1):
+        start = time.perf_counter_ns()
+        store.get_customer_data_fields(customer_id, list(fields_to_fetch))
+        end = time.perf_counter_ns()
+        recording.record(end - start)
+        if i % window == 0 or i == workload_requests:
+            hits = store.read_stats['hits'] - stats_before['hits']
+            misses = store.read_stats['misses'] - stats_before['misses']
+            windows.append(hits / (hits + misses) if hits + misses else 0.0)
+            stats_before = dict(store.read_stats)
+    hits = store.read_stats['hits'] - stats_start['hits']
+    misses = store.read_stats['misses'] - stats_start['misses']
+    return recording, hits / (hits + misses) if hits + misses else 0.0, windows
 
-for customer_id in rds_id:
-    start = time.time()
-    customer_data = fetch_from_postgresql(customer_id)
-    end = time.time()
-    rds_time_used.append(end - start)
-    rds_total_time += end - start
+recordings = {}
+metadata = {}
 
-avg_rds_time = sum(rds_time_used) / len(rds_time_used)
-print(f"Average time used for fetching data from PostgreSQL: {avg_rds_time} seconds")
-print(f"Total time used for fetching data from PostgreSQL: {rds_total_time} seconds")
+def report(key, description, recording, requests=None, **extra):
+    # requests is the number of customers covered when one timed request is a whole page
+    recordings[key] = recording
+    metadata[key] = {'description': description, 'requests': requests or len(recording), **extra}
+    summary = recording.histogram.summary()
+    print(f"Time used for {description}: mean {summary['mean'] / 1e6:.3f} ms, p50 {summary['p50'] / 1e6:.3f} ms, "
+          f"p90 {summary['p90'] / 1e6:.3f} ms, p99 {summary['p99'] / 1e6:.3f} ms, p99.9 {summary['p999'] / 1e6:.3f} ms, "
+          f"max {summary['max'] / 1e6:.3f} ms")
 
-# Example performance when accessing a sensitive field
-fields_to_fetch = ['FirstName', 'LastName', 'Email', 'LoyaltyPoints']
-sensitive_time_used = []
-sensitive_total_time = 0
 
-for customer_id in nosql_id:
-    # alters the loyalty points of a customer in DynamoDB to force a difference between the two datastores
-    altered_data = {
-                'CustomerID': customer_id,
-                'LoyaltyPoints': 10001
-            }
-    insert_into_dynamodb(altered_data)
-    start = time.time()
-    customer_data = get_customer_data_fields(customer_id, fields_to_fetch)
-    end = time.time()
-    sensitive_time_used.append(end - start)
-    sensitive_total_time += end - start
-
-avg_sensitive_time = sum(sensitive_time_used) / len(sensitive_time_used)
-print(f"Average time used for fetching data from DynamoDB with a sensitive field: {avg_sensitive_time} seconds")
-print(f"Total time used for fetching data from DynamoDB with a sensitive field: {sensitive_total_time} seconds")
-
-
-# Save time used list and total time variable into a file
-data = {
-    "nosql": nosql_time_used,
-    "hybrid": hybrid_time_used,
-    "rds": rds_time_used,
-    "sensitive": sensitive_time_used,
+# Cached, uncached and relational-only customers of the sample data, read by load_customer_ids()
+nosql_id = []
+hybrid_id = []
+rds_id = []
+fields_to_fetch = ['FirstName', 'LastName', 'Email', 'Street']
+sensitive_fields_to_fetch = ['FirstName', 'LastName', 'Email', 'LoyaltyPoints']
+
+def scenario_nosql():
+    report("nosql", "Hybrid Datastore (best case)",
+           measure(nosql_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(fields_to_fetch)), warmup=warmup_requests))
+
+def scenario_l1():
+    # L1 tier: the in-process cache is warmed with one untimed pass over the DynamoDB hits, then timed on the same IDs
+    configured_l1_cache = store.l1_cache
+    store.l1_cache = store.new_l1_cache()
+    report("l1", "Hybrid Datastore (L1 cache hit)",
+           measure(nosql_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(fields_to_fetch)), warmup=len(nosql_id)))
+    print(f"L1 cache stats: {store.l1_cache.stats}")
+    store.l1_cache = configured_l1_cache
+
+def scenario_batched():
+    # Batched read-through, each timed request is one page of batch_page_size customer IDs
+    report("nosql_batched", f"Hybrid Datastore (best case, batched, per page of {batch_page_size})",
+           measure(pages(nosql_id), lambda page: store.get_customers_data_fields(page, fields_to_fetch), warmup=1), requests=len(nosql_id))
+    report("hybrid_batched", f"Hybrid Datastore (worst case, batched, per page of {batch_page_size})",
+           measure(pages(hybrid_id), lambda page: store.get_customers_data_fields(page, fields_to_fetch), after=store.delete_many_from_dynamodb, warmup=1),
+           requests=len(hybrid_id))
+
+def scenario_stress():
+    # Concurrent stress test of the backfill and correction writes, with and without version conditions. The
+    # drift is injected behind the write API, so the corrections run even with WRITE_API_ONLY=1.
+    configured_conditional_writes = store.conditional_writes
+    configured_write_api_only = store.write_api_only
+    store.write_api_only = False
+    for store.conditional_writes in [False, True]:
+        stats = stress_backfill(hybrid_id[:100], 20)
+        label = "version-conditioned update_item" if store.conditional_writes else "unconditional put_item"
+        print(f"Backfill stress test with {label}: {stats}")
+    store.conditional_writes = configured_conditional_writes
+    store.write_api_only = configured_write_api_only
+    store.delete_many_from_dynamodb(hybrid_id[:100])
+
+def scenario_pooling():
+    # Every scenario that reaches PostgreSQL runs once with a new connection per lookup and once with the pool.
+    # The sensitive field scenario measures the double read here, the change sync is measured by sensitive_sync
+    # and the write API by writes.
+    configured_sync_max_staleness = store.sync_max_staleness
+    configured_write_api_only = store.write_api_only
+    store.sync_max_staleness = None
+    store.write_api_only = False
+    pooling_modes = [False, True] if store.pool_enabled else [False]
+    # use_pool is the switch of the datastore read by every PostgreSQL lookup
+    for store.use_pool in pooling_modes:
+        suffix = "_pooled" if store.use_pool else ""
+        label = ", pooled" if store.use_pool else ""
+
+        report("hybrid" + suffix, f"Hybrid Datastore (worst case{label})",
+               measure(hybrid_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(fields_to_fetch)),
+                       after=store.delete_from_dynamodb, warmup=warmup_requests))
+
+        # The same misses with the backfill written before the read returns
+        configured_backfill_mode = store.backfill_mode
+        store.backfill_mode = 'sync'
+        report("hybrid_sync_backfill" + suffix, f"Hybrid Datastore (worst case, synchronous backfill{label})",
+               measure(hybrid_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(fields_to_fetch)),
+                       after=store.delete_from_dynamodb, warmup=warmup_requests))
+        store.backfill_mode = configured_backfill_mode
+
+        # The relational baseline selects the same fields the hybrid reads return
+        report("rds" + suffix, f"Relational Database (best case{label})",
+               measure(rds_id, lambda customer_id: store.fetch_from_postgresql(customer_id, fields_to_fetch), warmup=warmup_requests))
+
+        # Example performance when accessing a sensitive field
+        report("sensitive" + suffix, f"Hybrid Datastore (sensitive field{label})",
+               measure(nosql_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(sensitive_fields_to_fetch)),
+                       before=alter_loyalty_points, warmup=warmup_requests))
+    store.use_pool = store.pool_enabled
+    store.sync_max_staleness = configured_sync_max_staleness
+    store.write_api_only = configured_write_api_only
+
+def scenario_workloads():
+    # Seeded workloads over all sample customers, starting with the first 1000 cached. The measured hit rates and
+    # latencies replace the linear miss-rate blends in CreateGraph.py.
+    # Workload updates always go through a pool, also with POOL_ENABLED=0
+    store.ensure_pg_pool()
+    all_ids = nosql_id + hybrid_id + rds_id
+    cached_ids = set(nosql_id)
+    workloads = [
+        Workload(all_ids, distribution='uniform', seed=workload_seed),
+        Workload(all_ids, distribution='zipf', skew=0.8, seed=workload_seed),
+        Workload(all_ids, distribution='zipf', skew=0.99, seed=workload_seed),
+        Workload(all_ids, distribution='zipf', skew=1.2, seed=workload_seed),
+        Workload(all_ids, distribution='hotspot', hot_set_size=300, shift_every=workload_requests // 4, seed=workload_seed),
+        Workload(all_ids, distribution='zipf', skew=0.99, read_ratio=0.8, seed=workload_seed),
+    ]
+    for workload in workloads:
+        recording, hit_rate = run_workload(workload, cached_ids)
+        print(f"Workload {workload.describe()}: measured hit rate {hit_rate:.1%}")
+        report(f"workload:{workload.describe()}", f"Workload: {workload.describe()}, {hit_rate:.0%} hits", recording,
+               workload=workload.describe(), hit_rate=hit_rate)
+
+def scenario_policies():
+    # Admission policies with the cache table capped at the 1000 preloaded customers, on the skewed workload. Write
+    # cost is the number of backfills plus evictions. Evicted preloaded customers are written back after every policy.
+    store.ensure_pg_pool()
+    configured_cache_policy = store.cache_policy
+    policy_workload = Workload(nosql_id + hybrid_id + rds_id, distribution='zipf', skew=0.99, seed=workload_seed)
+    for policy_name in ['first_miss', 'second_miss', 'tinylfu']:
+        store.cache_policy = make_policy(policy_name, ttl=store.cache_ttl, capacity=store.cache_capacity or len(nosql_id))
+        store.cache_policy.add_residents(nosql_id)
+        recording, hit_rate = run_workload(policy_workload, set(nosql_id))
+        writes = store.cache_policy.stats['admitted'] + store.cache_policy.stats['evicted']
+        print(f"Cache policy {store.cache_policy.describe()}: measured hit rate {hit_rate:.1%}, {writes} DynamoDB writes, "
+              f"{store.cache_policy.stats}")
+        report(f"policy:{store.cache_policy.describe()}", f"Cache policy: {store.cache_policy.describe()}, {hit_rate:.0%} hits, {writes} writes",
+               recording, policy=store.cache_policy.describe(), hit_rate=hit_rate, writes=writes)
+        store.write_behind.flush()
+        store.batch_insert_into_dynamodb(store.fetch_many_from_postgresql(nosql_id).values())
+    store.cache_policy = configured_cache_policy
+
+def scenario_sensitive_sync():
+    # Sensitive field with the change sync: the row changes in PostgreSQL and the read trusts the synced item
+    if store.sync_is_fresh():
+        report("sensitive_sync", "Hybrid Datastore (sensitive field, change sync)",
+               measure(nosql_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(sensitive_fields_to_fetch)),
+                       before=touch_in_postgresql, warmup=warmup_requests))
+    else:
+        print("Skipping the change sync scenario, set SYNC_MAX_STALENESS and run 'ChangeSync.py run' to include it")
+
+def scenario_warming():
+    # Hit-rate recovery after a cold start. The cache is emptied and a skewed workload replayed three times: without
+    # warming, after WarmCache.py preloaded the customers most read in the access log of the cold run, and after it
+    # preloaded the latest purchasers. Every warm-up loads as many customers as LoadData_NOSQL.py does. The second
+    # run replays the very traffic its log was recorded from, so it is the best an access log can do.
+    all_ids = nosql_id + hybrid_id + rds_id
+    workload = Workload(all_ids, distribution='zipf', skew=0.99, seed=workload_seed)
+    window = max(1, workload_requests // 20)
+    configured_access_log = store.access_log
+    log_file, log_path = tempfile.mkstemp(suffix='.csv')
+    os.close(log_file)
+    conn = store.connect()
+    curves = {}
+    try:
+        for warming in ['none', 'access_log', 'recency']:
+            store.delete_many_from_dynamodb(all_ids)
+            if warming == 'none':
+                store.access_log = AccessLog(log_path)
+            else:
+                candidates = None
+                if warming == 'access_log':
+                    store.access_log.flush()
+                    store.access_log = configured_access_log
+                    candidates = most_accessed(log_path, len(nosql_id))
+                warmed_ids, stats = warm(conn, [store.new_table() for _ in range(warming_workers)], candidates,
+                                         limit=len(nosql_id), codec=store.item_codec, ttl=store.cache_ttl)
+                store.cache_policy.add_residents(warmed_ids)
+                print(f"Warmed from {warming}: {stats}")
+            recording, hit_rate, windows = replay_recovery(workload, window)
+            store.write_behind.flush()
+            curves[warming] = windows
+            report(f"warming:{warming}", f"Cold start, warmed from {warming}, {hit_rate:.0%} hits", recording,
+                   warming=warming, hit_rate=hit_rate, recovery=windows, window=window)
+    finally:
+        conn.close()
+        store.access_log = configured_access_log
+        os.remove(log_path)
+    results = PrettyTable()
+    results.field_names = ["Requests", "No warming", "Access log", "Recency"]
+    for i in range(len(curves['none'])):
+        results.add_row([f"{i * window + 1}-{min((i + 1) * window, workload_requests)}"] +
+                        [f"{curves[warming][i]:.1%}" for warming in ['none', 'access_log', 'recency']])
+    print(f"Hit rate after a cold start, {workload.describe()}:")
+    print(results)
+    # Back to the cache contents of LoadData_NOSQL.py
+    store.delete_many_from_dynamodb(all_ids)
+    store.batch_insert_into_dynamodb(store.fetch_many_from_postgresql(nosql_id).values())
+    store.cache_policy.add_residents(nosql_id)
+
+def cached_loyalty_points(customer_id):
+    # Strongly consistent read of the cached value, None if the customer is not cached
+    response = store.table.get_item(Key={'CustomerID': customer_id}, ProjectionExpression=store.storage_projection(['LoyaltyPoints']),
+                                    ConsistentRead=True)
+    return store.decode_item(response['Item'], ['LoyaltyPoints']).get('LoyaltyPoints') if 'Item' in response else None
+
+def scenario_writes():
+    # Throughput and consistency of loyalty point updates on cached customers from stress_workers threads: directly
+    # in PostgreSQL as before, then through update_customer_fields in both modes. Right after every update the
+    # cached item is read back, a value older than the committed one is a stale read. After the write queue is
+    # flushed, every touched item is compared with PostgreSQL once more.
+    store.ensure_pg_pool()
+    customer_ids = [nosql_id[n % len(nosql_id)] for n in range(workload_requests)]
+    updates = {
+        'postgresql_only': lambda customer_id: store.update_in_primary(customer_id, {}, {'LoyaltyPoints': 1}),
+        'write_through': lambda customer_id: store.update_customer_fields(customer_id, increments={'LoyaltyPoints': 1}, mode='write_through'),
+        'write_behind': lambda customer_id: store.update_customer_fields(customer_id, increments={'LoyaltyPoints': 1}, mode='write_behind'),
+    }
+    # The workers and the write queue threads each get their own DynamoDB resource from the store
+    for mode, update in updates.items():
+        def request(customer_id):
+            start = time.perf_counter_ns()
+            customer_data = update(customer_id)
+            end = time.perf_counter_ns()
+            cached = cached_loyalty_points(customer_id)
+            return end - start, cached is not None and cached < customer_data['LoyaltyPoints']
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=stress_workers) as executor:
+            results = list(executor.map(request, customer_ids))
+        store.write_queue.flush()
+        elapsed = time.perf_counter() - start
+        recording = Recording()
+        for latency, _ in results:
+            recording.record(latency)
+        stale_reads = sum(stale for _, stale in results)
+        rows = store.fetch_many_from_postgresql(list(set(customer_ids)))
+        inconsistent = sum(1 for customer_id, customer_data in rows.items()
+                           if cached_loyalty_points(customer_id) not in (None, customer_data['LoyaltyPoints']))
+        throughput = len(results) / elapsed
+        print(f"Updates ({mode}): {throughput:.1f} updates/sec, {stale_reads} stale reads right after an update, "
+              f"{inconsistent} of {len(rows)} cached items inconsistent after the flush")
+        report(f"writes:{mode}", f"Update ({mode.replace('_', ' ')}), {throughput:.0f} updates/sec", recording,
+               mode=mode, throughput=throughput, stale_reads=stale_reads, inconsistent=inconsistent)
+    print(f"Write API stats: {store.write_stats}, write queue stats: {store.write_queue.stats}")
+
+    # Sensitive reads once every change goes through the write API, without the double read
+    configured_write_api_only = store.write_api_only
+    store.write_api_only = True
+    report("sensitive_write_api", "Hybrid Datastore (sensitive field, write API)",
+           measure(nosql_id, lambda customer_id: store.get_customer_data_fields(customer_id, list(sensitive_fields_to_fetch)),
+                   warmup=warmup_requests))
+    store.write_api_only = configured_write_api_only
+
+# Scenarios in the order they run, the later ones expect the cache contents the earlier ones leave behind
+scenarios = {
+    'nosql': scenario_nosql,
+    'l1': scenario_l1,
+    'batched': scenario_batched,
+    'stress': scenario_stress,
+    'pooling': scenario_pooling,
+    'workloads': scenario_workloads,
+    'policies': scenario_policies,
+    'warming': scenario_warming,
+    'writes': scenario_writes,
+    'sensitive_sync': scenario_sensitive_sync,
 }
 
-with open('term-paper/data/time_data.json', 'w') as file:
-    json.dump(data, file)
- 
-# Create a table to display the average time used for fetching data from each datastore
-table = PrettyTable()
-table.field_names = ["Datastore", "Average Time: Per Request (seconds)", "Total Time: 1000 Requests (seconds)"]
-table.add_row(["Hybrid Datastore (best case)", avg_nosql_time, nosql_total_time])
-table.add_row(["Hybrid Datastore (worst case)", avg_hybrid_time, hybrid_total_time])
-table.add_row(["Hybrid Datastore (sensitive field)  ", avg_sensitive_time, sensitive_total_time])
-table.add_row(["Relational Database (best case)", avg_rds_time, rds_total_time])
-print(table)
- 
+def load_customer_ids():
+    global nosql_id, hybrid_id, rds_id
+    nosql_id = get_customer_ids_from_csv(local_sample_data, 1, 1000)
+    hybrid_id = get_customer_ids_from_csv(local_sample_data, 1001, 2000)
+    rds_id = get_customer_ids_from_csv(local_sample_data, 2001, 3000)
+
+def close():
+    # The queues are drained before their stats are printed
+    store.close()
+    if store.access_log is not None:
+        print(f"Access log: {store.access_log.recorded} reads recorded in {store.access_log.path}")
+    if store.l1_cache is not None:
+        print(f"L1 cache stats: {store.l1_cache.stats}")
+    if store.negative_cache is not None:
+        print(f"Negative cache stats: {store.negative_cache.stats}")
+    print(f"Single-flight stats: {store.single_flight.stats}")
+    print(f"Cache policy {store.cache_policy.describe()} stats: {store.cache_policy.stats}")
+    if store.item_codec:
+        print(f"Compact item codec stats: {store.item_codec.stats}")
+    print(f"Write-behind stats: {store.write_behind.stats}")
+    print(f"Write API stats: {store.write_stats}, write queue stats: {store.write_queue.stats}")
+    stats = store.stats()
+    if 'shard_router' in stats:
+        print(f"Shard router stats: {stats['shard_router']}")
+    if 'read_routing' in stats:
+        print(f"Read routing stats: {stats['read_routing']}")
+    if 'connection_pool' in stats:
+        print(f"Connection pool stats: {stats['connection_pool']}")
+
+def export_traces():
+    print("Spans per stage (ms, capacity units summed):")
+    for name, summary in store.tracer.summary().items():
+        print(f"  {name}: {summary['count']} spans, mean {summary['mean'] / 1e6:.3f}, p50 {summary['p50'] / 1e6:.3f}, "
+              f"p99 {summary['p99'] / 1e6:.3f}, max {summary['max'] / 1e6:.3f}, capacity {summary['capacity_units']:.1f}")
+    if store.tracer.dropped:
+        print(f"{store.tracer.dropped} spans beyond the first {store.tracer.max_spans} were not exported")
+    if trace_output:
+        store.tracer.export(trace_output)
+    if trace_otlp_endpoint:
+        try:
+            store.tracer.export_otlp_http(trace_otlp_endpoint)
+        except Exception as e:
+            print(f"Error exporting spans to {trace_otlp_endpoint}: {e}")
+
+def print_results():
+    # Create a table to display the latency distribution of each scenario
+    results = PrettyTable()
+    results.field_names = ["Datastore", "Mean Per Request (ms)", "p50 (ms)", "p90 (ms)", "p99 (ms)", "p99.9 (ms)", "Max (ms)",
+                           "Total Time (seconds)"]
+    for key, recording in recordings.items():
+        summary = recording.histogram.summary()
+        # Batched scenarios are normalised to a mean per customer, their percentiles are per page
+        results.add_row([metadata[key]['description'], round(recording.histogram.total / metadata[key]['requests'] / 1e6, 3)] +
+                        [round(summary[stat] / 1e6, 3) for stat in ['p50', 'p90', 'p99', 'p999', 'max']] +
+                        [round(recording.histogram.total / 1e9, 3)])
+    print(results)
+
+def compare_to_baseline(path, threshold):
+    # Returns True if any scenario got slower than the baseline by more than threshold
+    comparison = compare_results(load_results(path), recordings, threshold)
+    results = PrettyTable()
+    results.field_names = ["Scenario", "Statistic", "Baseline (ms)", "Current (ms)", "Change", "Regression"]
+    for row in comparison:
+        results.add_row([row['scenario'], row['statistic'], round(row['baseline'] / 1e6, 3), round(row['current'] / 1e6, 3),
+                         f"{row['change']:+.1%}", "yes" if row['regression'] else ""])
+    print(f"Compared with the baseline {path} (regression threshold {threshold:.0%}):")
+    print(results)
+    return any(row['regression'] for row in comparison)
+
+def run(selected=None):
+    # Runs the selected scenarios, all of them by default, and returns (recordings, metadata)
+    recordings.clear()
+    metadata.clear()
+    # The first 1000 customers were loaded by LoadData_NOSQL.py
+    store.cache_policy.add_residents(nosql_id)
+    for name, scenario in scenarios.items():
+        if selected is None or name in selected:
+            scenario()
+    return recordings, metadata
+
+def main(argv=None):
+    global store, warmup_requests, workload_requests
+    parser = argparse.ArgumentParser(description="Latency benchmark of the hybrid datastore")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=None,
+                        help=f"Comma separated scenarios to run, default all of {','.join(scenarios)}")
+    parser.add_argument("--warmup", type=int, default=warmup_requests, help="Untimed requests before every scenario")
+    parser.add_argument("--workload-requests", type=int, default=workload_requests, help="Requests per workload")
+    parser.add_argument("--results", default=results_file, help="Binary results file to write")
+    parser.add_argument("--save-baseline", help="Also copy the results to this file as a baseline")
+    parser.add_argument("--compare-baseline", help="Compare the results with this baseline file")
+    parser.add_argument("--regression-threshold", type=float, default=0.25,
+                        help="Relative p50/p99 slowdown against the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios or [] if name not in scenarios]
+    assert not unknown, f"Unknown scenarios {', '.join(unknown)}, use any of {', '.join(scenarios)}"
+    warmup_requests = args.warmup
+    workload_requests = args.workload_requests
+
+    check_environment()
+    load_customer_ids()
+    store = HybridDatastore.from_env(tracing=bool(trace_output or trace_otlp_endpoint))
+    try:
+        # Clients, pools and the first connections are set up before the first timed request
+        store.start()
+        run(args.scenarios)
+    finally:
+        close()
+    if store.tracer.enabled:
+        export_traces()
+
+    # Save the raw latencies and histograms of every scenario into a columnar binary file
+    save_results(args.results, recordings, metadata)
+    if args.save_baseline:
+        save_results(args.save_baseline, recordings, metadata)
+        print(f"Saved the baseline {args.save_baseline}")
+    print_results()
+    if args.compare_baseline and compare_to_baseline(args.compare_baseline, args.regression_threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import itertools
+import threading
+import time
+import psycopg2
+from ConnectionPool import PostgresPool
+
+# Seconds the replica is behind the primary, 0 while it has replayed everything it received
+replica_lag_sql = """
+SELECT pg_is_in_recovery(),
+       CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.healthy = False
+        self.lag = None
+        self.checked_at = 0.0
+
+
+# Routes reads between a primary pool and the pools of N read replicas. A monitor thread checks every replica each
+# health_check_interval seconds and records its replication lag. Sensitive reads (LoyaltyPoints) go to a replica
+# that is at most sensitive_max_lag seconds behind, or to the primary. Other reads are spread round-robin over the
+# healthy replicas at most max_lag behind. Without a usable replica everything goes to the primary.
+class PostgresRouter:
+    def __init__(self, primary, replicas, max_lag=30.0, sensitive_max_lag=1.0, health_check_interval=5.0):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.sensitive_max_lag = sensitive_max_lag
+        self.health_check_interval = health_check_interval
+        self.stats = {'primary_reads': 0, 'replica_reads': 0, 'failovers': 0, 'health_check_failures': 0}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.check()
+        self._monitor = threading.Thread(target=self._run, daemon=True)
+        self._monitor.start()
+
+    @classmethod
+    def from_conn_strings(cls, primary, replica_conn_strings, pool_kwargs=None, **kwargs):
+        # primary is a PostgresPool or a connection string, replica_conn_strings maps a display name to a
+        # connection string, the names end up in logs so they should not contain passwords
+        pool_kwargs = pool_kwargs or {}
+        if isinstance(primary, str):
+            primary = PostgresPool(primary, **pool_kwargs)
+        # Replica pools start empty so a replica that is down does not stop the primary from serving
+        replicas = [Replica(name, PostgresPool(conn_string, **{**pool_kwargs, 'min_size': 0}))
+                    for name, conn_string in replica_conn_strings.items()]
+        return cls(primary, replicas, **kwargs)
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection() as pooled:
+                    cur = pooled.conn.cursor()
+                    cur.execute(replica_lag_sql)
+                    in_recovery, lag = cur.fetchone()
+                    cur.close()
+                replica.lag = float(lag)
+                replica.healthy = True
+                if not in_recovery:
+                    print(f"Replica {replica.name} is not in recovery, it may have been promoted")
+            except Exception as e:
+                if replica.healthy:
+                    print(f"Replica {replica.name} failed its health check: {e}")
+                replica.healthy = False
+                with self._lock:
+                    self.stats['health_check_failures'] += 1
+            replica.checked_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop.wait(self.health_check_interval):
+            self.check()
+
+    def pool_for(self, sensitive=False):
+        limit = self.sensitive_max_lag if sensitive else self.max_lag
+        candidates = [replica for replica in self.replicas if replica.healthy and replica.lag <= limit]
+        with self._lock:
+            if not candidates:
+                self.stats['primary_reads'] += 1
+                return self.primary
+            self.stats['replica_reads'] += 1
+            return candidates[next(self._next) % len(candidates)].pool
+
+    def failed(self, pool):
+        # A replica that could not be reached is skipped until its next successful health check
+        for replica in self.replicas:
+            if replica.pool is pool:
+                replica.healthy = False
+                with self._lock:
+                    self.stats['failovers'] += 1
+
+    def checkout(self, sensitive=False):
+        # Returns (pool, pooled connection), a replica that cannot be connected to fails over to the primary
+        pool = self.pool_for(sensitive)
+        try:
+            return pool, pool.checkout()
+        except psycopg2.OperationalError:
+            if pool is self.primary:
+                raise
+            self.failed(pool)
+            return self.primary, self.primary.checkout()
+
+    def lags(self):
+        return {replica.name: replica.lag if replica.healthy else None for replica in self.replicas}
+
+    def close(self, close_primary=True):
+        self._stop.set()
+        self._monitor.join()
+        for replica in self.replicas:
+            replica.pool.close()
+        if close_primary:
+            self.primary.close()
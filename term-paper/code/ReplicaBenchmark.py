@@ -0,0 +1,156 @@
+import argparse
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from prettytable import PrettyTable
+from Measurement import LatencyHistogram, Recording
+from PostgresRouter import PostgresRouter
+from Workload import Workload
+
+# Read throughput of PostgreSQL with and without read replicas, e.g. a local primary and streaming replica:
+#   docker run -d --name pg-primary -p 5432:5432 -e POSTGRESQL_REPLICATION_MODE=master \
+#       -e POSTGRESQL_REPLICATION_USER=repl -e POSTGRESQL_REPLICATION_PASSWORD=repl \
+#       -e POSTGRESQL_USERNAME=$DATABASE_USERNAME -e POSTGRESQL_PASSWORD=$DATABASE_PASSWORD \
+#       -e POSTGRESQL_DATABASE=$DATABASE_NAME bitnami/postgresql
+#   docker run -d -p 5433:5432 --link pg-primary -e POSTGRESQL_REPLICATION_MODE=slave \
+#       -e POSTGRESQL_MASTER_HOST=pg-primary -e POSTGRESQL_REPLICATION_USER=repl -e POSTGRESQL_REPLICATION_PASSWORD=repl \
+#       -e POSTGRESQL_PASSWORD=$DATABASE_PASSWORD bitnami/postgresql
+#   python term-paper/code/LoadData_RDS.py
+#   python term-paper/code/ReplicaBenchmark.py --primary localhost:5432 --replicas localhost:5433
+lookup_sql = "SELECT firstname, lastname, email FROM customer_info WHERE customerid = $1"
+
+
+def conn_string_for(endpoint):
+    host, _, port = endpoint.partition(":")
+    return f"dbname='{rds_name}' user='{rds_user}' host='{host}' password='{rds_pass}'" + (f" port='{port}'" if port else "")
+
+
+def run_mode(router, mode, customer_ids, threads, total_requests):
+    # primary: every read on the primary, replicas: any replica within max_lag, sensitive: only replicas within
+    # sensitive_max_lag, the way LoyaltyPoints reads are routed
+    operations = list(Workload(customer_ids, distribution='uniform').operations(total_requests))
+    recordings = [Recording() for _ in range(threads)]
+
+    def worker(n):
+        for _, customer_id in operations[n::threads]:
+            start = time.perf_counter_ns()
+            if mode == 'primary':
+                pool, pooled = router.primary, router.primary.checkout()
+            else:
+                pool, pooled = router.checkout(sensitive=mode == 'sensitive')
+            broken = False
+            try:
+                cur = pooled.execute_prepared('lookup', lookup_sql, (customer_id,))
+                cur.fetchone()
+                cur.close()
+            except Exception as e:
+                broken = True
+                print(f"Error reading {customer_id}: {e}")
+            finally:
+                pool.checkin(pooled, broken)
+            recordings[n].record(time.perf_counter_ns() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    histogram = LatencyHistogram()
+    for recording in recordings:
+        histogram.merge(recording.histogram)
+    return {
+        'requests_per_second': histogram.count / elapsed,
+        'p50': histogram.percentile(50),
+        'p99': histogram.percentile(99),
+    }
+
+
+def read_points(pool, customer_id):
+    with pool.connection() as pooled:
+        cur = pooled.conn.cursor()
+        cur.execute("SELECT loyaltypoints FROM customer_info WHERE customerid = %s", (customer_id,))
+        points = cur.fetchone()[0]
+        cur.close()
+    return points
+
+
+def staleness_check(router, customer_ids, trials, timeout=5.0):
+    # Updates LoyaltyPoints on the primary and reads it back right away through both routes. A stale read
+    # returns the value from before the update; for replica reads it also measures how long the update took
+    # to become visible there.
+    stale = {'replicas': 0, 'sensitive': 0}
+    visible_after = []
+    for customer_id in customer_ids[:trials]:
+        with router.primary.connection() as pooled:
+            cur = pooled.conn.cursor()
+            cur.execute("UPDATE customer_info SET loyaltypoints = loyaltypoints + 1 WHERE customerid = %s "
+                        "RETURNING loyaltypoints", (customer_id,))
+            expected = cur.fetchone()[0]
+            cur.close()
+        written = time.perf_counter()
+        for route in stale:
+            if read_points(router.pool_for(sensitive=route == 'sensitive'), customer_id) != expected:
+                stale[route] += 1
+        pool = router.pool_for(sensitive=False)
+        while pool is not router.primary and time.perf_counter() - written < timeout:
+            if read_points(pool, customer_id) == expected:
+                break
+        visible_after.append(time.perf_counter() - written)
+    return stale, max(visible_after, default=0.0)
+
+
+def main(args):
+    replica_endpoints = [endpoint.strip() for endpoint in args.replicas.split(",") if endpoint.strip()]
+    assert replica_endpoints, "Pass at least one replica with --replicas or DATABASE_REPLICA_ENDPOINTS"
+    pool_kwargs = {'max_size': args.threads, 'statements': {'lookup': lookup_sql}}
+    router = PostgresRouter.from_conn_strings(
+        conn_string_for(args.primary), {endpoint: conn_string_for(endpoint) for endpoint in replica_endpoints},
+        pool_kwargs=pool_kwargs, max_lag=args.max_lag, sensitive_max_lag=args.sensitive_max_lag,
+        health_check_interval=1.0)
+    print(f"Replica lag (seconds): {router.lags()}")
+
+    with router.primary.connection() as pooled:
+        cur = pooled.conn.cursor()
+        cur.execute("SELECT customerid FROM customer_info ORDER BY customerid LIMIT %s", (args.items,))
+        customer_ids = [row[0] for row in cur.fetchall()]
+        cur.close()
+
+    results = PrettyTable()
+    results.field_names = ["Routing", "Requests/sec", "p50 (ms)", "p99 (ms)"]
+    for mode in ('primary', 'replicas', 'sensitive'):
+        stats = run_mode(router, mode, customer_ids, args.threads, args.requests)
+        print(f"{mode}: {stats['requests_per_second']:.1f} requests/sec")
+        results.add_row([mode, round(stats['requests_per_second'], 1), round(stats['p50'] / 1e6, 2),
+                         round(stats['p99'] / 1e6, 2)])
+    print(results)
+    print(f"Routing stats: {router.stats}")
+
+    stale, visible_after = staleness_check(router, customer_ids, args.staleness_trials)
+    print(f"Stale reads right after {args.staleness_trials} updates: replica route {stale['replicas']}, "
+          f"sensitive route {stale['sensitive']}")
+    print(f"Longest time until an update was visible on a replica: {visible_after * 1000:.1f} ms")
+    router.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    rds_user = os.getenv("DATABASE_USERNAME")
+    rds_pass = os.getenv("DATABASE_PASSWORD")
+    rds_name = os.getenv("DATABASE_NAME")
+
+    parser = argparse.ArgumentParser(description="Read throughput of PostgreSQL with read replicas")
+    parser.add_argument("--primary", default=os.getenv("DATABASE_ENDPOINT", "localhost"), help="Primary as host or host:port")
+    parser.add_argument("--replicas", default=os.getenv("DATABASE_REPLICA_ENDPOINTS", ""),
+                        help="Comma separated replicas as host or host:port")
+    parser.add_argument("--items", type=int, default=3000, help="Number of customers to read")
+    parser.add_argument("--requests", type=int, default=20000, help="Reads per routing mode")
+    parser.add_argument("--threads", type=int, default=32, help="Concurrent readers")
+    parser.add_argument("--max-lag", type=float, default=float(os.getenv("REPLICA_MAX_LAG", "30")),
+                        help="Replication lag in seconds up to which a replica serves reads")
+    parser.add_argument("--sensitive-max-lag", type=float, default=float(os.getenv("REPLICA_SENSITIVE_MAX_LAG", "1")),
+                        help="Replication lag in seconds up to which a replica serves LoyaltyPoints reads")
+    parser.add_argument("--staleness-trials", type=int, default=100, help="Updates made by the staleness check")
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+import argparse
+import os
+import threading
+import time
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from prettytable import PrettyTable
+from LoadData_NOSQL import read_segment
+from Measurement import LatencyHistogram, Recording
+from ShardRouter import ShardRouter, shards_from_spec
+from Workload import Workload
+
+# Read throughput of the DynamoDB cache over 1..N shards, e.g. several DynamoDB Local instances:
+#   docker run -d -p 8000:8000 amazon/dynamodb-local   (and 8001, 8002, 8003)
+#   python term-paper/code/ShardBenchmark.py --shards http://localhost:8000,http://localhost:8001,http://localhost:8002,http://localhost:8003
+# The items are loaded into the first shard, every further shard is added to the ring and rebalanced into.
+local_sample_data = 'term-paper/data/customer_info_sample.csv'
+
+
+def ensure_table(shard):
+    for endpoint in shard.endpoints:
+        try:
+            endpoint.resource.create_table(
+                TableName=endpoint.table.name,
+                KeySchema=[{'AttributeName': 'CustomerID', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'CustomerID', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            endpoint.table.wait_until_exists()
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceInUseException':
+                raise
+
+
+def run_level(shard_specs, customer_ids, fields, threads, total_requests):
+    # Every thread gets its own router and boto3 resources, built from the same spec so the rings agree
+    routers = [ShardRouter(shards_from_spec(",".join(shard_specs), session, table_name, region)) for _ in range(threads)]
+    operations = list(Workload(customer_ids, distribution='uniform').operations(total_requests))
+    recordings = [Recording() for _ in range(threads)]
+
+    def worker(n):
+        router = routers[n]
+        for _, customer_id in operations[n::threads]:
+            start = time.perf_counter_ns()
+            router.get_item(Key={'CustomerID': customer_id}, ProjectionExpression=fields)
+            recordings[n].record(time.perf_counter_ns() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    histogram = LatencyHistogram()
+    for recording in recordings:
+        histogram.merge(recording.histogram)
+    return {
+        'requests_per_second': histogram.count / elapsed,
+        'p50': histogram.percentile(50),
+        'p99': histogram.percentile(99),
+        'failovers': sum(router.stats['failovers'] for router in routers),
+    }
+
+
+def main(args):
+    shard_specs = [spec.strip() for spec in args.shards.split(",") if spec.strip()]
+    assert shard_specs, "Pass at least one shard with --shards or DYNAMODB_SHARDS"
+    items = [item for _, item in read_segment(args.file, 0, 1, args.items, 0)]
+    customer_ids = [item['CustomerID'] for item in items]
+
+    router = ShardRouter(shards_from_spec(shard_specs[0], session, table_name, region))
+    for shard in router.shards.values():
+        ensure_table(shard)
+    with router.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+    print(f"Loaded {len(items)} items into {shard_specs[0]}")
+
+    results = PrettyTable()
+    results.field_names = ["Shards", "Requests/sec", "p50 (ms)", "p99 (ms)", "Failovers", "Items moved", "Rebalance (s)"]
+    for count in range(1, len(shard_specs) + 1):
+        moved = 0
+        rebalance_time = 0.0
+        if count > 1:
+            shard = shards_from_spec(shard_specs[count - 1], session, table_name, region)[0]
+            ensure_table(shard)
+            start = time.perf_counter()
+            moved = router.add_shard(shard)
+            rebalance_time = time.perf_counter() - start
+            print(f"Added {shard.name}, moved {moved} items in {rebalance_time:.2f} seconds")
+        stats = run_level(shard_specs[:count], customer_ids, args.fields, args.threads, args.requests)
+        print(f"{count} shards: {stats['requests_per_second']:.1f} requests/sec")
+        results.add_row([count, round(stats['requests_per_second'], 1), round(stats['p50'] / 1e6, 2),
+                         round(stats['p99'] / 1e6, 2), stats['failovers'], moved, round(rebalance_time, 2)])
+    print(results)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    # DynamoDB Local accepts any credentials
+    session = boto3.Session(
+        aws_access_key_id=os.getenv("ACCESS_KEY", "local"),
+        aws_secret_access_key=os.getenv("SECRET_KEY", "local"),
+        aws_session_token=os.getenv("SESSION_TOKEN")
+    )
+    table_name = os.getenv("NOSQL_NAME", "customer_info")
+    region = os.getenv("AWS_REGION", "us-east-1")
+
+    parser = argparse.ArgumentParser(description="Read throughput of the sharded DynamoDB cache")
+    parser.add_argument("--shards", default=os.getenv("DYNAMODB_SHARDS", ""),
+                        help="Shard spec as in DYNAMODB_SHARDS, shards are added to the ring one after the other")
+    parser.add_argument("--file", default=local_sample_data, help="CSV file with the items to load")
+    parser.add_argument("--items", type=int, default=3000, help="Number of items to load and read")
+    parser.add_argument("--requests", type=int, default=20000, help="Reads per shard count")
+    parser.add_argument("--threads", type=int, default=32, help="Concurrent readers")
+    parser.add_argument("--fields", default="FirstName, LastName, Email, Address.Street", help="ProjectionExpression of the reads")
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+import threading
+
+
+# Request coalescing for the miss path: concurrent loads of the same key share one call of the loader.
+# The first caller runs it, everyone arriving while it is in flight waits for and shares its result.
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.stats = {'loads': 0, 'coalesced': 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, loader):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['loads'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = loader()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self.stats = {'loads': 0, 'coalesced': 0}
+        self._calls = {}
+
+    async def do(self, key, loader):
+        # Imported here, importing asyncio adds tens of milliseconds to the startup of the threaded SingleFlight users
+        import asyncio
+        future = self._calls.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            # shield so a cancelled waiter does not cancel the load everyone else is waiting for
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.stats['loads'] += 1
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,103 @@
+import argparse
+import csv
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup cost of the hybrid datastore in a fresh process, which every short-lived script pays and a service pays
+# after every deploy: importing HybridDatastore.py, constructing it, start() in eager mode, and the first request
+# next to the steady-state latency of the requests after it. Every run is a new interpreter, so the imports and
+# the connections start cold.
+#   python term-paper/code/StartupBenchmark.py --runs 5 --requests 200
+# lazy creates the clients and pools inside the first request, eager calls start() right after constructing.
+local_sample_data = 'term-paper/data/customer_info_sample.csv'
+modes = ['lazy', 'eager']
+columns = {'import_ms': 'Import (ms)', 'construct_ms': 'Construct (ms)', 'start_ms': 'start() (ms)',
+           'first_request_ms': 'First Request (ms)', 'first_response_ms': 'Time to First Response (ms)',
+           'p50_ms': 'Steady p50 (ms)', 'p99_ms': 'Steady p99 (ms)'}
+
+
+def sample_ids(count):
+    # The first customers of the sample data, cached by LoadData_NOSQL.py, so every request is a DynamoDB hit
+    with open(local_sample_data, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)
+        return [row[0] for _, row in zip(range(count), reader)]
+
+
+def measure_startup(mode, requests, fields):
+    # Runs in the child process, nothing of the datastore may be imported before the clock starts
+    timings = {}
+    start = time.perf_counter()
+    from HybridDatastore import HybridDatastore
+    timings['import_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    store = HybridDatastore.from_env()
+    timings['construct_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    if mode == 'eager':
+        store.start()
+    timings['start_ms'] = (time.perf_counter() - start) * 1000
+
+    from Measurement import Recording
+    recording = Recording()
+    customer_ids = sample_ids(requests + 1)
+    try:
+        for i, customer_id in enumerate(customer_ids):
+            start = time.perf_counter_ns()
+            store.get_customer_data_fields(customer_id, list(fields))
+            end = time.perf_counter_ns()
+            if i == 0:
+                timings['first_request_ms'] = (end - start) / 1e6
+            else:
+                recording.record(end - start)
+    finally:
+        store.close()
+    timings['first_response_ms'] = sum(timings[stat] for stat in ['import_ms', 'construct_ms', 'start_ms', 'first_request_ms'])
+    summary = recording.histogram.summary()
+    timings['p50_ms'] = summary['p50'] / 1e6
+    timings['p99_ms'] = summary['p99'] / 1e6
+    return timings
+
+
+def run_child(mode, args):
+    result = subprocess.run([sys.executable, __file__, '--child', mode, '--requests', str(args.requests),
+                             '--fields', ",".join(args.fields)], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stdout + result.stderr)
+        raise RuntimeError(f"The {mode} run failed with status {result.returncode}")
+    # The datastore may print before the timings, they are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    from prettytable import PrettyTable
+    from HybridDatastore import check_environment
+    check_environment()
+    results = PrettyTable()
+    results.field_names = ["Mode"] + list(columns.values())
+    for mode in modes:
+        runs = []
+        for run in range(args.runs):
+            runs.append(run_child(mode, args))
+            print(f"{mode} run {run + 1}: {runs[-1]}")
+        # The median of every column over the runs
+        results.add_row([mode] + [round(statistics.median(timings[stat] for timings in runs), 3) for stat in columns])
+    print(f"Startup of the hybrid datastore, median of {args.runs} fresh processes per mode:")
+    print(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construction and first-request latency of the hybrid datastore")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per mode")
+    parser.add_argument("--requests", type=int, default=200, help="Requests after the first one, timed as the steady state")
+    parser.add_argument("--fields", type=lambda value: value.split(","), default=['FirstName', 'LastName', 'Email', 'Street'],
+                        help="Comma separated fields of every request")
+    parser.add_argument("--child", choices=modes, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure_startup(args.child, args.requests, args.fields)))
+    else:
+        main(args)
@@ -0,0 +1,160 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from Measurement import LatencyHistogram
+
+# OTLP span kinds and status codes
+kind_internal = 1
+kind_client = 3
+status_error = 2
+
+
+class Span:
+    def __init__(self, trace_id, span_id, parent_span_id, name, kind, attributes):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start_unix_ns = time.time_ns()
+        self.start_ns = time.perf_counter_ns()
+        self.duration_ns = 0
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_unix_ns),
+            'endTimeUnixNano': str(self.start_unix_ns + self.duration_ns),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': status_error, 'message': self.error} if self.error else {},
+        }
+        if self.parent_span_id:
+            span['parentSpanId'] = self.parent_span_id
+        return span
+
+
+class NullSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+null_span = NullSpan()
+# Marks a trace that was not sampled, so none of its child spans are recorded either
+not_sampled = object()
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+# Records nested timing spans per thread and exports them as OTLP/JSON (the body of a POST to /v1/traces).
+# A disabled tracer hands out a no-op span, so the instrumentation can stay in the hot path. sample_rate applies
+# to whole traces, max_spans bounds the spans kept for export, the per-name summary covers every sampled span.
+class Tracer:
+    def __init__(self, service_name='hybrid-datastore', enabled=True, sample_rate=1.0, max_spans=100000):
+        self.service_name = service_name
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.histograms = {}
+        self.capacity_units = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, kind=kind_internal, **attributes):
+        if not self.enabled:
+            yield null_span
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is not_sampled:
+            yield null_span
+            return
+        if parent is None and random.random() >= self.sample_rate:
+            stack.append(not_sampled)
+            try:
+                yield null_span
+            finally:
+                stack.pop()
+            return
+        span = Span(parent.trace_id if parent else os.urandom(16).hex(), os.urandom(8).hex(),
+                    parent.span_id if parent else None, name, kind, attributes)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration_ns = time.perf_counter_ns() - span.start_ns
+            stack.pop()
+            self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            self.histograms.setdefault(span.name, LatencyHistogram()).record(span.duration_ns)
+            units = span.attributes.get('aws.dynamodb.consumed_capacity_units')
+            if units is not None:
+                self.capacity_units[span.name] = self.capacity_units.get(span.name, 0) + units
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def record_capacity(self, span, response):
+        # ConsumedCapacity is a dict for single item calls and a list of per-table dicts for batch calls
+        consumed = response.get('ConsumedCapacity') if response else None
+        if consumed:
+            consumed = consumed if isinstance(consumed, list) else [consumed]
+            span.set_attribute('aws.dynamodb.consumed_capacity_units', sum(c.get('CapacityUnits', 0) for c in consumed))
+
+    def summary(self):
+        with self._lock:
+            return {name: {**histogram.summary(), 'capacity_units': self.capacity_units.get(name, 0)}
+                    for name, histogram in sorted(self.histograms.items())}
+
+    def to_otlp(self):
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'Tracing.py'}, 'spans': spans}],
+        }]}
+
+    def export(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_otlp(), file)
+
+    def export_otlp_http(self, endpoint):
+        # endpoint is an OTLP/HTTP receiver such as a local collector on http://localhost:4318
+        # urllib.request pulls in http.client and ssl, it is only imported when spans are exported
+        import urllib.request
+        request = urllib.request.Request(endpoint.rstrip('/') + '/v1/traces', data=json.dumps(self.to_otlp()).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
@@ -0,0 +1,188 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from datetime import date, timedelta
+from AccessLog import most_accessed
+from CachePolicy import ttl_attribute
+from HybridDatastore import HybridDatastore, check_environment, flag, row_to_customer_data
+from LoadData_NOSQL import AdaptiveBackoff, write_chunk
+
+# Preloads the DynamoDB tier after a deploy or a table recreate, so the first requests do not all pay the miss
+# path. The candidates are the customers read most often in an access log written by PerformanceEval.py
+# (ACCESS_LOG), or the customers with the latest LastPurchaseDate. Their rows are streamed from PostgreSQL with a
+# server-side cursor and written by parallel batch writers, together limited to --rate items per second.
+#   python term-paper/code/WarmCache.py --source access-log --since-days 1 --limit 50000 --rate 500
+access_log_file = 'term-paper/data/access_log.csv'
+cursor_name = 'warm_cache_candidates'
+recency_index_sql = "CREATE INDEX IF NOT EXISTS customer_info_lastpurchasedate ON customer_info (lastpurchasedate)"
+
+
+# Token bucket shared by all writers. A writer takes the tokens of a whole batch at once and sleeps off any
+# deficit, so the writers together never exceed rate items per second on average.
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate or 0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - count
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+def stream_rows(conn, customer_ids=None, since=None, limit=None, itersize=2000):
+    # Yields customer_info rows through a server-side cursor, only itersize rows are held in memory at a time.
+    # Candidates from an access log keep their order, most read first, customers missing in PostgreSQL are
+    # skipped. Without candidates the latest purchasers come first, optionally only those since a date.
+    try:
+        with conn.cursor(name=cursor_name) as cur:
+            cur.itersize = itersize
+            if customer_ids is not None:
+                cur.execute("SELECT c.* FROM unnest(%s::varchar[]) WITH ORDINALITY AS candidates (customerid, rank) "
+                            "JOIN customer_info c ON c.customerid = candidates.customerid ORDER BY candidates.rank",
+                            (list(customer_ids),))
+            else:
+                sql = "SELECT * FROM customer_info WHERE lastpurchasedate IS NOT NULL"
+                params = []
+                if since:
+                    sql += " AND lastpurchasedate >= %s"
+                    params.append(since)
+                sql += " ORDER BY lastpurchasedate DESC, customerid"
+                if limit:
+                    sql += " LIMIT %s"
+                    params.append(limit)
+                cur.execute(sql, params)
+            for result in cur:
+                yield result
+    finally:
+        # A named cursor lives in a transaction, end it so the connection does not sit idle in one
+        conn.rollback()
+
+
+def warm(conn, tables, customer_ids=None, since=None, limit=None, batch_size=100, rate=None, itersize=2000,
+         codec=None, ttl=None):
+    # Writes the candidate rows into DynamoDB with one writer thread per table (boto3 resources are not thread
+    # safe) and returns (warmed CustomerIDs, stats). The queue between the cursor and the writers is bounded, so
+    # reading never runs far ahead of the rate limit. BatchWriteItem cannot carry conditions, the rows were just
+    # read from PostgreSQL and overwrite whatever is cached.
+    chunks = queue.Queue(maxsize=len(tables) * 2)
+    limiter = RateLimiter(rate)
+    backoff = AdaptiveBackoff()
+    warmed = [[] for _ in tables]
+    errors = []
+
+    def writer(i):
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if errors:
+                continue
+            try:
+                limiter.acquire(len(chunk))
+                write_chunk(tables[i], chunk, backoff)
+                warmed[i].extend(item['CustomerID'] for item in chunk)
+            except Exception as e:
+                errors.append(e)
+                print(f"Writer {i} failed, stopping the warm-up: {e}")
+
+    start = time.time()
+    last_report = start
+    read = 0
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(len(tables))]
+    for thread in threads:
+        thread.start()
+    try:
+        chunk = []
+        for result in stream_rows(conn, customer_ids, since, limit, itersize):
+            item = row_to_customer_data(result)
+            if ttl:
+                item[ttl_attribute] = int(time.time() + ttl)
+            chunk.append(codec.encode(item) if codec else item)
+            read += 1
+            if len(chunk) >= batch_size:
+                chunks.put(chunk)
+                chunk = []
+                if errors:
+                    break
+            if limit and read >= limit:
+                break
+            if time.time() - last_report >= 5:
+                last_report = time.time()
+                written = sum(len(ids) for ids in warmed)
+                print(f"{written} items warmed, {written / (last_report - start):.1f} items/sec")
+        if chunk and not errors:
+            chunks.put(chunk)
+    finally:
+        for _ in threads:
+            chunks.put(None)
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - start
+    warmed_ids = [customer_id for ids in warmed for customer_id in ids]
+    stats = {'read': read, 'warmed': len(warmed_ids), 'seconds': round(elapsed, 3),
+             'items_per_second': round(len(warmed_ids) / elapsed, 1) if elapsed else 0.0,
+             'throttled_chunks': backoff.throttles, 'errors': len(errors)}
+    return warmed_ids, stats
+
+
+if __name__ == "__main__":
+    check_environment()
+
+    parser = argparse.ArgumentParser(description="Preload the DynamoDB tier with the customers most likely to be read")
+    parser.add_argument("--source", choices=['access-log', 'recency'], default='access-log',
+                        help="Pick the most read customers of an access log or the latest purchasers")
+    parser.add_argument("--access-log", default=os.getenv("ACCESS_LOG", access_log_file),
+                        help="Access log written by PerformanceEval.py, defaults to ACCESS_LOG")
+    parser.add_argument("--since-days", type=float,
+                        help="Only count reads, or purchases with --source recency, of the last N days")
+    parser.add_argument("--limit", type=int, default=1000, help="Number of customers to warm, 0 warms all candidates")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel batch writers")
+    parser.add_argument("--batch-size", type=int, default=100, help="Items handed to a writer at a time")
+    parser.add_argument("--rate", type=float, default=0, help="Items written per second by all writers together, 0 is unlimited")
+    parser.add_argument("--itersize", type=int, default=2000, help="Rows fetched per round trip of the server-side cursor")
+    parser.add_argument("--ttl", type=float, default=float(os.getenv("CACHE_TTL")) if os.getenv("CACHE_TTL") else None,
+                        help="Stamp the items with the ExpiresAt TTL attribute, defaults to CACHE_TTL")
+    parser.add_argument("--create-index", action="store_true",
+                        help="Index lastpurchasedate first, so --source recency does not sort the whole table")
+    parser.add_argument("--shards", default=os.getenv("DYNAMODB_SHARDS"),
+                        help="Shard spec as in DYNAMODB_SHARDS, defaults to that variable")
+    parser.add_argument("--compact", action="store_true", default=flag(os.getenv("COMPACT_ITEMS") or "0"),
+                        help="Store the items in the compact format of ItemCodec.py, defaults to COMPACT_ITEMS")
+    args = parser.parse_args()
+
+    store = HybridDatastore.from_env(dynamodb_shards=args.shards or None, compact_items=args.compact, cache_ttl=args.ttl)
+    tables = [store.new_table() for _ in range(args.workers)]
+
+    customer_ids = None
+    since = None
+    if args.source == 'access-log':
+        customer_ids = most_accessed(args.access_log, args.limit,
+                                     time.time() - args.since_days * 86400 if args.since_days else None)
+        print(f"{len(customer_ids)} candidates from {args.access_log}")
+    elif args.since_days:
+        since = date.today() - timedelta(days=args.since_days)
+
+    conn = store.connect()
+    try:
+        if args.create_index:
+            with conn.cursor() as cur:
+                cur.execute(recency_index_sql)
+            conn.commit()
+        warmed_ids, stats = warm(conn, tables, customer_ids, since, args.limit, args.batch_size, args.rate, args.itersize,
+                                 store.item_codec, store.cache_ttl)
+        print(f"Warmed {stats['warmed']} of {stats['read']} candidate rows in {stats['seconds']} seconds "
+              f"({stats['items_per_second']} items/sec, {stats['throttled_chunks']} throttled chunks)")
+    finally:
+        conn.close()
+        store.close()
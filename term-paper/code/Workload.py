@@ -0,0 +1,67 @@
+import bisect
+import random
+
+
+# Seeded generator of read/update operations over a set of customer IDs.
+# distribution is 'uniform', 'zipf' (popularity of rank r proportional to 1 / r ** skew) or 'hotspot'
+# (hot_fraction of the operations go to the hot_set_size most popular customers). With shift_every set, the
+# popularity ranking rotates by shift_size customers after every shift_every operations, moving the hot set.
+class Workload:
+    def __init__(self, customer_ids, distribution='zipf', skew=0.99, read_ratio=1.0, hot_set_size=None,
+                 hot_fraction=0.9, shift_every=None, shift_size=None, seed=42):
+        assert distribution in ('uniform', 'zipf', 'hotspot'), f"Unknown distribution '{distribution}'"
+        assert 0 <= read_ratio <= 1, "read_ratio must be between 0 and 1"
+        self.distribution = distribution
+        self.skew = skew
+        self.read_ratio = read_ratio
+        self.hot_set_size = hot_set_size or max(1, len(customer_ids) // 10)
+        self.hot_fraction = hot_fraction
+        self.shift_every = shift_every
+        self.shift_size = shift_size or self.hot_set_size
+        self.seed = seed
+        # Popularity ranks are assigned to a seeded shuffle of the IDs, so the hot customers are not the first rows
+        self.ranked_ids = list(customer_ids)
+        random.Random(seed).shuffle(self.ranked_ids)
+        if distribution == 'zipf':
+            weights = [1 / rank ** skew for rank in range(1, len(self.ranked_ids) + 1)]
+            total = sum(weights)
+            self.cdf = []
+            cumulative = 0.0
+            for weight in weights:
+                cumulative += weight / total
+                self.cdf.append(cumulative)
+
+    def describe(self):
+        if self.distribution == 'zipf':
+            name = f"zipf (skew {self.skew})"
+        elif self.distribution == 'hotspot':
+            name = f"hotspot ({self.hot_fraction:.0%} to {self.hot_set_size} customers)"
+        else:
+            name = "uniform"
+        if self.shift_every:
+            name += f", hot set shifts every {self.shift_every}"
+        if self.read_ratio < 1:
+            name += f", {self.read_ratio:.0%} reads"
+        return name
+
+    def sample_rank(self, rng):
+        n = len(self.ranked_ids)
+        if self.distribution == 'uniform':
+            return rng.randrange(n)
+        if self.distribution == 'hotspot':
+            if rng.random() < self.hot_fraction:
+                return rng.randrange(min(self.hot_set_size, n))
+            return rng.randrange(n)
+        return min(bisect.bisect_left(self.cdf, rng.random()), n - 1)
+
+    def operations(self, count):
+        # Yields (operation, customer_id) with operation 'read' or 'update', the same seed gives the same sequence
+        rng = random.Random(self.seed)
+        n = len(self.ranked_ids)
+        offset = 0
+        for i in range(count):
+            if self.shift_every and i and i % self.shift_every == 0:
+                offset = (offset + self.shift_size) % n
+            customer_id = self.ranked_ids[(self.sample_rank(rng) + offset) % n]
+            operation = 'read' if rng.random() < self.read_ratio else 'update'
+            yield operation, customer_id
@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+
+
+# Bounded write-behind queue. submit() hands an item to background writer threads and returns at once, a newer
+# item for a key that is still queued replaces the older one. When the queue is full the caller writes inline,
+# so the number of writes waiting in memory never exceeds max_pending.
+# A write that raises is retried up to retries times with exponential backoff, unless a newer item for its key
+# was submitted meanwhile. An item that still fails is handed to on_drop.
+class WriteBehind:
+    def __init__(self, write, max_pending=1000, workers=2, retries=0, retry_delay=0.1, on_drop=None):
+        self.write = write
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_drop = on_drop
+        self.stats = {'submitted': 0, 'written': 0, 'coalesced': 0, 'inline': 0, 'errors': 0, 'retries': 0,
+                      'superseded': 0, 'dropped': 0}
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, item):
+        assert not self._closed, "WriteBehind is closed"
+        with self._lock:
+            self.stats['submitted'] += 1
+            if key in self._pending:
+                self._pending[key] = item
+                self.stats['coalesced'] += 1
+                return
+            self._pending[key] = item
+        try:
+            self._queue.put_nowait(key)
+        except queue.Full:
+            with self._lock:
+                item = self._pending.pop(key)
+                self.stats['inline'] += 1
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            self._write(key, item)
+
+    def is_pending(self, key):
+        # True while a write for the key is queued, being written or retried
+        with self._lock:
+            return key in self._pending or key in self._in_flight
+
+    def _write(self, key, item):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.write(item)
+                    with self._lock:
+                        self.stats['written'] += 1
+                    return
+                except Exception as e:
+                    error = e
+                    with self._lock:
+                        self.stats['errors'] += 1
+                        superseded = key in self._pending
+                        if superseded:
+                            self.stats['superseded'] += 1
+                        elif attempt < self.retries:
+                            self.stats['retries'] += 1
+                    # The newer item is queued and will be written instead
+                    if superseded:
+                        return
+                    if attempt < self.retries:
+                        time.sleep(self.retry_delay * 2 ** attempt)
+            with self._lock:
+                self.stats['dropped'] += 1
+            print(f"Error in write-behind: {error}")
+            if self.on_drop:
+                try:
+                    self.on_drop(item)
+                except Exception as e:
+                    print(f"Error handling a dropped write-behind item: {e}")
+        finally:
+            with self._lock:
+                self._in_flight[key] -= 1
+                if not self._in_flight[key]:
+                    del self._in_flight[key]
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if key is None:
+                    return
+                with self._lock:
+                    item = self._pending.pop(key)
+                    self._in_flight[key] = self._in_flight.get(key, 0) + 1
+                self._write(key, item)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        # Blocks until every submitted item has been written
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
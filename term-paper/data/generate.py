@@ -1,51 +1,124 @@
+import argparse
 import csv
+import math
+import os
 import random
-from datetime import datetime, timedelta
-
-def str_time_prop(start, end, format, prop):
-    stime = datetime.strptime(start, format)
-    etime = datetime.strptime(end, format)
-    ptime = stime + prop * (etime - stime)
-    return ptime.strftime(format)
-
-def random_date(start, end, prop):
-    return str_time_prop(start, end, '%Y-%m-%d', prop)
-
-def generate_sample_data(num_records, file_path):
-    # Ensure that customer IDs and emails are unique
-    used_customer_ids = set()
-    used_emails = set()
-    
-    with open(file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["CustomerID", "FirstName", "LastName", "Email", "PhoneNumber", "Street", "City", "State", "PostalCode", "DateOfBirth", "AccountCreationDate", "LastPurchaseDate", "LoyaltyPoints"])
-        
-        while len(used_customer_ids) < num_records:
-            customer_id = f"CID{random.randint(10000, 99999)}"
-            if customer_id in used_customer_ids:
-                continue
-            
-            first_name = f"First{random.randint(1, 100)}"
-            last_name = f"Last{random.randint(1, 100)}"
-            email = f"{first_name.lower()}_{last_name.lower()}@example.com"
-            
-            if email in used_emails:
-                continue  
-            
-            phone_number = f"{random.randint(100, 999)}-{random.randint(100, 999)}-{random.randint(1000, 9999)}"
-            street = f"{random.randint(1, 9999)} Main St"
-            city = "City" + str(random.randint(1, 100))
-            state = "State" + str(random.randint(1, 50))
-            postal_code = f"{random.randint(10000, 99999)}"
-            date_of_birth = random_date("1950-01-01", "2010-12-31", random.random())
-            account_creation_date = random_date("2015-01-01", "2023-01-01", random.random())
-            last_purchase_date = random_date("2023-01-01", "2024-01-01", random.random())
-            loyalty_points = random.randint(0, 10000)
-            
-            writer.writerow([customer_id, first_name, last_name, email, phone_number, street, city, state, postal_code, date_of_birth, account_creation_date, last_purchase_date, loyalty_points])
-            
-            used_customer_ids.add(customer_id)
-            used_emails.add(email)
-
-sample_file_path = 'term-paper/data/customer_info_sample.csv'
-generate_sample_data(3000, sample_file_path)
+from datetime import date
+from multiprocessing import Pool
+
+columns = ["CustomerID", "FirstName", "LastName", "Email", "PhoneNumber", "Street", "City", "State", "PostalCode",
+           "DateOfBirth", "AccountCreationDate", "LastPurchaseDate", "LoyaltyPoints"]
+
+
+def random_date(rng, start, end):
+    return date.fromordinal(rng.randint(start.toordinal(), end.toordinal()))
+
+
+def id_permutation(num_records, seed):
+    # i -> (multiplier * i + increment) % num_records is a bijection when multiplier and num_records are coprime,
+    # so every row gets a distinct number without remembering the ones already used
+    rng = random.Random(seed)
+    multiplier = rng.randrange(num_records // 2 + 1, num_records + 1) if num_records > 1 else 1
+    while math.gcd(multiplier, num_records) != 1:
+        multiplier += 1
+    return multiplier, rng.randrange(num_records) if num_records else 0
+
+
+def generate_chunk(spec):
+    # Rows [start, end) of the data set, each chunk has its own seeded generator so output does not depend on
+    # which worker generated it
+    start, end, num_records, multiplier, increment, seed = spec
+    rng = random.Random(f"{seed}-{start}")
+    rows = []
+    for i in range(start, end):
+        number = (multiplier * i + increment) % num_records
+        customer_id = f"CID{10000 + number}"
+        first_name = f"First{rng.randint(1, 100)}"
+        last_name = f"Last{rng.randint(1, 100)}"
+        # The customer number keeps emails unique however many rows share a name
+        email = f"{first_name.lower()}_{last_name.lower()}_{number}@example.com"
+        phone_number = f"{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        street = f"{rng.randint(1, 9999)} Main St"
+        city = "City" + str(rng.randint(1, 100))
+        state = "State" + str(rng.randint(1, 50))
+        postal_code = f"{rng.randint(10000, 99999)}"
+        date_of_birth = random_date(rng, date(1950, 1, 1), date(2010, 12, 31))
+        account_creation_date = random_date(rng, date(2015, 1, 1), date(2023, 1, 1))
+        last_purchase_date = random_date(rng, date(2023, 1, 1), date(2024, 1, 1))
+        loyalty_points = rng.randint(0, 10000)
+        rows.append([customer_id, first_name, last_name, email, phone_number, street, city, state, postal_code,
+                     date_of_birth, account_creation_date, last_purchase_date, loyalty_points])
+    return rows
+
+
+class CsvChunkWriter:
+    def __init__(self, file_path):
+        self.file = open(file_path, mode='w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter:
+    def __init__(self, file_path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow, install it with 'pip install pyarrow'")
+        self.pa = pa
+        date_columns = {"DateOfBirth", "AccountCreationDate", "LastPurchaseDate"}
+        self.schema = pa.schema([(name, pa.date32() if name in date_columns else
+                                  pa.int32() if name == "LoyaltyPoints" else pa.string()) for name in columns])
+        self.writer = pq.ParquetWriter(file_path, self.schema)
+
+    def write(self, rows):
+        # Each chunk becomes one row group
+        arrays = [self.pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def generate_sample_data(num_records, file_path, file_format='csv', workers=1, chunk_size=100000, seed=42):
+    multiplier, increment = id_permutation(num_records, seed)
+    specs = [(start, min(start + chunk_size, num_records), num_records, multiplier, increment, seed)
+             for start in range(0, num_records, chunk_size)]
+    writer = ParquetChunkWriter(file_path) if file_format == 'parquet' else CsvChunkWriter(file_path)
+    written = 0
+    try:
+        if workers <= 1:
+            for spec in specs:
+                writer.write(generate_chunk(spec))
+                written += spec[1] - spec[0]
+        else:
+            # Chunks are handed out in windows so at most 2 * workers chunks are held in memory at once,
+            # imap keeps them in order so the output is the same for any number of workers
+            window = workers * 2
+            with Pool(workers) as pool:
+                for window_start in range(0, len(specs), window):
+                    for rows in pool.imap(generate_chunk, specs[window_start:window_start + window]):
+                        writer.write(rows)
+                        written += len(rows)
+                    print(f"{written} of {num_records} rows written")
+    finally:
+        writer.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate unique, reproducible customer_info sample data")
+    parser.add_argument("--rows", type=int, default=3000, help="Number of rows to generate")
+    parser.add_argument("--output", default='term-paper/data/customer_info_sample.csv', help="Output file")
+    parser.add_argument("--format", choices=['csv', 'parquet'], default='csv', help="Output format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Rows generated per chunk")
+    parser.add_argument("--seed", type=int, default=42, help="Seed, the same seed and row count give the same file")
+    args = parser.parse_args()
+    generate_sample_data(args.rows, args.output, args.format, args.workers, args.chunk_size, args.seed)